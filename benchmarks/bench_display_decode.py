@@ -0,0 +1,115 @@
+"""
+Compare the display path before and after reduced-resolution decoding: latency per image and peak memory.
+
+The old path decodes the full resolution image, rotates it by guessing from width and height, and then scales it
+down. The new path (metaedit.decode_display_img) lets the JPEG decoder scale down while decoding and applies the
+EXIF orientation after downscaling. Every mode runs in its own process so the peak RSS numbers don't mix.
+
+usage: python benchmarks/bench_display_decode.py [--count 10] [--width 6000] [--height 4000]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_images(directory, count, width, height):
+    import piexif
+    from PIL import Image
+
+    template = os.path.join(directory, "template.jpg")
+    exif_bytes = piexif.dump({"0th": {piexif.ImageIFD.Orientation: 6}})
+    Image.effect_noise((width, height), 64).convert("RGB").save(template, exif=exif_bytes, quality=90)
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"img_{i:06d}.jpg")
+        shutil.copyfile(template, path)
+        paths.append(path)
+    return paths
+
+
+def legacy_display_img(path, max_scaled_height=500):
+    # the display path as it was before draft decoding
+    from PIL import Image
+
+    with Image.open(path) as image:
+        if image.size[0] > image.size[1]:
+            image = image.rotate(270)
+        scaled_height = image.size[1] / max_scaled_height
+        new_width = int(image.size[0] / scaled_height)
+        new_height = int(image.size[1] / scaled_height)
+        return image.resize((new_width, new_height), Image.LANCZOS)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_mode(mode, paths):
+    from PIL import Image  # noqa: F401  (imported before the baseline in both modes)
+
+    sys.path.insert(0, REPO_DIR)
+    if mode == "legacy":
+        decode = legacy_display_img
+    else:
+        from metaedit import decode_display_img as decode
+
+    baseline_mb = peak_rss_mb()
+    start = time.perf_counter()
+    for path in paths:
+        image = decode(path)
+        size = image.size
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "mode": mode,
+        "ms_per_image": elapsed / len(paths) * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_increase_mb": peak_rss_mb() - baseline_mb,
+        "displayed_size": size,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--mode", choices=["legacy", "draft"], help=argparse.SUPPRESS)
+    parser.add_argument("paths", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.paths)
+        return
+
+    directory = tempfile.mkdtemp(prefix="metaedit_bench_")
+    try:
+        paths = make_images(directory, args.count, args.width, args.height)
+        results = {}
+        for mode in ("legacy", "draft"):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--mode", mode] + paths,
+                check=True, capture_output=True, text=True
+            ).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+            print(f"{mode:<8} {results[mode]['ms_per_image']:8.1f} ms/image   "
+                  f"peak RSS {results[mode]['peak_rss_mb']:.0f} MB "
+                  f"(+{results[mode]['peak_rss_increase_mb']:.0f} MB while decoding)   "
+                  f"displayed {results[mode]['displayed_size']}")
+        print(f"speedup: {results['legacy']['ms_per_image'] / results['draft']['ms_per_image']:.1f}x")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
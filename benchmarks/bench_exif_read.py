@@ -0,0 +1,82 @@
+"""
+Compare reading the ImageDescription field through PIL (Image.open + getexif) with the header-only reader.
+
+usage: python benchmarks/bench_exif_read.py [--count 500] [--width 3000] [--height 2000]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import piexif
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metaexif  # noqa: E402
+
+
+def make_images(directory, count, width, height):
+    # every file is a copy of one encoded image, so generating the set stays fast even for big sizes
+    template = os.path.join(directory, "template.jpg")
+    description = json.dumps({
+        "people": "Alice Smith, Bob Smith",
+        "location": "Lake Tahoe",
+        "date": "Summer 1962",
+        "group": "Smith family",
+        "comment": "Cabin trip",
+    })
+    exif_bytes = piexif.dump({"0th": {piexif.ImageIFD.ImageDescription: description}})
+    Image.effect_noise((width, height), 64).convert("RGB").save(template, exif=exif_bytes, quality=90)
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"img_{i:06d}.jpg")
+        shutil.copyfile(template, path)
+        paths.append(path)
+    return paths
+
+
+def read_with_pil(path):
+    with Image.open(path) as image:
+        return image.getexif().get(piexif.ImageIFD.ImageDescription)
+
+
+def bench(label, reader, paths):
+    start = time.perf_counter()
+    for path in paths:
+        reader(path)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {len(paths)} files in {elapsed:.3f}s "
+          f"({len(paths) / elapsed:.0f} files/s, {elapsed / len(paths) * 1e6:.1f} us/file)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--width", type=int, default=3000)
+    parser.add_argument("--height", type=int, default=2000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="metaedit_bench_")
+    try:
+        paths = make_images(directory, args.count, args.width, args.height)
+
+        # make sure both readers agree before timing them
+        assert read_with_pil(paths[0]) == metaexif.read_image_description(paths[0])
+
+        # warm the page cache so both paths are measured on the same footing
+        bench("warmup", metaexif.read_image_description, paths)
+        pil_time = bench("PIL", read_with_pil, paths)
+        header_time = bench("header-only", metaexif.read_image_description, paths)
+        print(f"speedup: {pil_time / header_time:.1f}x")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
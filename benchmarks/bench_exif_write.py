@@ -0,0 +1,92 @@
+"""
+Compare saving the ImageDescription field with piexif.insert (rewrites the whole file) against metaexif's writer,
+which patches the value in place when it fits and otherwise rewrites the file atomically.
+
+usage: python benchmarks/bench_exif_write.py [--count 20] [--width 6000] [--height 4000]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import piexif
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metaexif  # noqa: E402
+
+
+def make_images(directory, count, width, height):
+    template = os.path.join(directory, "template.jpg")
+    description = json.dumps({"people": "Alice Smith", "location": "Lake Tahoe"})
+    exif_bytes = piexif.dump({"0th": {piexif.ImageIFD.ImageDescription: description}})
+    Image.effect_noise((width, height), 64).convert("RGB").save(template, exif=exif_bytes, quality=95)
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"img_{i:06d}.jpg")
+        shutil.copyfile(template, path)
+        paths.append(path)
+    return paths
+
+
+def write_with_piexif(path, description):
+    # what write_input() used to do on every key press
+    exif_dict = piexif.load(path)
+    exif_dict["0th"][piexif.ImageIFD.ImageDescription] = json.dumps(description)
+    piexif.insert(piexif.dump(exif_dict), path)
+
+
+def sync():
+    # flush dirty pages between runs so one writer's fsync doesn't pay for another's writes (unix only)
+    if hasattr(os, "sync"):
+        os.sync()
+
+
+def bench(label, writer, paths, description):
+    start = time.perf_counter()
+    for path in paths:
+        writer(path, description)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed / len(paths) * 1000:8.2f} ms/save")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="metaedit_bench_")
+    try:
+        paths = make_images(directory, args.count, args.width, args.height)
+        print(f"{args.count} files of {os.path.getsize(paths[0]) / 1e6:.1f} MB")
+
+        description = {"people": "Alice Smith, Bob Smith", "location": "Lake Tahoe", "date": "Summer 1962"}
+        sync()
+        piexif_time = bench("piexif.insert", write_with_piexif, paths, description)
+
+        # the first save through metaexif has to grow the value, which rewrites the file and adds padding
+        description["comment"] = "Cabin trip with the whole family"
+        sync()
+        bench("metaexif (atomic rewrite)", metaexif.write_image_description, paths, description)
+
+        description["comment"] = "Cabin trip"
+        sync()
+        patch_time = bench("metaexif (in-place patch)", metaexif.write_image_description, paths, description)
+        print(f"in-place speedup over piexif.insert: {piexif_time / patch_time:.0f}x")
+
+        for path in paths:
+            assert json.loads(metaexif.read_image_description(path)) == description
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
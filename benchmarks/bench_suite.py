@@ -0,0 +1,444 @@
+"""
+Benchmark suite over a synthetic library (see synthlib.py). Runs headless: it times the functions the editor's
+Tk callbacks are built on, the way those callbacks use them:
+
+- discover: metascan.scan_images() over the library (pick_path)
+- index_cold / index_warm: metaindex.index_batch() on the indexing pool plus the sqlite writes (index_images),
+  first without an index file, then against it with nothing changed
+- duplicate_hashing: metadupes.hash_images() over the indexed images plus the sqlite writes, the pass the editor
+  runs the first time duplicates are looked for (hashes_ready)
+- duplicates_of / duplicate_groups: metadupes.HashIndex searches over the hashes in the index, for every image and
+  for the whole library (show_duplicates / show_all_duplicates); the groups found are checked against the
+  near-duplicates synthlib made
+- filter_*: SearchIndex queries of different selectivity, and typing a location one character at a time through
+  the incremental refine path (filter_images)
+- index_memory: memory held by the SearchIndex of the library (bytes_per_image), measured with tracemalloc
+- save_patch / save_rewrite: metaexif.write_image_description() when the edit fits in place and when it does not
+  (write_input + flush_pending_writes)
+- display_decode: metaedit.decode_display_img(), i.e. get_parsed_img + resize_img (load_img on a cache miss)
+- export_copy / export_uptodate / export_zip: metaexport (export_images)
+
+Results are printed as JSON (one document: environment, parameters and one entry per benchmark), so runs can be
+stored and compared to catch regressions. Progress goes to stderr.
+
+usage: python benchmarks/bench_suite.py [--count 2000] [--width 1600] [--height 1200] [--repeat 3]
+                                        [--only index_cold,filter] [--output results.json] [--keep DIR]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import PIL  # noqa: E402
+
+import metaexif  # noqa: E402
+import metadupes  # noqa: E402
+import metaexport  # noqa: E402
+import metaindex  # noqa: E402
+import metascan  # noqa: E402
+import metasearch  # noqa: E402
+import synthlib  # noqa: E402
+
+INDEX_BATCH_SIZE = 64  # as in metaedit
+
+
+def sync():
+    # flush dirty pages between runs so one benchmark doesn't pay for another's writes (unix only)
+    if hasattr(os, "sync"):
+        os.sync()
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+class Suite:
+    def __init__(self, root, paths, repeat, selected):
+        self.root = root
+        self.paths = paths
+        self.repeat = repeat
+        self.selected = selected
+        self.results = []
+
+    def wanted(self, name):
+        return not self.selected or any(name.startswith(prefix) for prefix in self.selected)
+
+    def run(self, name, items, func, setup=None, **details):
+        """
+        Time func() repeat times (setup() runs untimed before every repetition)
+        :param items: number of files/queries one run handles, for per-item figures
+        """
+        if not self.wanted(name):
+            return None
+        times = []
+        value = None
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            value = func()
+            times.append(time.perf_counter() - start)
+        best = min(times)
+        result = {
+            "name": name,
+            "items": items,
+            "repeat": self.repeat,
+            "seconds_min": best,
+            "seconds_median": statistics.median(times),
+            "ms_per_item": best / items * 1000 if items else None,
+            "items_per_second": items / best if best > 0 else None,
+        }
+        if isinstance(value, dict):
+            result.update(value)
+        result.update(details)
+        self.results.append(result)
+        log(f"{name:<24} {best:8.3f}s  ({result['items_per_second'] or 0:.0f}/s)")
+        return value
+
+
+#########
+# Index #
+#########
+def run_index(root, paths, pool_kind, workers, index_file):
+    """
+    What index_images() and poll_index_results() do, without the Tk loop
+    """
+    conn = metaindex.open_index(os.path.dirname(index_file))
+    cached_entries = metaindex.load_index(conn)
+    search_index = metasearch.SearchIndex()
+    image_hashes = metadupes.HashIndex()
+    for path, (size, mtime_ns, record, image_hash) in cached_entries.items():
+        if record is None:
+            continue  # could not be parsed
+        search_index.update(path, record)
+        if image_hash is not None:
+            image_hashes.add(path, image_hash)
+
+    executor_class = ProcessPoolExecutor if pool_kind == "process" else ThreadPoolExecutor
+    parsed = 0
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        with executor_class(max_workers=workers) as executor:
+            futures = []
+            for start in range(0, len(paths), INDEX_BATCH_SIZE):
+                batch = []
+                for path in paths[start:start + INDEX_BATCH_SIZE]:
+                    cached = cached_entries.get(path)
+                    batch.append((path, None, None) if cached is None else (path, cached[0], cached[1]))
+                futures.append(executor.submit(metaindex.index_batch, batch, "", False))
+            for future in futures:
+                for path, status, size, mtime_ns, record, image_hash in future.result():
+                    if status == "parsed":
+                        parsed += 1
+                        search_index.update(path, record)
+                        if image_hash is not None:
+                            image_hashes.add(path, image_hash)
+                        metaindex.store_record(conn, path, size, mtime_ns, record, image_hash)
+                    elif status == "failed" and size is not None:
+                        metaindex.store_failed(conn, path, size, mtime_ns)
+    finally:
+        os.chdir(cwd)
+    conn.commit()
+    conn.close()
+    return {"parsed": parsed, "hashed": len(image_hashes)}
+
+
+def bench_index(suite, pool_kind, workers):
+    index_file = os.path.join(suite.root, metaindex.INDEX_FILENAME)
+
+    def remove_index():
+        if os.path.exists(index_file):
+            os.remove(index_file)
+
+    suite.run(
+        "index_cold", len(suite.paths), lambda: run_index(suite.root, suite.paths, pool_kind, workers, index_file),
+        setup=remove_index, pool=pool_kind, workers=workers
+    )
+    if not os.path.exists(index_file):
+        run_index(suite.root, suite.paths, pool_kind, workers, index_file)
+    suite.run(
+        "index_warm", len(suite.paths), lambda: run_index(suite.root, suite.paths, pool_kind, workers, index_file),
+        pool=pool_kind, workers=workers
+    )
+
+
+def run_hashing(root, index_file, workers):
+    """
+    What hashes_ready() and poll_hashing_results() do, without the Tk loop
+    """
+    conn = metaindex.open_index(os.path.dirname(index_file))
+    unhashed = [
+        path for path, (size, mtime_ns, record, image_hash) in metaindex.load_index(conn).items()
+        if record is not None and image_hash is None
+    ]
+    hashed = 0
+    for path, image_hash in metadupes.hash_images(root, unhashed, workers):
+        if image_hash is not None:
+            metaindex.store_hash(conn, path, image_hash)
+            hashed += 1
+    conn.commit()
+    conn.close()
+    return {"hashed": hashed}
+
+
+def clear_hashes(index_file):
+    conn = metaindex.open_index(os.path.dirname(index_file))
+    conn.execute("UPDATE images SET image_hash = NULL")
+    conn.commit()
+    conn.close()
+
+
+def bench_duplicates(suite, index_file, workers, expected_groups=None):
+    if not os.path.exists(index_file):
+        return
+    suite.run(
+        "duplicate_hashing", len(suite.paths), lambda: run_hashing(suite.root, index_file, workers),
+        setup=lambda: clear_hashes(index_file), workers=workers
+    )
+    # the searches need the hashes even when the hashing run was not asked for
+    run_hashing(suite.root, index_file, workers)
+    conn = metaindex.open_index(os.path.dirname(index_file))
+    image_hashes = metadupes.HashIndex()
+    for path, (size, mtime_ns, record, image_hash) in metaindex.load_index(conn).items():
+        if image_hash is not None:
+            image_hashes.add(path, image_hash)
+    conn.close()
+    if not image_hashes:
+        return
+
+    def find_all():
+        return {"found": sum(len(image_hashes.duplicates_of(path)) for path in suite.paths)}
+
+    suite.run("duplicates_of", len(suite.paths), find_all, distance=metadupes.DUPLICATE_DISTANCE)
+    groups = suite.run(
+        "duplicate_groups", len(image_hashes), lambda: {"groups": len(image_hashes.groups())},
+        distance=metadupes.DUPLICATE_DISTANCE, expected_groups=expected_groups
+    )
+    if groups is not None and expected_groups is not None and groups["groups"] != expected_groups:
+        log(f"[ERROR] found {groups['groups']} groups of duplicates, the library has {expected_groups}")
+
+
+##########
+# Filter #
+##########
+def build_search_index(root, paths):
+    search_index = metasearch.SearchIndex()
+    for path in paths:
+        record = metaindex.read_record(os.path.join(root, path))
+        if record is not None:
+            search_index.update(path, record)
+    return search_index
+
+
+def bench_filter(suite, search_index):
+    queries = {
+        # (people, location, date, group, comment), as filter_images() builds them
+        "filter_all": ((), "", "", "", ""),
+        "filter_common_location": ((), "a", "", "", ""),
+        "filter_location": ((), "paris", "", "", ""),
+        "filter_person": (("alice smith",), "", "", "", ""),
+        "filter_rare_combination": (("alice smith", "bob jones"), "lake", "19", "family", ""),
+        "filter_no_match": ((), "atlantis", "", "", ""),
+    }
+    rounds = 50
+    for name, query in queries.items():
+        def run_query(query=query):
+            for _ in range(rounds):
+                matches = search_index.query(*query)
+            return {"matches": len(matches)}
+
+        suite.run(name, rounds, run_query, query=list(query))
+
+    # typing "lake tahoe" one key at a time: every key after the first narrows the previous results
+    def run_typing():
+        text = "lake tahoe"
+        previous_query = None
+        results = []
+        for i in range(1, len(text) + 1):
+            query = ((), text[:i], "", "", "")
+            if previous_query is not None and metasearch.is_refinement(previous_query, query):
+                results = search_index.refine(results, *query)
+            else:
+                results = search_index.query(*query)
+            previous_query = query
+        return {"matches": len(results)}
+
+    suite.run("filter_typing", len("lake tahoe"), run_typing)
+
+
+def bench_memory(suite):
+    def measure():
+        tracemalloc.start()
+        try:
+            search_index = build_search_index(suite.root, suite.paths)
+            used = tracemalloc.get_traced_memory()[0]
+            del search_index
+        finally:
+            tracemalloc.stop()
+        return {"bytes_per_image": round(used / len(suite.paths)), "mb": used / (1024 * 1024)}
+
+    suite.run("index_memory", len(suite.paths), measure)
+
+
+########
+# Save #
+########
+def bench_save(suite, sample):
+    full_paths = [os.path.join(suite.root, path) for path in sample]
+    descriptions = {}
+
+    def read_descriptions():
+        sync()
+        for path in full_paths:
+            try:
+                descriptions[path] = metaexif.parse_image_description(metaexif.read_image_description(path))
+            except ValueError:
+                descriptions[path] = {}
+
+    def save(comment_suffix):
+        # an edit to the comment field, as typed into the editor
+        for path in full_paths:
+            description = dict(descriptions[path])
+            description["comment"] = description.get("comment", "") + comment_suffix
+            metaexif.write_image_description(path, description)
+
+    # growing the description past its slot rewrites the file (and leaves padding for later edits)
+    suite.run("save_rewrite", len(full_paths), lambda: save(" " + "x" * 300), setup=read_descriptions)
+    suite.run("save_patch", len(full_paths), lambda: save("!"), setup=read_descriptions)
+
+
+###########
+# Display #
+###########
+def bench_display(suite, sample):
+    import metaedit
+
+    full_paths = [os.path.join(suite.root, path) for path in sample]
+
+    def decode_all():
+        for path in full_paths:
+            image = metaedit.decode_display_img(path)
+        return {"displayed_size": list(image.size)}
+
+    suite.run("display_decode", len(full_paths), decode_all)
+
+
+##########
+# Export #
+##########
+def bench_export(suite, workers):
+    dest = os.path.join(tempfile.gettempdir(), f"metaedit_bench_export_{os.getpid()}")
+    archive = dest + ".zip"
+    library_bytes = sum(os.path.getsize(os.path.join(suite.root, path)) for path in suite.paths)
+
+    def export():
+        stats = metaexport.ExportStats(len(suite.paths))
+        for result in metaexport.export_files(suite.root, suite.paths, dest, workers):
+            stats.add(result)
+        return {"copied": stats.copied, "skipped": stats.skipped, "failed": stats.failed}
+
+    def clean():
+        shutil.rmtree(dest, ignore_errors=True)
+        sync()
+
+    try:
+        suite.run("export_copy", len(suite.paths), export, setup=clean,
+                  mb=library_bytes / (1024 * 1024))
+        suite.run("export_uptodate", len(suite.paths), export)
+
+        def export_zip():
+            for result in metaexport.export_archive(suite.root, suite.paths, archive):
+                pass
+            return {"archive_mb": os.path.getsize(archive) / (1024 * 1024)}
+
+        suite.run("export_zip", len(suite.paths), export_zip, setup=sync)
+    finally:
+        shutil.rmtree(dest, ignore_errors=True)
+        if os.path.exists(archive):
+            os.remove(archive)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicates", type=float, default=synthlib.DUPLICATE_SHARE,
+                        help="share of near-duplicate images in the library")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--sample", type=int, default=100, help="files used by the save and display benchmarks")
+    parser.add_argument("--pool", choices=["process", "thread"], default="process")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--only", default="", help="comma separated benchmark name prefixes")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--keep", help="generate the library in this folder and keep it (reused if it exists)")
+    args = parser.parse_args()
+
+    root = args.keep or tempfile.mkdtemp(prefix="metaedit_bench_")
+    try:
+        start = time.perf_counter()
+        expected_groups = None  # unknown for a reused library
+        if args.keep and os.path.isdir(args.keep) and os.listdir(args.keep):
+            log(f"reusing library in [{root}]")
+        else:
+            library = synthlib.make_library(root, args.count, args.width, args.height, args.depth, args.fanout,
+                                            args.seed, args.duplicates)
+            expected_groups = synthlib.duplicate_groups(library)
+            log(f"generated {args.count} images in {time.perf_counter() - start:.1f}s")
+
+        paths = sorted(path for path, size, mtime_ns in metascan.scan_images(root))
+        suite = Suite(root, paths, args.repeat, [name for name in args.only.split(",") if name])
+        sample = paths[:args.sample]
+
+        suite.run("discover", len(paths), lambda: {"found": sum(1 for _ in metascan.scan_images(root))})
+        bench_index(suite, args.pool, args.workers)
+        bench_duplicates(suite, os.path.join(root, metaindex.INDEX_FILENAME), args.workers, expected_groups)
+        if suite.wanted("filter"):
+            bench_filter(suite, build_search_index(root, paths))
+        bench_memory(suite)
+        bench_display(suite, sample)
+        bench_export(suite, args.workers)
+        # last, since it changes the files
+        bench_save(suite, sample)
+
+        document = {
+            "suite": "metaedit",
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "pillow": PIL.__version__,
+            },
+            "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "keep", "only")},
+            "results": suite.results,
+        }
+        output = json.dumps(document, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output + "\n")
+        else:
+            print(output)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
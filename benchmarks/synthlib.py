@@ -0,0 +1,216 @@
+"""
+Synthetic photo library for benchmarks: N JPEGs of a given size spread over nested folders, each with a JSON
+ImageDescription like the ones the editor writes (people, location, date, group, comment).
+
+Every image has its own picture: a random pattern of coloured blocks under a noise texture shared by the library,
+so their perceptual hashes differ like those of real photos. A share of the images (--duplicates) are near-duplicates
+of an earlier one, slightly cropped, brightened or compressed harder, as a re-scan of the same print would be. The
+images are encoded on a pool of threads. Apart from the shared texture, the content is determined by the seed.
+
+usage: python benchmarks/synthlib.py DIR [--count 1000] [--width 1600] [--height 1200] [--depth 2] [--fanout 8]
+    [--duplicates 0.1]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import piexif
+from PIL import Image
+
+FIRST_NAMES = [
+    "Alice", "Bob", "Carol", "David", "Edith", "Frank", "Grace", "Henry", "Irene", "James", "Karen", "Louis",
+    "Mary", "Norman", "Olive", "Peter", "Rose", "Samuel", "Tessa", "Walter",
+]
+LAST_NAMES = ["Smith", "Jones", "Miller", "Brown", "Garcia", "Wilson", "Moore", "Taylor", "Clark", "Lewis"]
+LOCATIONS = [
+    "Paris", "Lake Tahoe", "Grandma's house", "Yosemite", "Chicago", "Rome", "Cape Cod", "Boston", "Denver",
+    "Niagara Falls", "San Diego", "Lisbon", "Dublin", "Oslo", "Kyoto", "Vancouver",
+]
+SEASONS = ["Spring", "Summer", "Fall", "Winter", "Christmas", "Easter"]
+GROUPS = ["Smith family", "Jones family", "work", "school", "church", "friends", "wedding", "reunion"]
+COMMENTS = [
+    "Cabin trip", "First day of school", "Birthday party", "Graduation", "Road trip", "Picnic by the lake",
+    "New house", "Fishing with dad", "", "",
+]
+
+# room reserved for the description of every file
+DESCRIPTION_SLOT = 400
+PLACEHOLDER = b"\x01" * DESCRIPTION_SLOT
+
+# share of the images that are near-duplicates of an earlier one
+DUPLICATE_SHARE = 0.1
+
+# cells of the random block pattern that makes every picture different
+PATTERN_SIZE = (16, 12)
+
+# ways a near-duplicate differs from its original
+VARIANTS = ("crop", "brighten", "recompress")
+
+
+def random_description(rng: random.Random):
+    """
+    :return: ImageDescription dict as write_input() stores it, None for no description, or a foreign string
+    """
+    roll = rng.random()
+    if roll < 0.03:
+        return None
+    if roll < 0.05:
+        return "Processed with VSCO with b1 preset"
+    # a small pool of people keeps some names common and makes others rare
+    people = {f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(rng.choice((1, 1, 2, 3, 4, 6)))}
+    return {
+        "people": sorted(people),
+        "location": rng.choice(LOCATIONS),
+        "date": f"{rng.choice(SEASONS)} {rng.randint(1940, 2005)}" if rng.random() < 0.5 else str(rng.randint(1940, 2005)),
+        "group": rng.choice(GROUPS),
+        "comment": rng.choice(COMMENTS),
+    }
+
+
+def make_texture(width: int, height: int):
+    """
+    :return: noise shared by every picture of a library, so the JPEGs are not all smooth gradients
+    """
+    return Image.effect_noise((width, height), 48).convert("RGB")
+
+
+def random_picture(rng: random.Random):
+    """
+    :return: description of a picture for render_picture(): its pattern, and no variant
+    """
+    pattern = bytes(rng.randrange(256) for _ in range(PATTERN_SIZE[0] * PATTERN_SIZE[1] * 3))
+    return {"pattern": pattern, "variant": None}
+
+
+def near_duplicate(picture: dict, rng: random.Random):
+    """
+    :return: description of a near-duplicate of picture for render_picture()
+    """
+    variant = rng.choice(VARIANTS)
+    amount = {"crop": rng.uniform(0.002, 0.006), "brighten": rng.uniform(1.05, 1.15), "recompress": rng.randint(40, 60)}
+    return {"pattern": picture["pattern"], "variant": variant, "amount": amount[variant]}
+
+
+def render_picture(picture: dict, texture) -> bytes:
+    """
+    :return: JPEG of a picture with a PLACEHOLDER ImageDescription
+    """
+    width, height = texture.size
+    pattern = Image.frombytes("RGB", PATTERN_SIZE, picture["pattern"]).resize((width, height), Image.BILINEAR)
+    image = Image.blend(texture, pattern, 0.5)
+    quality = 90
+    if picture["variant"] == "crop":
+        dx, dy = int(width * picture["amount"]), int(height * picture["amount"])
+        image = image.crop((dx, dy, width - dx, height - dy)).resize((width, height), Image.BILINEAR)
+    elif picture["variant"] == "brighten":
+        image = image.point(lambda value: min(255, int(value * picture["amount"])))
+    elif picture["variant"] == "recompress":
+        quality = picture["amount"]
+    exif_bytes = piexif.dump({"0th": {
+        piexif.ImageIFD.ImageDescription: PLACEHOLDER,
+        piexif.ImageIFD.Orientation: 1,
+    }})
+    out = io.BytesIO()
+    image.save(out, "JPEG", exif=exif_bytes, quality=quality)
+    return out.getvalue()
+
+
+def library_paths(count: int, depth: int, fanout: int):
+    """
+    :return: relative paths like "d03/d01/img_000123.jpg", spreading count files evenly over fanout ** depth folders
+    """
+    folders = fanout ** depth
+    paths = []
+    for i in range(count):
+        folder = i % folders
+        parts = []
+        for _ in range(depth):
+            parts.append(f"d{folder % fanout:02d}")
+            folder //= fanout
+        paths.append(os.path.join(*parts, f"img_{i:06d}.jpg"))
+    return paths
+
+
+def make_library(root: str, count: int, width: int = 1600, height: int = 1200, depth: int = 2, fanout: int = 8,
+                 seed: int = 0, duplicate_share: float = DUPLICATE_SHARE, workers: int = None):
+    """
+    Write a synthetic library into root
+    :return: list of (relative path, description, original) with description as described in random_description()
+        and original the path of the image this one is a near-duplicate of (None for an original)
+    """
+    rng = random.Random(seed)
+    texture = make_texture(width, height)
+    paths = library_paths(count, depth, fanout)
+
+    pictures = []
+    library = []
+    for i, path in enumerate(paths):
+        original = None
+        if i and rng.random() < duplicate_share:
+            # near-duplicates of near-duplicates would make the groups depend on how the variants add up
+            original_index = rng.choice([j for j in range(max(0, i - 50), i) if library[j][2] is None] or [0])
+            original = paths[original_index]
+            pictures.append(near_duplicate(pictures[original_index], rng))
+        else:
+            pictures.append(random_picture(rng))
+        library.append((path, random_description(rng), original))
+
+    def write_image(path, description, picture):
+        if description is None:
+            text = ""
+        elif isinstance(description, str):
+            text = description
+        else:
+            text = json.dumps(description)
+        encoded = text.encode()
+        if len(encoded) > DESCRIPTION_SLOT:
+            raise ValueError(f"description does not fit the placeholder: [{text}]")
+        data = render_picture(picture, texture)
+        slot = data.index(PLACEHOLDER)
+
+        full_path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            # NUL padding: the reader stops at the first NUL, like at the end of any EXIF ASCII value
+            f.write(data[:slot] + encoded.ljust(DESCRIPTION_SLOT, b"\0") + data[slot + DESCRIPTION_SLOT:])
+
+    # Pillow releases the GIL while it encodes, so threads keep every core busy
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4) as executor:
+        for _ in executor.map(write_image, paths, [description for _, description, _ in library], pictures):
+            pass
+    return library
+
+
+def duplicate_groups(library) -> int:
+    """
+    :return: number of groups of near-duplicates in a library returned by make_library()
+    """
+    return len({original for _, _, original in library if original is not None})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duplicates", type=float, default=DUPLICATE_SHARE, help="share of near-duplicate images")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    library = make_library(args.root, args.count, args.width, args.height, args.depth, args.fanout, args.seed,
+                           args.duplicates)
+    print(f"{args.count} images written to [{args.root}] in {time.perf_counter() - start:.1f}s, "
+          f"{duplicate_groups(library)} groups of near-duplicates", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
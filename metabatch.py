@@ -0,0 +1,260 @@
+"""
+Headless bulk tagging: apply a CSV or JSONL manifest of image path -> field values without opening the editor.
+
+Every manifest row names an image (relative to --root) and any of the people, location, date, group and comment
+fields. The values are merged into the image's JSON ImageDescription the same way typing them into the editor
+does, and the files are written on a bounded pool of threads. Progress goes to stderr and a per-file result line
+(JSONL) to stdout or --report.
+
+CSV: a header row with a "path" column and one column per field; an empty cell leaves that field as it is.
+JSONL: one object per line, e.g. {"path": "2019/beach.jpg", "people": ["Ann", "Bob"], "location": "Nice"};
+a field given as "" is cleared, and people may be a list or a comma separated string.
+
+usage: python metabatch.py manifest.csv [--root DIR] [--workers 8] [--report report.jsonl] [--dry-run]
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metaexif
+import metaindex
+
+# fields the editor lets the user change
+FIELDS = ("people", "location", "date", "group", "comment")
+
+# seconds between progress lines
+PROGRESS_INTERVAL = 0.5
+
+
+class ManifestError(ValueError):
+    pass
+
+
+#####################
+# Read the manifest #
+#####################
+def _field_value(field: str, value):
+    # stored as the editor stores them: people as a list of names, the other fields as stripped text
+    if field == "people" and isinstance(value, (list, str)):
+        return metaindex.people_list(value)
+    if not isinstance(value, str):
+        raise ManifestError(f"field [{field}] must be text, got [{value!r}]")
+    return value.strip()
+
+
+def read_csv_manifest(f):
+    reader = csv.DictReader(f)
+    if reader.fieldnames is None or "path" not in reader.fieldnames:
+        raise ManifestError("CSV manifest needs a header row with a [path] column")
+    for line_number, row in enumerate(reader, start=2):
+        # blank spreadsheet cells are "no change", not "clear the field"
+        fields = {field: _field_value(field, row[field]) for field in FIELDS if row.get(field) and row[field].strip()}
+        yield line_number, (row["path"] or "").strip(), fields
+
+
+def read_jsonl_manifest(f):
+    for line_number, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.decoder.JSONDecodeError as e:
+            raise ManifestError(f"line {line_number}: invalid JSON [{e}]")
+        if not isinstance(row, dict):
+            raise ManifestError(f"line {line_number}: expected a JSON object")
+        try:
+            fields = {field: _field_value(field, row[field]) for field in FIELDS if field in row}
+        except ManifestError as e:
+            raise ManifestError(f"line {line_number}: {e}")
+        yield line_number, str(row.get("path", "")).strip(), fields
+
+
+def load_manifest(manifest_path: str, root: str) -> dict:
+    """
+    Read a CSV (.csv) or JSONL (anything else) manifest
+    :return: dict of path relative to root -> fields to set, in manifest order; when a path is listed more than
+        once its rows are merged, later rows winning, so every file is written at most once
+    :raise ManifestError: if the manifest is malformed, or a row names a file outside root
+    """
+    reader = read_csv_manifest if manifest_path.lower().endswith(".csv") else read_jsonl_manifest
+    edits = {}
+    with open(manifest_path, newline="", encoding="utf-8-sig") as f:
+        for line_number, path, fields in reader(f):
+            if not path:
+                raise ManifestError(f"line {line_number}: missing path")
+            # rows may only edit images inside the library
+            if os.path.isabs(path):
+                raise ManifestError(f"line {line_number}: path [{path}] must be relative to the root")
+            relative = os.path.relpath(os.path.join(root, path), root)
+            if relative in (os.curdir, os.pardir) or relative.startswith(os.pardir + os.sep):
+                raise ManifestError(f"line {line_number}: path [{path}] is not inside the root")
+            edits.setdefault(relative, {}).update(fields)
+    return edits
+
+
+##################
+# Apply the tags #
+##################
+def read_description(path: str) -> dict:
+    """
+    :return: ImageDescription dict of the image; empty if it has none or it does not use our scheme
+    """
+    try:
+        return metaexif.parse_image_description(metaexif.read_image_description(path))
+    except ValueError:
+        # not our scheme (e.g. b'Processed with VSCO with b1 preset'): overwritten, as the editor does
+        return {}
+
+
+def merge_fields(description: dict, fields: dict, add_people: bool = False) -> dict:
+    """
+    :param add_people: add the given people to the ones already in the description instead of replacing them
+    :return: copy of description with fields set
+    """
+    merged = dict(description)
+    merged.update(fields)
+    if "people" in fields:
+        merged["people"] = metaindex.people_list(fields["people"])
+    if add_people and description.get("people") and fields.get("people"):
+        people = metaindex.people_list(description["people"])
+        known = {person.lower() for person in people}
+        for person in merged["people"]:
+            if person.lower() not in known:
+                people.append(person)
+                known.add(person.lower())
+        merged["people"] = people
+    return merged
+
+
+def apply_edit(root: str, path: str, fields: dict, dry_run: bool = False, add_people: bool = False) -> dict:
+    """
+    Merge fields into the ImageDescription of one image and write it. Runs on a worker thread.
+    :param add_people: add the given people to the image's instead of replacing them (see merge_fields())
+    :return: report entry: path, status ("written", "unchanged", "missing" or "failed"), error, ms and, for
+        written files, the new description with its size and mtime (for the index)
+    """
+    start = time.perf_counter()
+    result = {"path": path, "status": "failed", "error": None}
+    full_path = os.path.join(root, path)
+    try:
+        current = read_description(full_path)
+        merged = merge_fields(current, fields, add_people)
+        if merged == current:
+            result["status"] = "unchanged"
+        elif dry_run:
+            result["status"] = "written"
+        else:
+            metaexif.write_image_description(full_path, merged)
+            stat = os.stat(full_path)
+            result.update(status="written", description=merged, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    except FileNotFoundError:
+        result.update(status="missing", error="file not found")
+    except (OSError, ValueError) as e:
+        result["error"] = str(e)
+    result["ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def map_bounded(func, calls, workers: int = 8):
+    """
+    Run func(*args) for every args tuple of calls on a pool of threads
+    :return: generator of the results in completion order
+    """
+    pending = iter(calls)
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # only a couple of calls per worker are queued, so memory doesn't grow with the number of files
+            while len(in_flight) < workers * 2:
+                try:
+                    args = next(pending)
+                except StopIteration:
+                    break
+                in_flight.add(executor.submit(func, *args))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def apply_manifest(root: str, edits: dict, workers: int = 8, dry_run: bool = False, index_conn=None):
+    """
+    Apply edits with at most workers files being written at a time
+    :param edits: dict of path relative to root -> fields, as returned by load_manifest()
+    :param index_conn: library index to keep in step with the written files, if any
+    :return: generator of report entries in completion order
+    """
+    calls = ((root, path, fields, dry_run) for path, fields in edits.items())
+    for result in map_bounded(apply_edit, calls, workers):
+        if index_conn is not None and "description" in result:
+            # the connection belongs to this thread, so the workers hand their results back for it
+            metaindex.store_record(
+                index_conn, result["path"], result.pop("size"), result.pop("mtime_ns"),
+                metaindex.record_from_description(result.pop("description"))
+            )
+        else:
+            for key in ("description", "size", "mtime_ns"):
+                result.pop(key, None)
+        yield result
+    if index_conn is not None:
+        index_conn.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", help="CSV (.csv) or JSONL manifest")
+    parser.add_argument("--root", default=".", help="library folder the manifest paths are relative to")
+    parser.add_argument("--workers", type=int, default=8, help="files written at the same time")
+    parser.add_argument("--report", help="write the per-file report (JSONL) here instead of stdout")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    parser.add_argument("--no-index", action="store_true", help="don't update the library index")
+    args = parser.parse_args(argv)
+
+    root = os.path.abspath(args.root)
+    try:
+        edits = load_manifest(args.manifest, root)
+    except (OSError, ManifestError) as e:
+        print(f"[ERROR] Failed to read manifest [{args.manifest}] with error [{e}]", file=sys.stderr)
+        return 2
+
+    index_conn = None
+    if not (args.dry_run or args.no_index):
+        index_conn = metaindex.open_index(root)
+
+    report = open(args.report, "w", encoding="utf-8") if args.report else sys.stdout
+    counts = {"written": 0, "unchanged": 0, "missing": 0, "failed": 0}
+    start = last_progress = time.perf_counter()
+    try:
+        for done, result in enumerate(apply_manifest(root, edits, max(1, args.workers), args.dry_run, index_conn), 1):
+            counts[result["status"]] += 1
+            report.write(json.dumps(result) + "\n")
+            now = time.perf_counter()
+            if now - last_progress >= PROGRESS_INTERVAL or done == len(edits):
+                last_progress = now
+                print(
+                    f"\r{done}/{len(edits)} files, {done / max(now - start, 1e-9):.0f} files/s, "
+                    f"{counts['failed'] + counts['missing']} errors",
+                    end="", file=sys.stderr, flush=True
+                )
+    finally:
+        if report is not sys.stdout:
+            report.close()
+        if index_conn is not None:
+            index_conn.close()
+
+    print(file=sys.stderr)
+    print(
+        f"{counts['written']} written, {counts['unchanged']} unchanged, {counts['missing']} missing, "
+        f"{counts['failed']} failed in {time.perf_counter() - start:.1f}s",
+        file=sys.stderr
+    )
+    return 1 if counts["failed"] or counts["missing"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
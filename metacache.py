@@ -0,0 +1,234 @@
+"""
+Memory-bounded LRU cache of display-ready (decoded and scaled) images, a background prefetcher that fills it with
+the images the user is likely to look at next, and the on-disk thumbnail cache used by the grid view.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import metaexif
+
+# transpose that turns an image upright for each EXIF Orientation value
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+# thumbnails are keyed on a hash of the last bytes of the file after the EXIF segment: that is entropy coded image
+# data, so it identifies the picture but does not change when the description is edited, even in small files
+THUMBNAIL_KEY_BYTES = 64 * 1024
+
+
+def orient_image(image, orientation: int):
+    if orientation in ORIENTATION_TRANSPOSE:
+        return image.transpose(ORIENTATION_TRANSPOSE[orientation])
+    return image
+
+
+def image_size_bytes(image) -> int:
+    # PIL keeps multi-band images at 4 bytes per pixel
+    bands = len(image.getbands())
+    return image.size[0] * image.size[1] * (4 if bands > 1 else 1)
+
+
+class ImageCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (image, size in bytes), least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # the prefetch threads put images while the Tk thread reads them
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        :return: cached image (marked as most recently used) or None; counts towards hits/misses
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, image):
+        size = image_size_bytes(image)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            # an image bigger than the whole cache is not worth keeping
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (image, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def discard(self, key):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+class Prefetcher:
+    """
+    Loads images into an ImageCache on background threads
+    """
+
+    def __init__(self, cache: ImageCache, loader, workers: int = 1):
+        """
+        :param loader: callable taking a key and returning the display-ready image (or None on failure)
+        """
+        self.cache = cache
+        self.loader = loader
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = {}  # key -> future of a queued or running load
+        self.lock = threading.Lock()
+
+    def prefetch(self, keys):
+        """
+        Queue keys for loading, nearest first; loads still queued for earlier keys that are no longer wanted are
+        dropped so fast navigation does not build up a backlog
+        """
+        wanted = [key for key in keys if key not in self.cache]
+        with self.lock:
+            queued = list(self.futures.items())
+        for key, future in queued:
+            if key not in wanted:
+                # a cancelled future is done, so _forget() removes it
+                future.cancel()
+        for key in wanted:
+            with self.lock:
+                if key in self.futures:
+                    continue
+                future = self.executor.submit(self._load, key)
+                self.futures[key] = future
+            # registered after the future is in self.futures, so a load that finishes right away is removed too
+            future.add_done_callback(lambda done, key=key: self._forget(key, done))
+
+    def pending(self, key):
+        """
+        :return: future of a queued or running load of key, or None
+        """
+        with self.lock:
+            future = self.futures.get(key)
+        if future is not None and future.cancelled():
+            return None
+        return future
+
+    def _load(self, key):
+        image = self.loader(key)
+        if image is not None:
+            self.cache.put(key, image)
+        return image
+
+    def _forget(self, key, future):
+        # runs when a load is done or cancelled; a newer load of the same key stays
+        with self.lock:
+            if self.futures.get(key) is future:
+                del self.futures[key]
+
+    def shutdown(self):
+        with self.lock:
+            queued = list(self.futures.values())
+        for future in queued:
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+
+class ThumbnailCache:
+    """
+    Thumbnails for the grid view. The thumbnail embedded in the EXIF data is used when there is one; otherwise a
+    thumbnail is generated once and stored on disk under a hash of the image data.
+    """
+
+    def __init__(self, directory: str, size: int = 160):
+        self.directory = directory
+        self.size = size
+
+    def key(self, path: str, orientation: int) -> str:
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            try:
+                segment = metaexif.find_exif_segment(f)
+            except ValueError:
+                segment = None  # not a JPEG, or a broken one: hash the end of the file as it is
+            data_start = 0 if segment is None else segment[0] + segment[1]
+            f.seek(0, os.SEEK_END)
+            f.seek(max(data_start, f.tell() - THUMBNAIL_KEY_BYTES))
+            digest.update(f.read(THUMBNAIL_KEY_BYTES))
+        digest.update(f"{orientation}:{self.size}".encode())
+        return digest.hexdigest()
+
+    def load(self, path: str):
+        """
+        :return: upright thumbnail no bigger than size x size, or None if the image could not be read
+        """
+        try:
+            thumbnail_bytes, orientation = metaexif.read_exif_thumbnail(path)
+            if thumbnail_bytes is not None:
+                with Image.open(io.BytesIO(thumbnail_bytes)) as image:
+                    image.thumbnail((self.size, self.size))
+                    return orient_image(image.convert("RGB"), orientation)
+
+            key = self.key(path, orientation)
+            cache_path = os.path.join(self.directory, key[:2], key + ".jpg")
+            if os.path.exists(cache_path):
+                with Image.open(cache_path) as image:
+                    image.load()
+                    return image.copy()
+
+            with Image.open(path) as image:
+                # thumbnail() lets the JPEG decoder scale down while decoding
+                image.thumbnail((self.size, self.size))
+                thumbnail = orient_image(image.convert("RGB"), orientation)
+            self._store(cache_path, thumbnail)
+            return thumbnail
+        except Exception as e:
+            print(f"[ERROR] Failed to load thumbnail for [{path}] with error [{e}]")
+            return None
+
+    def _store(self, cache_path: str, thumbnail):
+        # write to a temp file and rename, so a concurrent reader never sees half a thumbnail
+        directory = os.path.dirname(cache_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                thumbnail.save(f, "JPEG", quality=85)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"[ERROR] Failed to store thumbnail [{cache_path}] with error [{e}]")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
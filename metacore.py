@@ -0,0 +1,405 @@
+"""
+GUI-free core of the editor: scan a library folder, index it, query it, and read and write the ImageDescription
+fields of its images, for scripts, batch jobs and tests. The Tk app (metaedit) keeps its library in a Library too.
+
+    with metacore.Library("~/Pictures/family") as library:
+        library.scan()
+        library.index()
+        for path in library.query('people:"ann smith" AND date:1960..1965'):
+            print(path, library.read(path))
+        library.write("1962/beach.jpg", {"location": "Nice"})
+
+Paths are relative to the library folder. Importing this module doesn't import Tk or Pillow (nor piexif, which is
+only needed when a description has to be rewritten), so a headless import takes tens of milliseconds; Pillow is
+imported on the first thumbnail(), or when images are first hashed for duplicate detection (see metadupes).
+"""
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import metabatch
+import metadupes
+import metaexif
+import metaindex
+import metajournal
+import metaquery
+import metascan
+import metasearch
+import metastore
+
+# where generated thumbnails are kept (see metacache.ThumbnailCache)
+THUMBNAIL_DIR = os.path.join(os.path.expanduser("~"), ".cache", "metaedit", "thumbnails")
+
+INDEX_BATCH_SIZE = 64  # images handed to an indexing worker at a time
+
+
+class Library:
+    def __init__(self, root: str, store_kind: str = "", use_index: bool = True):
+        """
+        :param root: library folder
+        :param store_kind: "sidecar" or "database" to keep edits in a metadata store (see metastore), "" to write
+            them into the images
+        :param use_index: keep the on-disk index in the library folder (see metaindex) up to date and use it
+        """
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.index_conn = metaindex.open_index(self.root) if use_index else None
+        self.store = metastore.open_store(store_kind, self.root)
+        self.images = []  # paths found by the last scan()
+        self.stats = {}  # image path -> (size, mtime_ns) found by the last scan()
+        self.search_index = metasearch.SearchIndex()
+        # image path -> indexed fields (people as a set, the other fields as strings), read from the search index
+        self.records = self.search_index.records
+        # perceptual hashes of the indexed images, for finding duplicates
+        self.image_hashes = metadupes.HashIndex()
+        self.unhashable = set()  # images that could not be hashed, so hash_images() doesn't try them again
+        self.thumbnails = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+        if self.index_conn is not None:
+            self.index_conn.close()
+
+    def path(self, path: str) -> str:
+        """
+        :return: full path of an image given relative to the library folder
+        """
+        return os.path.join(self.root, path)
+
+    ############
+    # Indexing #
+    ############
+    def scan(self, exclude_dirs=()) -> list:
+        """
+        Find the images in the library folder (see metascan)
+        :return: paths relative to the library folder
+        """
+        self.stats = {path: (size, mtime_ns) for path, size, mtime_ns in metascan.scan_images(self.root, exclude_dirs)}
+        self.images = list(self.stats)
+        return self.images
+
+    def index(self, workers: int = 0, pool: str = "thread", hash_images: bool = False) -> dict:
+        """
+        Read the fields of every scanned image into the search index. Images whose size and mtime match the on-disk
+        index are not parsed again.
+        :param workers: size of the pool parsing images (default: the number of cores)
+        :param pool: "thread" or "process"
+        :param hash_images: also compute the perceptual hash of every parsed image, which decodes it (default:
+            hash_images() does it when duplicates are first looked for)
+        :return: number of images per status: "unchanged", "parsed" and "failed"
+        """
+        cached_entries = metaindex.load_index(self.index_conn) if self.index_conn is not None else {}
+        batches = []
+        for start in range(0, len(self.images), INDEX_BATCH_SIZE):
+            batch = []
+            for path in self.images[start:start + INDEX_BATCH_SIZE]:
+                cached = cached_entries.get(path)
+                batch.append((path, None, None) if cached is None else (path, cached[0], cached[1]))
+            batches.append(batch)
+
+        counts = {"unchanged": 0, "parsed": 0, "failed": 0}
+        if pool == "process":
+            # imported here: it pulls in multiprocessing, which headless users of threads don't need to pay for
+            from concurrent.futures import ProcessPoolExecutor
+            executor_class = ProcessPoolExecutor
+        else:
+            executor_class = ThreadPoolExecutor
+        with executor_class(max_workers=workers or os.cpu_count() or 4) as executor:
+            results_per_batch = executor.map(
+                metaindex.index_batch, batches, itertools.repeat(self.root), itertools.repeat(hash_images)
+            )
+            for results in results_per_batch:
+                for path, status, size, mtime_ns, record, image_hash in results:
+                    cached = cached_entries.get(path)
+                    if status == "unchanged" and cached[2] is None:
+                        # could not be parsed before either, and the file is the same
+                        status = "failed"
+                    elif status == "failed" and size is not None and self.index_conn is not None:
+                        metaindex.store_failed(self.index_conn, path, size, mtime_ns)
+                    counts[status] += 1
+                    if status == "failed":
+                        self.drop_record(path)
+                        continue
+                    # like the on-disk index, an image that could not be hashed keeps the hash it had
+                    if image_hash is None and cached is not None:
+                        image_hash = cached[3]
+                    if image_hash is not None:
+                        self.image_hashes.add(path, image_hash)
+                    if status == "unchanged":
+                        self.set_record(path, cached[2])
+                    else:
+                        if self.store is not None:
+                            stored = self.store.get(path)
+                            if stored:
+                                record.update(metaindex.record_from_description(stored))
+                        self.set_record(path, record)
+                        if self.index_conn is not None:
+                            metaindex.store_record(self.index_conn, path, size, mtime_ns, record, image_hash)
+
+        if self.index_conn is not None:
+            # drop entries for images that no longer exist in the library
+            metaindex.remove_records(self.index_conn, [path for path in cached_entries if path not in self.stats])
+            self.index_conn.commit()
+        return counts
+
+    def set_record(self, path: str, record: dict):
+        self.search_index.update(path, record)
+
+    def drop_record(self, path: str):
+        self.search_index.remove(path)
+        self.image_hashes.discard(path)
+
+    def update_index_entry(self, path: str):
+        """
+        Store the record of an image in the on-disk index with the file's current size and mtime
+        """
+        if self.index_conn is None:
+            return
+        stat = os.stat(self.path(path))
+        record = self.records.get(path, {})
+        metaindex.store_record(
+            self.index_conn, path, stat.st_size, stat.st_mtime_ns, record, self.image_hashes.get(path)
+        )
+        self.index_conn.commit()
+
+    #############
+    # Searching #
+    #############
+    def filter(self, people=(), location="", date="", group="", comment="") -> list:
+        """
+        :return: images matching every given field (see metasearch.SearchIndex.query), in scan order
+        """
+        return self.search_index.query(people, location, date, group, comment)
+
+    def query(self, text: str) -> list:
+        """
+        :return: images matching a structured query (see metaquery), in scan order
+        :raise metaquery.QueryError: if the query is malformed
+        """
+        matches = metaquery.run_query(self.search_index, text)
+        if matches is None:
+            return self.search_index.all_paths()
+        return self.search_index.in_order(matches)
+
+    def suggest(self, field: str, prefix: str, limit: int = 8) -> list:
+        return self.search_index.suggest(field, prefix, limit)
+
+    ##############
+    # Duplicates #
+    ##############
+    def unhashed_images(self) -> list:
+        """
+        :return: indexed images that have no perceptual hash yet, in scan order
+        """
+        return [
+            path for path in self.search_index.all_paths()
+            if path not in self.image_hashes and path not in self.unhashable
+        ]
+
+    def hash_images(self, workers: int = 4) -> int:
+        """
+        Compute the perceptual hash of every indexed image that has none yet, and keep it in the on-disk index
+        :return: number of images hashed
+        """
+        hashed = 0
+        for path, image_hash in metadupes.hash_images(self.root, self.unhashed_images(), workers):
+            if image_hash is None:
+                self.unhashable.add(path)
+                continue
+            self.image_hashes.add(path, image_hash)
+            if self.index_conn is not None:
+                metaindex.store_hash(self.index_conn, path, image_hash)
+            hashed += 1
+        if self.index_conn is not None:
+            self.index_conn.commit()
+        return hashed
+
+    def duplicates(self, path: str, max_distance: int = metadupes.DUPLICATE_DISTANCE) -> list:
+        """
+        :return: images whose perceptual hash is within max_distance bits of the image's, closest first; images
+            are hashed first if needed (see hash_images())
+        """
+        self.hash_images()
+        return self.image_hashes.duplicates_of(path, max_distance)
+
+    def duplicate_groups(self, max_distance: int = metadupes.DUPLICATE_DISTANCE) -> list:
+        """
+        :return: lists of images that are near-duplicates of each other (see metadupes.HashIndex.groups); images
+            are hashed first if needed (see hash_images())
+        """
+        self.hash_images()
+        return self.image_hashes.groups(max_distance)
+
+    def copy_to_duplicates(self, path: str, max_distance: int = metadupes.DUPLICATE_DISTANCE, targets=None) -> list:
+        """
+        Copy the tags of an image onto its untagged duplicates; duplicates that have tags of their own are left alone
+        :param targets: copy onto these images (e.g. a group from duplicate_groups()) rather than the duplicates
+            found within max_distance
+        :return: images that were written
+        """
+        fields = metadupes.copied_fields(self.read(path))
+        if not fields:
+            return []
+        if targets is None:
+            targets = self.duplicates(path, max_distance)
+        written = []
+        for target in targets:
+            if target == path or metadupes.is_tagged(self.records.get(target, {})):
+                continue
+            self.write(target, fields)
+            written.append(target)
+        return written
+
+    ###################
+    # Reading/writing #
+    ###################
+    def read_embedded(self, path: str) -> dict:
+        """
+        :return: ImageDescription dict stored in the image file; empty if it has none or it does not use our scheme
+        """
+        return metabatch.read_description(self.path(path))
+
+    def read(self, path: str) -> dict:
+        """
+        :return: ImageDescription dict of an image, with the edits kept in the metadata store (if any) merged over it
+        """
+        embedded = self.read_embedded(path)
+        if self.store is None:
+            return embedded
+        return metastore.merge(embedded, self.store.get(path))
+
+    def save(self, path: str, description: dict):
+        """
+        Save the whole description of an image: into the metadata store if there is one, otherwise into the image
+        """
+        if "people" in description:
+            # stored as a list of names, however the caller gave them (see metaindex.people_list())
+            description = dict(description, people=metaindex.people_list(description["people"]))
+        if self.store is not None:
+            changed = metastore.changed_fields(self.read_embedded(path), description)
+            if changed:
+                self.store.put(path, changed)
+            else:
+                self.store.remove(path)
+            self.store.commit()
+        else:
+            metaexif.write_image_description(self.path(path), description)
+        self.set_record(path, metaindex.record_from_description(description))
+        self.update_index_entry(path)
+
+    def write(self, path: str, fields: dict) -> dict:
+        """
+        Change some fields of an image, keeping the others
+        :return: the description after the change
+        """
+        description = metabatch.merge_fields(self.read(path), fields)
+        self.save(path, description)
+        return description
+
+    def sync(self, workers: int = 8):
+        """
+        Write the edits kept in the metadata store into the images (see metastore.sync_to_exif)
+        :return: generator of per-file report entries; empty without a metadata store
+        """
+        if self.store is None:
+            return iter(())
+        return metastore.sync_to_exif(self.root, self.store, workers, self.index_conn)
+
+    ###############
+    # Batch edits #
+    ###############
+    def batch_edit(self, paths, fields: dict, workers: int = 8):
+        """
+        Set fields on many images at once (people are added to the ones already tagged), journaled so the batch can
+        be undone (see metajournal)
+        :return: generator of per-file report entries in completion order
+        """
+        return self._index_results(metajournal.start_batch(self.root, paths, fields, workers, self.store))
+
+    def resume_batch(self, batch_id: int, workers: int = 8):
+        """
+        Finish a batch that was interrupted (see unfinished_batches())
+        :return: generator of per-file report entries
+        """
+        return self._index_results(metajournal.resume_batch(self.root, batch_id, workers, self.store))
+
+    def undo_batch(self, batch_id: int = None, workers: int = 8):
+        """
+        Undo a batch, or roll back one that was interrupted
+        :param batch_id: default: the newest finished batch
+        :return: generator of per-file report entries; empty if there is nothing to undo
+        """
+        if batch_id is None:
+            batch = self.last_batch()
+            if batch is None:
+                return iter(())
+            batch_id = batch["id"]
+        return self._index_results(metajournal.revert_batch(self.root, batch_id, workers, self.store))
+
+    def last_batch(self):
+        """
+        :return: the newest batch that can be undone (see metajournal.Journal.batch()), or None
+        """
+        return self._read_journal(lambda journal: journal.last_done(), None)
+
+    def unfinished_batches(self) -> list:
+        """
+        :return: batches that were interrupted while running or undoing (see metajournal.Journal.batch())
+        """
+        return self._read_journal(lambda journal: journal.unfinished(), [])
+
+    def _read_journal(self, read, default):
+        # a library that never had a batch has no journal, and doesn't get one just for looking
+        if not os.path.exists(self.path(metajournal.JOURNAL_FILENAME)):
+            return default
+        journal = metajournal.Journal(self.root)
+        try:
+            return read(journal)
+        finally:
+            journal.close()
+
+    def _index_results(self, results):
+        # keeps the search index and the on-disk index in step with the files a batch wrote
+        try:
+            for result in results:
+                description = result.pop("description", None)
+                if description is not None:
+                    record = metaindex.record_from_description(description)
+                    self.set_record(result["path"], record)
+                    if self.index_conn is not None:
+                        self._store_index_entry(result, record)
+                result.pop("size", None)
+                result.pop("mtime_ns", None)
+                yield result
+        finally:
+            if self.index_conn is not None:
+                self.index_conn.commit()
+
+    def _store_index_entry(self, result: dict, record: dict):
+        if "size" in result:
+            size, mtime_ns = result["size"], result["mtime_ns"]
+        else:
+            # edits that went into the metadata store leave the file as it is
+            try:
+                stat = os.stat(self.path(result["path"]))
+            except OSError:
+                return
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        metaindex.store_record(
+            self.index_conn, result["path"], size, mtime_ns, record, self.image_hashes.get(result["path"])
+        )
+
+    def thumbnail(self, path: str):
+        """
+        :return: upright PIL thumbnail of an image (see metacache.ThumbnailCache), or None if it could not be read
+        """
+        if self.thumbnails is None:
+            import metacache
+            self.thumbnails = metacache.ThumbnailCache(os.environ.get("METAEDIT_THUMB_CACHE", THUMBNAIL_DIR))
+        return self.thumbnails.load(self.path(path))
@@ -0,0 +1,279 @@
+"""
+Near-duplicate detection: the same print scanned several times, or a photo copied around with different tags.
+
+Every image gets a perceptual hash (dHash): the picture is shrunk to 9x8 grey pixels and each bit says whether a
+pixel is brighter than its right neighbour, so re-scans, re-compressions and small crops or colour changes keep most
+of the 64 bits. Hashing decodes the picture, so it is not done while indexing (which only reads the file headers)
+unless asked for, but the first time duplicates are looked for. The hash is stored with the image's entry in the
+on-disk index (see metaindex) and kept when the editor rewrites the description, so it is computed once per file.
+
+The hashes are kept in a HashIndex, a multi-index hash table over chunks of the hash. Finding the near-duplicates
+of an image then costs a few dozen dict lookups and compares a handful of candidates, instead of comparing it with
+every image, and grouping the whole library is one such search per distinct hash. (A BK-tree does not help here:
+with 64 bit hashes and a useful distance it visits most of its nodes, and ends up slower than a linear scan.)
+
+usage: python metadupes.py [--root DIR] [--distance 6] [--copy] [--report groups.jsonl]
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+
+import metabatch
+import metaexif
+
+HASH_SIZE = 8  # hash is HASH_SIZE x HASH_SIZE bits
+
+# the hash is split into CHUNKS chunks of CHUNK_BITS bits for the HashIndex tables
+CHUNK_BITS = 16
+CHUNKS = HASH_SIZE * HASH_SIZE // CHUNK_BITS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# images whose hashes differ in at most this many bits are taken for duplicates
+DUPLICATE_DISTANCE = 6
+
+# fields copied from a tagged duplicate to its untagged twins
+COPIED_FIELDS = ("people", "location", "date", "group", "comment")
+
+if hasattr(int, "bit_count"):
+    def hamming_distance(first: int, second: int) -> int:
+        return (first ^ second).bit_count()
+else:
+    # python < 3.10
+    def hamming_distance(first: int, second: int) -> int:
+        return bin(first ^ second).count("1")
+
+
+def image_hash(path: str):
+    """
+    :return: 64 bit dHash of the upright image, or None if it could not be decoded
+    """
+    # imported here so the index workers only load Pillow when hashing is on, and the tree works without it
+    from PIL import Image
+
+    import metacache
+
+    try:
+        with Image.open(path) as image:
+            # the JPEG decoder can scale down (up to 8 times) while decoding; that is plenty for 9x8 pixels
+            image.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+            orientation = image.getexif().get(metaexif.ORIENTATION_TAG, 1)
+            grey = metacache.orient_image(image.convert("L"), orientation)
+        pixels = list(grey.resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX).getdata())
+    except Exception as e:
+        print(f"[ERROR] Failed to hash image [{path}] with error [{e}]")
+        return None
+
+    value = 0
+    for row in range(0, len(pixels), HASH_SIZE + 1):
+        for x in range(row, row + HASH_SIZE):
+            value = (value << 1) | (pixels[x] < pixels[x + 1])
+    return value
+
+
+def _hash_one(root: str, path: str):
+    # runs on a worker thread
+    return path, image_hash(os.path.join(root, path))
+
+
+def hash_images(root: str, paths, workers: int = 4):
+    """
+    Hash images on a pool of threads (Pillow decodes without holding the GIL)
+    :param paths: paths relative to root
+    :return: generator of (path, hash or None) tuples in completion order
+    """
+    return metabatch.map_bounded(_hash_one, ((root, path) for path in paths), workers)
+
+
+_flips = {}  # radius -> chunk masks, see _chunk_flips()
+
+
+def _chunk_flips(radius: int) -> list:
+    # every CHUNK_BITS bit mask with at most radius bits set
+    flips = _flips.get(radius)
+    if flips is None:
+        flips = [0]
+        for bits in range(1, radius + 1):
+            for positions in itertools.combinations(range(CHUNK_BITS), bits):
+                flips.append(sum(1 << position for position in positions))
+        _flips[radius] = flips
+    return flips
+
+
+class HashIndex:
+    """
+    Image hashes in a multi-index hash table: every distinct hash is filed under each of its CHUNKS chunks of
+    CHUNK_BITS bits. Two hashes within max_distance bits of each other have at least one chunk within
+    max_distance // CHUNKS bits (pigeonhole), so a search only looks up the chunk values that close to the query's
+    in each table and compares the few hashes found there, instead of every hash in the library.
+    """
+
+    def __init__(self):
+        self.hashes = {}  # image path -> hash
+        self.paths = {}  # hash -> paths of the images with that hash
+        self.tables = [{} for _ in range(CHUNKS)]  # per chunk: chunk value -> list of distinct hashes
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, path):
+        return path in self.hashes
+
+    def get(self, path: str):
+        return self.hashes.get(path)
+
+    def add(self, path: str, value: int):
+        if self.hashes.get(path) == value:
+            return
+        self.discard(path)
+        self.hashes[path] = value
+        paths = self.paths.get(value)
+        if paths is not None:
+            paths.append(path)
+            return
+        self.paths[value] = [path]
+        for chunk, table in enumerate(self.tables):
+            table.setdefault((value >> (chunk * CHUNK_BITS)) & CHUNK_MASK, []).append(value)
+
+    def discard(self, path: str):
+        value = self.hashes.pop(path, None)
+        if value is None:
+            return
+        paths = self.paths[value]
+        paths.remove(path)
+        if paths:
+            return
+        del self.paths[value]
+        for chunk, table in enumerate(self.tables):
+            key = (value >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+            bucket = table[key]
+            bucket.remove(value)
+            if not bucket:
+                del table[key]
+
+    def clear(self):
+        self.hashes = {}
+        self.paths = {}
+        self.tables = [{} for _ in range(CHUNKS)]
+
+    def _hashes_near(self, value: int, max_distance: int) -> dict:
+        # distinct hash -> distance, for every hash within max_distance of value
+        flips = _chunk_flips(max_distance // CHUNKS)
+        candidates = set()
+        for chunk, table in enumerate(self.tables):
+            key = (value >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+            get = table.get
+            for flip in flips:
+                bucket = get(key ^ flip)
+                if bucket is not None:
+                    candidates.update(bucket)
+        near = {}
+        for candidate in candidates:
+            distance = hamming_distance(value, candidate)
+            if distance <= max_distance:
+                near[candidate] = distance
+        return near
+
+    def search(self, value: int, max_distance: int = DUPLICATE_DISTANCE) -> list:
+        """
+        :return: (distance, path) of every image whose hash is within max_distance of value, closest first
+        """
+        return sorted(
+            (distance, path)
+            for candidate, distance in self._hashes_near(value, max_distance).items()
+            for path in self.paths[candidate]
+        )
+
+    def duplicates_of(self, path: str, max_distance: int = DUPLICATE_DISTANCE) -> list:
+        """
+        :return: paths of the images within max_distance of an image, closest first (without the image itself)
+        """
+        value = self.hashes.get(path)
+        if value is None:
+            return []
+        return [found for _, found in self.search(value, max_distance) if found != path]
+
+    def groups(self, max_distance: int = DUPLICATE_DISTANCE) -> list:
+        """
+        Group every image with its near-duplicates, transitively (A ~ B and B ~ C puts A, B and C together)
+        :return: lists of paths with more than one image each, largest group first
+        """
+        parents = {value: value for value in self.paths}  # union-find over the distinct hashes
+
+        def find(value):
+            while parents[value] != value:
+                parents[value] = parents[parents[value]]
+                value = parents[value]
+            return value
+
+        for value in self.paths:
+            for near in self._hashes_near(value, max_distance):
+                first, second = find(value), find(near)
+                if first != second:
+                    parents[second] = first
+
+        members = {}
+        for value, paths in self.paths.items():
+            members.setdefault(find(value), []).extend(paths)
+        found = [sorted(paths) for paths in members.values() if len(paths) > 1]
+        found.sort(key=lambda paths: (-len(paths), paths[0]))
+        return found
+
+
+def is_tagged(record: dict) -> bool:
+    """
+    :return: True if an indexed record has any of the copied fields filled in
+    """
+    return any(record.get(field) for field in COPIED_FIELDS)
+
+
+def copied_fields(description: dict) -> dict:
+    """
+    :return: the fields of a description that are copied to untagged duplicates
+    """
+    return {field: description[field] for field in COPIED_FIELDS if description.get(field)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default=".", help="library folder")
+    parser.add_argument("--distance", type=int, default=DUPLICATE_DISTANCE,
+                        help="most bits (of 64) in which duplicates' hashes may differ")
+    parser.add_argument("--copy", action="store_true",
+                        help="copy the tags of each group onto its untagged images, when its tagged images agree")
+    parser.add_argument("--report", help="write the groups (JSONL) here instead of stdout")
+    args = parser.parse_args(argv)
+
+    # imported here: metacore imports this module
+    import metacore
+
+    with metacore.Library(args.root, os.environ.get("METAEDIT_STORE", "")) as library:
+        library.scan()
+        library.index()
+        groups = library.duplicate_groups(args.distance)
+        report = open(args.report, "w", encoding="utf-8") if args.report else sys.stdout
+        copied = 0
+        try:
+            for paths in groups:
+                entry = {"paths": paths}
+                if args.copy:
+                    tagged = [path for path in paths if is_tagged(library.records.get(path, {}))]
+                    sources = {json.dumps(copied_fields(library.read(path)), sort_keys=True) for path in tagged}
+                    if len(sources) == 1:
+                        entry["copied_to"] = library.copy_to_duplicates(tagged[0], args.distance, paths)
+                        copied += len(entry["copied_to"])
+                    elif len(sources) > 1:
+                        entry["skipped"] = "tagged images disagree"
+                report.write(json.dumps(entry) + "\n")
+        finally:
+            if report is not sys.stdout:
+                report.close()
+
+    print(f"{len(groups)} groups of duplicates, {sum(len(paths) for paths in groups)} images"
+          + (f", tags copied to {copied} images" if args.copy else ""), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
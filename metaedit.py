@@ -1,38 +1,39 @@
-import asyncio
-import json
+import multiprocessing
 import os
-import shutil
+import queue
+import threading
+import time
 import tkinter as tk
-from os import walk
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from tkinter import filedialog
+from tkinter import filedialog, messagebox
 
-import piexif as piexif
 # import pyheif
 from PIL import ImageTk, Image
-from PIL.ExifTags import TAGS
-from PIL.TiffImagePlugin import IFDRational
 
-win = tk.Tk()
-win.geometry('1200x800')  # set window size
-
-panel = tk.Label(win)
-panel.grid(row=0, column=0, columnspan=3, rowspan=12, padx=0, pady=0)
+import metabatch
+import metacache
+import metacore
+import metadupes
+import metaexif
+import metaexport
+import metaindex
+import metajournal
+import metaprof
+import metaquery
+import metascan
+import metasearch
+import metastore
+import metawidgets
+
+# main window and image panel, created in __main__ so that worker processes can import this module
+win = None
+panel = None
 
 ###############
 # Global Vars #
 ###############
 
-# tags used in EXIF metadata
-# source: https://www.tranquillitybase.jp/PME/userguide/taggedFormat_en.html
-exif_tags = {
-    36880: "Offset Time",
-    36881: "Offset Time Original",
-    36882: "Offset Time Digitized",
-    42080: "Composite Image",
-    # 100000: "TEST"
-}
-
 # custom current photo attribute prefixes
 curr_people_prefix = "People:\t"
 curr_location_prefix = "Location:\t"
@@ -66,6 +67,7 @@ filter_location_entry = None
 filter_date_entry = None
 filter_group_entry = None
 filter_comment_entry = None
+filter_query_entry = None
 
 # used to control whether we write input/filter results or whether changes are from a photo switch
 change_img_was_clicked = False  # loading image metadata
@@ -73,6 +75,9 @@ change_filter_was_clicked = False  # filtering
 
 images = []
 
+# EXIF Orientation tag (piexif.ImageIFD.Orientation)
+ORIENTATION_TAG = 274
+
 # Set defaults that increase based upon viewed images -- this prevents us from cutting images off in the viewer
 max_scaled_height = 500
 max_img_width = 0
@@ -80,62 +85,180 @@ max_img_height = 0
 
 curr_img_path = None
 
+# decoded, scaled images for the panel (LRU, bounded by memory) and the threads that fill it ahead of next/prev
+# -- METAEDIT_CACHE_MB is the cache size in megabytes
+# -- METAEDIT_PREFETCH is how many images before and after the current one are decoded ahead of time
+display_cache_mb = int(os.environ.get("METAEDIT_CACHE_MB", "256"))
+prefetch_depth = int(os.environ.get("METAEDIT_PREFETCH", "2"))
+display_cache = metacache.ImageCache(display_cache_mb * 1024 * 1024)
+img_prefetcher = metacache.Prefetcher(display_cache, lambda img_path: decode_display_img(img_path))
+cache_stats_label = None
+
+# thumbnails for the grid view: the EXIF thumbnail when there is one, otherwise generated once and kept on disk
+# -- METAEDIT_THUMB_CACHE is the directory of the generated thumbnails
+thumbnail_cache = metacache.ThumbnailCache(
+    os.environ.get("METAEDIT_THUMB_CACHE", metacore.THUMBNAIL_DIR)
+)
+thumbnail_grid = None
+
 # controls our iteration through all available images
 curr_img_idx = -1
 
-# 1. all images are read in and imagedescription field is retained as dict with key being image filename
-# 2. on insert, dict is updated for given image filename to reflect inserted/changed data
-# 3. search iterates through all image dicts, looking for matches
-# store ImageDescription fields for filtering
+# 1. all images are read in and imagedescription field is retained, keyed by image filename
+# 2. on insert, the entry of the given image filename is updated to reflect inserted/changed data
+# 3. search goes through the search index, looking for matches
+# store ImageDescription fields for filtering: a read-only view of the library's search index (see
+# metasearch.RecordView), replaced when a library is opened
 indexed_images = {}
 
+# per-field search structures over indexed_images (see metasearch); always updated together with indexed_images
+# through set_indexed_record() and drop_indexed_record()
+search_index = metasearch.SearchIndex()
+
+# folder selected by the user; image paths are relative to it
+library_root = None
+
+# the selected library (see metacore); indexed_images, search_index, index_conn and metadata_store are its own
+library = None
+
+# on-disk index (sqlite) in the library root, so unchanged images are not re-parsed on every launch
+index_conn = None
+
+# indexing runs on a worker pool so the window stays usable
+# -- METAEDIT_INDEX_POOL is "process" (default, uses every core) or "thread"
+# -- METAEDIT_INDEX_WORKERS is the pool size (defaults to the number of cores)
+index_pool_kind = os.environ.get("METAEDIT_INDEX_POOL", "process")
+index_workers = int(os.environ.get("METAEDIT_INDEX_WORKERS", "0")) or os.cpu_count() or 4
+index_batch_size = 64  # images handed to a worker at a time
+index_poll_ms = 100  # how often finished batches are merged into indexed_images
+
+index_executor = None
+index_futures = []
+index_results = queue.Queue()
+index_job = 0  # incremented per indexing run so results of a cancelled run are ignored
+index_cached_entries = {}
+index_pending = 0
+index_total = 0
+index_done = 0
+index_started = 0
+index_last_refresh = 0
+index_progress_label = None
+
+# the library folder is walked on a background thread; found images are shown and indexed while the walk goes on
+discovering = False
+discovery_results = queue.Queue()
+discovery_batch_size = 256  # images handed to the Tk thread at a time (the first one is handed over on its own)
+discovery_poll_ms = 20
+
+# rescans look for images added, removed or modified since indexing; the folder is scanned on a background thread
+# -- METAEDIT_RESCAN_SECONDS rescans the folder every so many seconds (0, the default: only on "Rescan Folder")
+rescan_interval = int(os.environ.get("METAEDIT_RESCAN_SECONDS", "0"))
+rescan_thread = None
+rescan_results = queue.Queue()
+
+# images edited while indexing is running; their parsed (older) fields must not replace the edits
+edited_paths = set()
+
+# edits are buffered per image and written to the file once, after typing stops
+# -- METAEDIT_WRITE_DELAY_MS is the idle delay (ms) before buffered edits are written
+write_delay_ms = int(os.environ.get("METAEDIT_WRITE_DELAY_MS", "1500"))
+pending_writes = {}  # image path -> ImageDescription dict waiting to be written
+write_after_id = None
+
+# keeping edits out of the image files
+# -- METAEDIT_STORE is "sidecar" (a JSON file per folder) or "database" (one SQLite file) to keep edits there until
+#    they are synced into the images with "Sync to EXIF"; unset (the default) writes them into the images directly
+store_kind = os.environ.get("METAEDIT_STORE", "")
+metadata_store = None
+sync_thread = None
+sync_results = queue.Queue()
+sync_entries = {}  # image path -> stored fields being synced
+sync_counts = {}
+sync_started = 0
+sync_progress_label = None
+
 # global filter variables
 filter_people = []
 filter_location = ""
 filter_date = ""
 filter_group = ""
 filter_comment = ""
+filter_expression = ""  # structured query (see metaquery), combined with the field filters
 
-# UI rendered element to show all matching image files
+# UI rendered element to show all matching image files (only the visible rows are rendered)
 filterbox_lb = None
 
 # global to track all images being dispalyed in filterbox and availble for export (matching filters applied)
 filtered_images = []
 
+# query and search_index version that produced filtered_images; a query that only narrows this one (e.g. one more
+# character typed) is answered by re-checking filtered_images instead of the whole library
+filtered_query = None
+filtered_version = -1
+
+# export of filtered_images runs on a background thread; unchanged files already in the export folder are skipped
+# -- METAEDIT_EXPORT_DIR is the export folder (relative to the library folder unless absolute)
+# -- METAEDIT_EXPORT_WORKERS is the number of files copied at the same time
+# -- METAEDIT_EXPORT_LINK=1 hardlinks instead of copying (edits made later then show up in the export as well)
+export_dir = os.environ.get("METAEDIT_EXPORT_DIR", "filtered_images")
+export_workers = int(os.environ.get("METAEDIT_EXPORT_WORKERS", "8"))
+export_link = os.environ.get("METAEDIT_EXPORT_LINK", "") == "1"
+# -- METAEDIT_ARCHIVE_VOLUME_MB splits archive exports into volumes of at most this size (0: a single archive)
+archive_volume_mb = int(os.environ.get("METAEDIT_ARCHIVE_VOLUME_MB", "0"))
+export_results = queue.Queue()
+export_thread = None
+export_stats = None
+export_progress_label = None
+
+# near-duplicates are found through a perceptual hash of every image (see metadupes). Hashing decodes the images, so
+# it runs on a background thread the first time duplicates are looked for (see hashes_ready), and indexing only
+# reads the file headers
+# -- METAEDIT_HASH_IMAGES=1 hashes the images while indexing instead
+# -- METAEDIT_DUPLICATE_DISTANCE is the most bits (of 64) in which the hashes of duplicates may differ
+hash_images = os.environ.get("METAEDIT_HASH_IMAGES", "0") == "1"
+duplicate_distance = int(os.environ.get("METAEDIT_DUPLICATE_DISTANCE", str(metadupes.DUPLICATE_DISTANCE)))
+duplicates_label = None
+duplicates_thread = None
+duplicates_results = queue.Queue()
+hashing_thread = None
+hashing_results = queue.Queue()
+hashing_total = 0
+hashing_done = 0
+hashing_started = 0
+hashing_then = None  # the duplicates action that asked for the hashes, run again when they are done
+
+# batch edits of filtered_images are journaled so they can be resumed, rolled back or undone (see metajournal); one
+# batch runs at a time, on a background thread with METAEDIT_EXPORT_WORKERS files written at the same time
+batch_thread = None
+batch_results = queue.Queue()
+batch_title = ""
+batch_counts = {}
+batch_total = 0
+batch_started = 0
+batch_touched_current = False  # the batch wrote the image on screen, so it is shown again when the batch is done
+batch_progress_label = None
+
 
 ###########
 # Helpers #
 ###########
-def clear_entries():
-    global curr_img_idx, change_img_was_clicked, people_entry, location_entry, date_entry, \
-        group_entry, comment_entry, curr_people_label, curr_location_label, curr_date_label, \
+def clear_entries(clear_filters=True):
+    global curr_img_idx, curr_people_label, curr_location_label, curr_date_label, \
         curr_group_label, curr_comment_label, change_filter_was_clicked, filter_people_entry, \
         filter_location_entry, filter_date_entry, filter_group_entry, filter_comment_entry, \
-        filter_people, filter_location, filter_date, filter_group, filter_comment
+        filter_people, filter_location, filter_date, filter_group, filter_comment, filter_query_entry, \
+        filter_expression
 
-    # clear global search variables
-    filter_people = []
-    filter_location = ""
-    filter_date = ""
-    filter_group = ""
-    filter_comment = ""
+    if clear_filters:
+        # clear global search variables
+        filter_people = []
+        filter_location = ""
+        filter_date = ""
+        filter_group = ""
+        filter_comment = ""
+        filter_expression = ""
 
-    # input fields
-    if people_entry.get():
-        change_img_was_clicked = True
-        people_entry.delete(0, "end")
-    if location_entry.get():
-        change_img_was_clicked = True
-        location_entry.delete(0, "end")
-    if date_entry.get():
-        change_img_was_clicked = True
-        date_entry.delete(0, "end")
-    if group_entry.get():
-        change_img_was_clicked = True
-        group_entry.delete(0, "end")
-    if comment_entry.get():
-        change_img_was_clicked = True
-        comment_entry.delete(0, "end")
+    clear_input_entries()
 
     # current image fields (existing data)
     curr_people_label.configure(text=curr_people_prefix)
@@ -144,6 +267,9 @@ def clear_entries():
     curr_group_label.configure(text=curr_group_prefix)
     curr_comment_label.configure(text=curr_comment_prefix)
 
+    if not clear_filters:
+        return
+
     # search filters
     if filter_people_entry.get():
         change_filter_was_clicked = True
@@ -160,57 +286,397 @@ def clear_entries():
     if filter_comment_entry.get():
         change_filter_was_clicked = True
         filter_comment_entry.delete(0, "end")
+    if filter_query_entry.get():
+        change_filter_was_clicked = True
+        filter_query_entry.delete(0, "end")
+
+
+def clear_input_entries():
+    global change_img_was_clicked
+
+    # input fields; change_img_was_clicked keeps write_input from writing the cleared text
+    if people_entry.get():
+        change_img_was_clicked = True
+        people_entry.delete(0, "end")
+    if location_entry.get():
+        change_img_was_clicked = True
+        location_entry.delete(0, "end")
+    if date_entry.get():
+        change_img_was_clicked = True
+        date_entry.delete(0, "end")
+    if group_entry.get():
+        change_img_was_clicked = True
+        group_entry.delete(0, "end")
+    if comment_entry.get():
+        change_img_was_clicked = True
+        comment_entry.delete(0, "end")
+
+
+def set_editing(enabled: bool):
+    """
+    Turn the input fields on or off. They are off while a batch writes images on a background thread, so that
+    edits (written by flush_pending_writes() on the Tk thread) cannot write the same file at the same time.
+    """
+    if not enabled:
+        # a disabled entry ignores delete(), so it is emptied first; clear_entries() then has nothing to clear
+        clear_input_entries()
+    for entry in (people_entry, location_entry, date_entry, group_entry, comment_entry):
+        entry.configure(state="normal" if enabled else "disabled")
 
     # show all photos in filter results
     filter_images("", None)
 
 
-async def index_images():
-    global indexed_images
+@metaprof.timed()
+def index_images(paths=None):
+    """
+    Start indexing every image in the library on a worker pool. This returns right away; results stream into
+    indexed_images from the Tk main loop (see poll_index_results) so the window stays usable while indexing.
+    :param paths: only (re)parse these images, e.g. the ones a rescan found added or modified
+    """
+    global indexed_images, index_conn, index_executor, index_futures, index_job, index_cached_entries, \
+        index_pending, index_total, index_done, index_started, index_last_refresh, edited_paths
+
+    cancel_indexing()
 
-    for img_filename in images:
-        # parse image file
-        image = get_parsed_img(img_filename)
-        if image is None:
-            print(f"[ERROR] Failed to parse image [{img_filename}] while indexing images.")
+    if paths is None:
+        paths = images
+        # only images that are new or changed since the last run (by size and mtime) are parsed again
+        index_cached_entries = metaindex.load_index(index_conn)
+
+        # cached records can be searched right away; the workers only confirm that they are still current
+        for img_filename in images:
+            cached = index_cached_entries.get(img_filename)
+            if cached is not None and img_filename not in indexed_images:
+                restore_cached_record(img_filename, cached)
+    else:
+        # the caller already knows these changed, so there is nothing to check them against
+        index_cached_entries = {}
+
+    if index_pool_kind == "process":
+        index_executor = ProcessPoolExecutor(max_workers=index_workers)
+    else:
+        index_executor = ThreadPoolExecutor(max_workers=index_workers)
+
+    index_job += 1
+    index_futures = []
+    index_pending = 0
+    index_total = 0
+    index_done = 0
+    index_started = time.perf_counter()
+    index_last_refresh = index_started
+    edited_paths = set()
+
+    queue_index_batches(paths)
+    win.after(index_poll_ms, poll_index_results)
+
+
+def queue_index_batches(paths):
+    """
+    Hand images to the running indexing pool, e.g. as discovery finds them
+    """
+    global index_futures, index_pending, index_total
+
+    index_total += len(paths)
+    for start in range(0, len(paths), index_batch_size):
+        batch = []
+        for img_filename in paths[start:start + index_batch_size]:
+            cached = index_cached_entries.get(img_filename)
+            if cached is None:
+                batch.append((img_filename, None, None))
+            else:
+                batch.append((img_filename, cached[0], cached[1]))
+        future = index_executor.submit(metaindex.index_batch, batch, "", hash_images)
+        # callbacks run on a pool thread, so results are handed to the Tk thread through a queue
+        future.add_done_callback(lambda f, job=index_job: index_results.put((job, f)))
+        index_futures.append(future)
+        index_pending += 1
+
+
+@metaprof.timed()
+def poll_index_results():
+    global indexed_images, index_pending, index_done, index_last_refresh
+
+    changed = False
+    while True:
+        try:
+            job, future = index_results.get_nowait()
+        except queue.Empty:
+            break
+
+        # results of a cancelled or restarted indexing run
+        if job != index_job or future.cancelled():
             continue
 
-        # get exif data out of image
-        exif_data = image.getexif()
+        index_pending -= 1
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"[ERROR] Failed to index a batch of images with error [{e}]")
+            continue
 
-        indexed_images[img_filename] = {}
+        for img_filename, status, size, mtime_ns, record, image_hash in results:
+            index_done += 1
+            if status == "failed":
+                if img_filename in indexed_images:
+                    drop_indexed_record(img_filename)
+                    changed = True
+                if size is not None:
+                    # so the next run or rescan doesn't parse it again while it is unchanged
+                    metaindex.store_failed(index_conn, img_filename, size, mtime_ns)
+            elif status == "parsed":
+                # the user edited this image while it was being parsed; keep the edited fields, but not without a
+                # hash: editing the description doesn't change the picture
+                if img_filename in edited_paths:
+                    if image_hash is not None:
+                        library.image_hashes.add(img_filename, image_hash)
+                        # the entry written for the edit (if it was written yet) gets it too; later ones take it
+                        # from library.image_hashes
+                        metaindex.store_hash(index_conn, img_filename, image_hash)
+                    continue
+                if metadata_store is not None:
+                    stored = metadata_store.get(img_filename)
+                    if stored:
+                        record.update(metaindex.record_from_description(stored))
+                set_indexed_record(img_filename, record)
+                if image_hash is not None:
+                    library.image_hashes.add(img_filename, image_hash)
+                metaindex.store_record(index_conn, img_filename, size, mtime_ns, record, image_hash)
+                changed = True
+
+    elapsed = time.perf_counter() - index_started
+    files_per_sec = index_done / elapsed if elapsed > 0 else 0
+
+    # while discovery is still walking the folder, more images keep arriving for this run
+    if index_pending > 0 or discovering:
+        found = " found so far" if discovering else ""
+        index_progress_label.configure(
+            text=f"Indexing {index_done}/{index_total} files{found} ({files_per_sec:.0f} files/s)"
+        )
+        # refreshing the results is not free, so only do it every so often while indexing
+        if changed and time.perf_counter() - index_last_refresh > 1:
+            index_conn.commit()
+            index_last_refresh = time.perf_counter()
+            filter_images("", None)
+        win.after(index_poll_ms, poll_index_results)
+        return
 
-        # ImageDescription field is set for image and contains a dictionary object
-        if piexif.ImageIFD.ImageDescription in exif_data:
-            try:
-                # extract ImageDescription field using metadata code
-                img_desc_parsed = json.loads(exif_data[piexif.ImageIFD.ImageDescription])
-
-                if 'location' in img_desc_parsed:
-                    indexed_images[img_filename]['location'] = img_desc_parsed['location'].strip()
-                if 'date' in img_desc_parsed:
-                    indexed_images[img_filename]['date'] = img_desc_parsed['date'].strip()
-                if 'group' in img_desc_parsed:
-                    indexed_images[img_filename]['group'] = img_desc_parsed['group'].strip()
-                if 'comment' in img_desc_parsed:
-                    indexed_images[img_filename]['comment'] = img_desc_parsed['comment'].strip()
-                if 'people' in img_desc_parsed:
-                    people_set = set()
-                    people_list = img_desc_parsed['people'].split(",")
-                    for person in people_list:
-                        people_set.add(person.strip())
-                    indexed_images[img_filename]['people'] = people_set
-            except json.decoder.JSONDecodeError as e:
-                print(
-                    f"[ERROR] Failed to decode image description [{img_filename}]. "
-                    f"Setting fields to empty for filtering purposes."
-                )
+    # drop entries for images that no longer exist in the library
+    library_images = set(images)
+    metaindex.remove_records(
+        index_conn, [path for path in index_cached_entries if path not in library_images]
+    )
+    index_conn.commit()
+    index_executor.shutdown(wait=False)
+    metaprof.record("indexing_run", elapsed, index_started)
+    index_progress_label.configure(
+        text=f"Indexed {index_done} files in {elapsed:.1f}s ({files_per_sec:.0f} files/s)"
+    )
+    filter_images("", None)
+    # rank the suggestions now rather than on the first key press
+    search_index.prepare_completions()
+
+
+def cancel_indexing():
+    global index_executor, index_futures, index_job
+
+    if index_executor is None:
+        return
+    # bumping the job number makes poll_index_results ignore batches that were already running
+    index_job += 1
+    for future in index_futures:
+        future.cancel()
+    index_executor.shutdown(wait=False)
+    index_executor = None
+    index_futures = []
+
+
+def set_indexed_record(img_filename, record):
+    library.set_record(img_filename, record)
+
+
+def drop_indexed_record(img_filename):
+    library.drop_record(img_filename)
+
+
+def restore_cached_record(img_filename, cached):
+    # an entry of the on-disk index: (size, mtime_ns, record, image hash); no record if it could not be parsed
+    if cached[2] is None:
+        return
+    set_indexed_record(img_filename, cached[2])
+    if cached[3] is not None:
+        library.image_hashes.add(img_filename, cached[3])
+
+
+def rebuild_index():
+    """
+    Throw away the on-disk index and re-parse every image in the library
+    """
+    cancel_indexing()
+    metaindex.clear_index(index_conn)
+    indexed_images.clear()
+    search_index.clear()
+    library.image_hashes.clear()
+    library.unhashable.clear()
+    filter_images("", None)
+    index_images()
+
+
+def discover_images(root):
+    """
+    Walk the library folder on a background thread, handing found images to the Tk thread in batches (see
+    poll_discovery_results). The first image is handed over on its own so it can be shown right away.
+    """
+    global discovering
+
+    discovering = True
+
+    def run_discovery():
+        batch = []
+        last_put = time.perf_counter()
+        first = True
+        try:
+            for path, size, mtime_ns in metascan.scan_images(root, [export_dir]):
+                batch.append(path)
+                if first or len(batch) >= discovery_batch_size or time.perf_counter() - last_put > 0.1:
+                    discovery_results.put(batch)
+                    batch = []
+                    last_put = time.perf_counter()
+                    first = False
+        except Exception as e:
+            print(f"[ERROR] Failed to scan [{root}] with error [{e}]")
+        finally:
+            discovery_results.put(batch)
+            discovery_results.put(None)
+
+    threading.Thread(target=run_discovery, daemon=True).start()
+    win.after(discovery_poll_ms, poll_discovery_results)
+
+
+@metaprof.timed()
+def poll_discovery_results():
+    global discovering, index_last_refresh
+
+    found = []
+    finished = False
+    while True:
+        try:
+            batch = discovery_results.get_nowait()
+        except queue.Empty:
+            break
+        if batch is None:
+            finished = True
+            break
+        found.extend(batch)
+
+    if found:
+        images.extend(found)
+        # cached records are searchable right away, like in index_images()
+        for img_filename in found:
+            cached = index_cached_entries.get(img_filename)
+            if cached is not None and img_filename not in indexed_images:
+                restore_cached_record(img_filename, cached)
+        if index_executor is not None:
+            queue_index_batches(found)
+        # show the first image as soon as there is one
+        if curr_img_idx == -1:
+            next_img()
+        if time.perf_counter() - index_last_refresh > 1:
+            index_last_refresh = time.perf_counter()
+            filter_images("", None)
+
+    if finished:
+        discovering = False
+        filter_images("", None)
+        return
+    win.after(discovery_poll_ms, poll_discovery_results)
+
+
+def is_indexing():
+    return discovering or (index_executor is not None and index_pending > 0)
+
+
+def rescan_library():
+    """
+    Pick up images that were added, removed or modified since the library was indexed, without a restart. The folder
+    is scanned on a background thread and compared with the index by size and mtime; only added and modified images
+    are parsed again (see poll_rescan_results).
+    """
+    global rescan_thread
+
+    if rescan_thread is not None or is_indexing():
+        return  # still busy; whatever changed is picked up by the next rescan
+    # our own edits change size and mtime too; once written, the index has the new values
+    flush_pending_writes()
+
+    indexed_stats = metaindex.load_file_stats(index_conn)
+    known = {img_filename: indexed_stats.get(img_filename) for img_filename in images}
+    started = time.perf_counter()
+
+    def run_scan():
+        try:
+            scanned = {
+                path: (size, mtime_ns) for path, size, mtime_ns in metascan.scan_images(library_root, [export_dir])
+            }
+            rescan_results.put((metascan.diff_scan(known, scanned), time.perf_counter() - started))
+        except Exception as e:
+            print(f"[ERROR] Failed to rescan [{library_root}] with error [{e}]")
+            rescan_results.put(None)
+
+    rescan_thread = threading.Thread(target=run_scan, daemon=True)
+    rescan_thread.start()
+    win.after(index_poll_ms, poll_rescan_results)
+
+
+def poll_rescan_results():
+    global rescan_thread, curr_img_idx
+
+    try:
+        result = rescan_results.get_nowait()
+    except queue.Empty:
+        win.after(index_poll_ms, poll_rescan_results)
+        return
+    rescan_thread = None
+    if result is None:
+        return
+    (added, removed, modified), elapsed = result
+
+    if removed:
+        removed_set = set(removed)
+        # keep the current position: if the current image is gone, next_img() continues with the one after it
+        curr_img_idx = sum(1 for img_filename in images[:curr_img_idx + 1] if img_filename not in removed_set) - 1
+        images[:] = [img_filename for img_filename in images if img_filename not in removed_set]
+        for img_filename in removed:
+            drop_indexed_record(img_filename)
+            display_cache.discard(img_filename)
+            pending_writes.pop(img_filename, None)
+        metaindex.remove_records(index_conn, removed)
+        index_conn.commit()
+    images.extend(added)
+    for img_filename in modified:
+        display_cache.discard(img_filename)
+
+    index_progress_label.configure(
+        text=f"Rescanned in {elapsed:.1f}s: {len(added)} added, {len(removed)} removed, {len(modified)} modified"
+    )
+    if added or modified:
+        # refreshes the filter results once the changed images are parsed
+        index_images(added + modified)
+    elif removed:
+        filter_images("", None)
+
+
+def poll_library():
+    rescan_library()
+    win.after(rescan_interval * 1000, poll_library)
 
 
 ####################
 # Parse image file #
 ####################
+@metaprof.timed()
 def get_parsed_img(img):
+    # only used for display; indexing reads the ImageDescription header-only (see metaexif)
     # fixme: this processing doesn't work... heif_file.metadata or heif_file.data works properly,
     #  but the Image.frombytes() call fails to retain/parse the metadata :(
     try:
@@ -240,25 +706,31 @@ def get_parsed_img(img):
 ##############################
 # Resize image to fit screen #
 ##############################
+@metaprof.timed()
 def resize_img(image):
-    global max_scaled_height, max_img_width, max_img_height
-    # if image height > width, then it is a vertically taken picture and PIL rotates it so rotate it back
-    if image.size[0] > image.size[1]:
-        image = image.rotate(270)
+    # note: this also runs on the prefetch threads, so it must not touch any GUI state
+    # the camera records how the stored pixels are turned; 5-8 mean they are on their side
+    orientation = image.getexif().get(ORIENTATION_TAG, 1)
+    if orientation in (5, 6, 7, 8):
+        displayed_height = image.size[0]
+    else:
+        displayed_height = image.size[1]
 
-    scaled_height = image.size[1] / max_scaled_height
+    scaled_height = displayed_height / max_scaled_height
 
-    new_width = int(image.size[0] / scaled_height)
-    new_height = int(image.size[1] / scaled_height)
+    new_width = max(1, int(image.size[0] / scaled_height))
+    new_height = max(1, int(image.size[1] / scaled_height))
 
-    # update maximum image sizes
-    if new_width > max_img_width:
-        max_img_width = new_width
-    if new_height > max_img_height:
-        max_img_height = new_height
+    # let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding (DCT scaling), so the full resolution
+    # is never decoded; the result is still at least as big as the target size
+    if image.format == "JPEG":
+        image.draft("RGB", (new_width, new_height))
 
-    image = image.resize((new_width, new_height), Image.ANTIALIAS)
-    return image
+    # LANCZOS is what Image.ANTIALIAS used to be an alias of (removed in Pillow 10)
+    image = image.resize((new_width, new_height), Image.LANCZOS)
+
+    # rotate/flip after downscaling, when there are far fewer pixels to move
+    return metacache.orient_image(image, orientation)
 
 
 #############################
@@ -267,27 +739,56 @@ def resize_img(image):
 def display_updated_photo_attributes(image_desc_dict: dict):
     global curr_people_label, curr_location_label, curr_date_label, curr_group_label, curr_comment_label
     if 'people' in image_desc_dict:
-        if isinstance(image_desc_dict['people'], str):
-            curr_people_label.configure(text=curr_people_prefix + image_desc_dict['people'])
-        else:
-            # list case (multiple people in photo)
-            screen_str = curr_people_prefix + ', '.join(image_desc_dict['people'][:-1]) + image_desc_dict['people'][-1]
-            curr_people_label.configure(text=screen_str)
-    if 'location' in image_desc_dict:
-        curr_location_label.configure(text=curr_location_prefix + image_desc_dict['location'])
-    if 'date' in image_desc_dict:
-        curr_date_label.configure(text=curr_date_prefix + image_desc_dict['date'])
-    if 'group' in image_desc_dict:
-        curr_group_label.configure(text=curr_group_prefix + image_desc_dict['group'])
-    if 'comment' in image_desc_dict:
-        curr_comment_label.configure(text=curr_comment_prefix + image_desc_dict['comment'])
+        # a list (multiple people in photo) or comma separated text
+        curr_people_label.configure(
+            text=curr_people_prefix + ', '.join(metaindex.people_list(image_desc_dict['people']))
+        )
+    # other tools may have written numbers (e.g. "date": 1962) or nulls
+    if image_desc_dict.get('location') is not None:
+        curr_location_label.configure(text=curr_location_prefix + str(image_desc_dict['location']))
+    if image_desc_dict.get('date') is not None:
+        curr_date_label.configure(text=curr_date_prefix + str(image_desc_dict['date']))
+    if image_desc_dict.get('group') is not None:
+        curr_group_label.configure(text=curr_group_prefix + str(image_desc_dict['group']))
+    if image_desc_dict.get('comment') is not None:
+        curr_comment_label.configure(text=curr_comment_prefix + str(image_desc_dict['comment']))
+
+
+@metaprof.timed()
+def decode_display_img(display_image):
+    """
+    Decode and scale an image for the panel. This also runs on the prefetch threads, so no Tk calls in here.
+    :return: display-ready image, or None if the image could not be parsed
+    """
+    # parse image file
+    image = get_parsed_img(display_image)
+    if image is None:
+        return None
 
+    # resize image to fit screen; the resized copy is fully loaded, so the file handle can be released
+    try:
+        return resize_img(image)
+    except Exception as e:
+        print(f"[ERROR] Failed to decode image [{display_image}] with error [{e}]")
+        return None
+    finally:
+        image.close()
 
+
+@metaprof.timed()
 def load_img(display_image):
     global max_scaled_height, max_img_width, max_img_height, curr_img_path
 
-    # parse image file
-    image = get_parsed_img(display_image)
+    # use the cached copy if there is one; a prefetch thread may also be decoding it right now
+    image = display_cache.get(display_image)
+    if image is None:
+        in_progress = img_prefetcher.pending(display_image)
+        if in_progress is not None:
+            image = in_progress.result()
+        else:
+            image = decode_display_img(display_image)
+            if image is not None:
+                display_cache.put(display_image, image)
     if image is None:
         print(f"[ERROR] Failed to parse image [{display_image}]")
         return
@@ -295,8 +796,11 @@ def load_img(display_image):
     # update path since we were able to parse the image
     curr_img_path = display_image
 
-    # resize image to fit screen
-    image = resize_img(image)
+    # update maximum image sizes
+    if image.size[0] > max_img_width:
+        max_img_width = image.size[0]
+    if image.size[1] > max_img_height:
+        max_img_height = image.size[1]
 
     #############################
     # Set image for Tkinter GUI #
@@ -307,51 +811,66 @@ def load_img(display_image):
     panel['image'] = tk_image
     panel.config(height=max_scaled_height + 50, width=max_img_width + 50)
 
-    #####################
-    # extract EXIF data #
-    #####################
+    # update current image attributes on UI; these come from the file (or the edit buffer), not from the cached
+    # image, since the metadata may have been edited after the image was decoded
+    curr_photo_image_desc = pending_writes.get(display_image)
+    if curr_photo_image_desc is None:
+        curr_photo_image_desc = read_img_desc(display_image)
+    display_updated_photo_attributes(curr_photo_image_desc)
 
-    exif_data = image.getexif()
+    # get the images around this one ready for next/prev
+    prefetch_neighbour_imgs()
+    cache_stats_label.configure(
+        text=f"Image cache: {display_cache.hits} hits, {display_cache.misses} misses "
+             f"({display_cache.total_bytes / (1024 * 1024):.0f} MB)"
+    )
 
-    parsed_data = {}
-
-    # iterating over all EXIF data fields
-    for tag_id in exif_data:
-        # get the tag name, instead of human unreadable tag id
-        tag = TAGS.get(tag_id, tag_id)
-
-        # skip these tags as they are unwieldy
-        if tag in ('JPEGThumbnail', 'TIFFThumbnail', 'Filename',
-                   'MakerNote'):
-            continue
-        elif tag in exif_tags.keys():
-            tag = exif_tags.get(tag)
-
-        data = exif_data.get(tag_id)
-        # decode bytes
-        if isinstance(data, bytes):
-            data = data.decode()
-        elif isinstance(data, int) or isinstance(data, str) or isinstance(data, tuple):
-            data = data
-        elif isinstance(data, IFDRational):
-            ifdr = IFDRational(data)
-            data = str(ifdr.numerator) + "/" + str(ifdr.denominator)
-        else:
-            print(f"[ERROR] Invalid metadata tag [{tag}] and tag_id [{tag_id}]: [{data}] with type [{type(data)}]")
-            continue
-        parsed_data[tag] = data
 
-    # update current image attributes on UI
-    if 'ImageDescription' in parsed_data:
-        curr_photo_image_desc = json.loads(parsed_data['ImageDescription'])
-        display_updated_photo_attributes(curr_photo_image_desc)
+def prefetch_neighbour_imgs():
+    # nearest first, alternating forwards and backwards
+    neighbours = []
+    for offset in range(1, prefetch_depth + 1):
+        for img_idx in (curr_img_idx + offset, curr_img_idx - offset):
+            if 0 <= img_idx < len(images):
+                neighbours.append(images[img_idx])
+    img_prefetcher.prefetch(neighbours)
 
 
 ###########################
 # insert custom EXIF data #
 ###########################
+def read_img_desc(img_path):
+    """
+    Read the ImageDescription dict of an image, with the edits kept in the metadata store (if any) merged over it
+    :return: dict of fields; empty if there is none or it does not use our scheme
+    """
+    embedded = read_embedded_desc(img_path)
+    if metadata_store is None:
+        return embedded
+    return metastore.merge(embedded, metadata_store.get(img_path))
+
+
+def read_embedded_desc(img_path):
+    """
+    Read the ImageDescription dict currently stored in an image file
+    :return: dict of fields; empty if there is none or it does not use our scheme
+    """
+    try:
+        return metaexif.parse_image_description(metaexif.read_image_description(img_path))
+    except ValueError:
+        # e.g. was: b'Processed with VSCO with b1 preset'
+        # if it is not our scheme, overwrite as empty dictionary (this is our metadata tag!)
+        print(f"[ERROR] Failed to decode image description for [{img_path}]")
+        return {}
+    except OSError as e:
+        print(f"[ERROR] Failed to read image description for [{img_path}] with error [{e}]")
+        return {}
+
+
+@metaprof.timed()
 def write_input(text, data_key):
-    # note: this gets called on every key press while user is focused in any input box
+    # note: this gets called on every key press while user is focused in any input box, so the edit is only
+    # buffered here and written to the file later by flush_pending_writes()
     global curr_img_path, curr_people_label, curr_location_label, curr_date_label, curr_group_label, \
         curr_comment_label, change_img_was_clicked, indexed_images
 
@@ -360,92 +879,158 @@ def write_input(text, data_key):
         change_img_was_clicked = False
         return
 
-    img_desc = {
-        "people": [],
-        "location": "",
-        "date": "",
-        "group": "",
-        "comment": ""
-    }
-
-    # todo: AUTOCOMPLETE
-    #   - https://stackoverflow.com/questions/58428545/clarify-functionality-of-tkinter-autocomplete-entry
-
-    exif_dict = piexif.load(curr_img_path)
-    # create paths if they do not exist
-    # update them if they do
-    if '0th' in exif_dict:
-        if piexif.ImageIFD.ImageDescription in exif_dict['0th']:
-            # check if value is a btyes string and attempt to decode to json
-            # if it is not our scheme, overwrite as empty dictionary (this is our metadata tag!)
-            if isinstance(exif_dict['0th'][piexif.ImageIFD.ImageDescription], bytes):
-                try:
-                    curr_desc = json.loads(exif_dict['0th'][piexif.ImageIFD.ImageDescription].decode('ascii'))
-                except Exception as e:
-                    # e.g. was: b'Processed with VSCO with b1 preset'
-                    print(f"[ERROR] Failed to decode binary string object for [{curr_img_path}]")
-                    curr_desc = {}
-            else:
-                curr_desc = json.loads(exif_dict['0th'][piexif.ImageIFD.ImageDescription])
-        else:
-            exif_dict['0th'][piexif.ImageIFD.ImageDescription] = {}
-            curr_desc = {}
-    else:
-        exif_dict['0th'] = {
-            piexif.ImageIFD.ImageDescription: {}
-        }
-        curr_desc = {}
-    if data_key in img_desc:
-        text_data = text.get().strip()
-        if data_key == "people":
-            people_to_write = text_data.split(",")
-            people_list_to_write = [person.strip() for person in people_to_write]
-            curr_desc[data_key] = people_list_to_write
-            if people_entry.get():
-                curr_people_label.configure(text=curr_people_prefix + text_data)
-            if data_key in indexed_images[curr_img_path]:
-                people_set = set()
-                [people_set.add(person) for person in people_list_to_write]
-                indexed_images[curr_img_path][data_key] = people_set
-        if data_key == "location":
-            curr_desc[data_key] = text_data
-            if location_entry.get():
-                curr_location_label.configure(text=curr_location_prefix + text_data)
-        if data_key == "date":
-            curr_desc[data_key] = text_data
-            if date_entry.get():
-                curr_date_label.configure(text=curr_date_prefix + text_data)
-        if data_key == "group":
-            curr_desc[data_key] = text_data
-            if group_entry.get():
-                curr_group_label.configure(text=curr_group_prefix + text_data)
-        if data_key == "comment":
-            curr_desc[data_key] = text_data
-            if comment_entry.get():
-                curr_comment_label.configure(text=curr_comment_prefix + text_data)
-        else:
-            curr_desc[data_key] = text_data
+    if data_key not in ("people", "location", "date", "group", "comment"):
+        return
+    # the entry boxes take input before the first image is shown
+    if curr_img_path is None:
+        return
+
+    edited_paths.add(curr_img_path)
+
+    # the first edit of an image starts from the description in the file; later ones keep editing the buffer
+    curr_desc = pending_writes.get(curr_img_path)
+    if curr_desc is None:
+        curr_desc = read_img_desc(curr_img_path)
+
+    text_data = text.get().strip()
+    # people are stored as a list of names, the other fields as text
+    curr_desc[data_key] = metaindex.people_list(text_data) if data_key == "people" else text_data
 
-        # already covered the special people set case above
-        if data_key != "people" and data_key in indexed_images[curr_img_path]:
-            indexed_images[curr_img_path][data_key] = text_data
+    # update the on-screen labels right away
+    if data_key == "people" and people_entry.get():
+        curr_people_label.configure(text=curr_people_prefix + text_data)
+    if data_key == "location" and location_entry.get():
+        curr_location_label.configure(text=curr_location_prefix + text_data)
+    if data_key == "date" and date_entry.get():
+        curr_date_label.configure(text=curr_date_prefix + text_data)
+    if data_key == "group" and group_entry.get():
+        curr_group_label.configure(text=curr_group_prefix + text_data)
+    if data_key == "comment" and comment_entry.get():
+        curr_comment_label.configure(text=curr_comment_prefix + text_data)
 
-    # dump updated dictionary as value into exif object
-    exif_dict['0th'][piexif.ImageIFD.ImageDescription] = json.dumps(curr_desc)
+    # filtering sees the edit immediately, even though the file is written later
+    set_indexed_record(curr_img_path, metaindex.record_from_description(curr_desc))
 
-    # overwrite photo exif data
-    exif_bytes = piexif.dump(exif_dict)
-    piexif.insert(exif_bytes, curr_img_path)
+    pending_writes[curr_img_path] = curr_desc
+    schedule_pending_writes()
+
+
+def schedule_pending_writes():
+    global write_after_id
+
+    # restart the idle timer on every edit so a burst of key presses ends up as a single write
+    if write_after_id is not None:
+        win.after_cancel(write_after_id)
+    write_after_id = win.after(write_delay_ms, flush_pending_writes)
+
+
+@metaprof.timed()
+def flush_pending_writes():
+    """
+    Write every buffered edit to its image file (called after the idle delay, on image change and on quit)
+    """
+    global pending_writes, write_after_id
+
+    if write_after_id is not None:
+        win.after_cancel(write_after_id)
+        write_after_id = None
+
+    writes = pending_writes
+    pending_writes = {}
+    for img_path, img_desc in writes.items():
+        # into the image, or into the metadata store if there is one; the on-disk index follows
+        try:
+            library.save(img_path, img_desc)
+        except Exception as e:
+            print(f"[ERROR] Failed to write image description for [{img_path}] with error [{e}]")
+
+
+def sync_to_exif():
+    """
+    Write every edit kept in the metadata store into its image file, on a background thread. Returns right away;
+    progress is shown by poll_sync_results().
+    """
+    global sync_thread, sync_entries, sync_counts, sync_started
+
+    if metadata_store is None or sync_thread is not None:
+        return
+    flush_pending_writes()
+    sync_entries = metadata_store.entries()
+    if not sync_entries:
+        sync_progress_label.configure(text="Nothing to sync")
+        return
+    sync_counts = {"written": 0, "unchanged": 0, "missing": 0, "failed": 0}
+    sync_started = time.perf_counter()
+    entries = dict(sync_entries)
+
+    def run_sync():
+        try:
+            for result in metabatch.apply_manifest(library_root, entries, export_workers):
+                sync_results.put(result)
+        finally:
+            sync_results.put(None)
+
+    sync_thread = threading.Thread(target=run_sync, daemon=True)
+    sync_thread.start()
+    win.after(index_poll_ms, poll_sync_results)
+
+
+def poll_sync_results():
+    global sync_thread
+
+    finished = False
+    written = False
+    while True:
+        try:
+            result = sync_results.get_nowait()
+        except queue.Empty:
+            break
+        if result is None:
+            finished = True
+            break
+        path, status = result["path"], result["status"]
+        sync_counts[status] += 1
+        if status == "failed" or status == "missing":
+            print(f"[ERROR] Failed to sync image [{path}] with error [{result['error']}]")
+            continue
+        # an image edited again while it was being synced keeps its newer entry
+        metadata_store.remove(path, sync_entries[path])
+        if status == "written":
+            # the file changed, so its index entry needs the new size and mtime
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                print(f"[ERROR] Failed to stat image [{path}] with error [{e}] while updating the index.")
+                continue
+            metaindex.store_record(
+                index_conn, path, stat.st_size, stat.st_mtime_ns, indexed_images.get(path, {}),
+                library.image_hashes.get(path)
+            )
+            written = True
+    metadata_store.commit()
+    if written:
+        index_conn.commit()
+
+    done = sum(sync_counts.values())
+    elapsed = time.perf_counter() - sync_started
+    summary = (f"{done}/{len(sync_entries)} files ({done / elapsed if elapsed > 0 else 0:.0f} files/s), "
+               f"{sync_counts['failed'] + sync_counts['missing']} errors")
+    if finished:
+        sync_thread = None
+        metaprof.record("sync_run", elapsed, sync_started)
+        sync_progress_label.configure(text="Synced " + summary)
+        return
+    sync_progress_label.configure(text="Syncing " + summary)
+    win.after(index_poll_ms, poll_sync_results)
 
 
 #############
 # Filtering #
 #############
+@metaprof.timed()
 def filter_images(text, text_type):
-    global indexed_images, filter_people, filter_location, filter_date, filter_group, filter_comment, \
-        filterbox_lb, filtered_images
-
-    filterbox_lb.delete('0', 'end')
+    global filter_people, filter_location, filter_date, filter_group, filter_comment, filter_expression, \
+        filterbox_lb, filtered_images, filtered_query, filtered_version
 
     if text_type is not None:
         # convert from tkinter StringVar to string or list
@@ -453,60 +1038,502 @@ def filter_images(text, text_type):
 
     # update globals based upon changing text; leave other filters as previously set
     # this function is not responsible for clearing input on image change
-    if len(text) > 0:
-        if text_type == "people":
-            people_to_filter = text.split(",")
-            filter_people = [person.strip().lower() for person in people_to_filter]
-        if text_type == "location":
-            filter_location = text.lower()
-        if text_type == "date":
-            filter_date = text.lower()
-        if text_type == "group":
-            filter_group = text.lower()
-        if text_type == "comment":
-            filter_comment = text.lower()
-
-    box_idx = 0
+    if text_type == "people":
+        people_to_filter = text.split(",") if len(text) > 0 else []
+        filter_people = [person.strip().lower() for person in people_to_filter]
+    if text_type == "location":
+        filter_location = text.lower()
+    if text_type == "date":
+        filter_date = text.lower()
+    if text_type == "group":
+        filter_group = text.lower()
+    if text_type == "comment":
+        filter_comment = text.lower()
+    if text_type == "query":
+        filter_expression = text
 
     # require full matches or empty filter variables
-    filtered_images = []
-    for image, image_data in indexed_images.items():
-        location_match = filter_location == "" or (
-                'location' in image_data and filter_location in image_data['location'].lower())
-        date_match = filter_date == "" or ('date' in image_data and filter_date in image_data['date'].lower())
-        group_match = filter_group == "" or ('group' in image_data and filter_group in image_data['group'].lower())
-        comment_match = filter_comment == "" or (
-                'comment' in image_data and filter_comment in image_data['comment'].lower())
-        if len(filter_people) > 0 and 'people' not in image_data:
-            people_match = False
-        else:
-            people_match = True
-        # don't do this work if the simple matches failed or people are being filtered for
-        if people_match and location_match and date_match and group_match and comment_match:
-            for person in filter_people:
-                lowercase_people = [p.lower() for p in image_data['people']]
-                if person not in lowercase_people:
-                    people_match = False
-                    break
+    query = (tuple(filter_people), filter_location, filter_date, filter_group, filter_comment)
+    query_error = None
+    if filtered_query is not None and filtered_version == search_index.version \
+            and text_type != "query" and metasearch.is_refinement(filtered_query, query):
+        new_filtered_images = search_index.refine(filtered_images, *query)
+    else:
+        new_filtered_images = search_index.query(*query)
+        # the structured query is often incomplete while it is being typed; it is then left out until it parses
+        try:
+            expression_matches = metaquery.run_query(search_index, filter_expression)
+        except metaquery.QueryError as e:
+            query_error = str(e)
+            expression_matches = None
+        if expression_matches is not None:
+            new_filtered_images = [path for path in new_filtered_images if path in expression_matches]
+
+    filtered_images = new_filtered_images
+    with metaprof.span("filter_images.widgets"):
+        filterbox_lb.set_items(filtered_images)
+        if query_error is not None:
+            filterbox_lb.count_label.configure(text=f"{len(filtered_images)} matching images (query: {query_error})")
+        if thumbnail_grid is not None:
+            thumbnail_grid.set_items(filtered_images)
+    filtered_query = query
+    filtered_version = search_index.version
+
+
+##############
+# Duplicates #
+##############
+def show_filtered(paths, summary):
+    """
+    Show a list of images in the filter results in place of the filter matches, until a filter changes
+    """
+    global filtered_images, filtered_query
+
+    filtered_images = paths
+    # the next filter change runs a full query rather than refining this list
+    filtered_query = None
+    filterbox_lb.set_items(filtered_images)
+    filterbox_lb.count_label.configure(text=summary)
+    if thumbnail_grid is not None:
+        thumbnail_grid.set_items(filtered_images)
+
+
+def hashes_ready(then) -> bool:
+    """
+    Check that every indexed image has its perceptual hash. If some don't, they are hashed on a background thread
+    (see poll_hashing_results), after which then() is called.
+    :return: True if the duplicates actions can go ahead now
+    """
+    global hashing_thread, hashing_total, hashing_done, hashing_started, hashing_then
+
+    if hashing_thread is not None:
+        hashing_then = then
+        return False
+    paths = library.unhashed_images()
+    if not paths:
+        return True
+    hashing_total = len(paths)
+    hashing_done = 0
+    hashing_started = time.perf_counter()
+    hashing_then = then
+
+    def run_hashing():
+        try:
+            for result in metadupes.hash_images(library_root, paths, index_workers):
+                hashing_results.put(result)
+        except Exception as e:
+            print(f"[ERROR] Failed to hash images with error [{e}]")
+        finally:
+            hashing_results.put(None)
+
+    duplicates_label.configure(text=f"Hashing {hashing_total} images...")
+    hashing_thread = threading.Thread(target=run_hashing, daemon=True)
+    hashing_thread.start()
+    win.after(index_poll_ms, poll_hashing_results)
+    return False
+
+
+def poll_hashing_results():
+    global hashing_thread, hashing_done
+
+    finished = False
+    while True:
+        try:
+            result = hashing_results.get_nowait()
+        except queue.Empty:
+            break
+        if result is None:
+            finished = True
+            break
+        path, image_hash = result
+        hashing_done += 1
+        if image_hash is None:
+            library.unhashable.add(path)
+        elif path in indexed_images:
+            library.image_hashes.add(path, image_hash)
+            metaindex.store_hash(index_conn, path, image_hash)
+
+    if not finished:
+        duplicates_label.configure(text=f"Hashing {hashing_done}/{hashing_total} images...")
+        win.after(index_poll_ms, poll_hashing_results)
+        return
+    hashing_thread = None
+    index_conn.commit()
+    metaprof.record("duplicate_hashing", time.perf_counter() - hashing_started, hashing_started)
+    duplicates_label.configure(text=f"Hashed {hashing_total} images")
+    hashing_then()
+
+
+def show_duplicates():
+    """
+    Show the current image and its near-duplicates, closest first
+    """
+    if curr_img_path is None or not hashes_ready(show_duplicates):
+        return
+    if curr_img_path not in library.image_hashes:
+        duplicates_label.configure(text="This image has no hash (yet)")
+        return
+    duplicates = library.duplicates(curr_img_path, duplicate_distance)
+    show_filtered([curr_img_path] + duplicates, f"{len(duplicates)} duplicates of {curr_img_path}")
+
+
+def show_all_duplicates():
+    """
+    Show every group of near-duplicates in the library, one group after the other. Grouping a large library takes
+    a while, so it runs on a background thread over a copy of the hashes (see poll_duplicates_results).
+    """
+    global duplicates_thread
+
+    if duplicates_thread is not None or not hashes_ready(show_all_duplicates):
+        return
+    hashes = dict(library.image_hashes.hashes)
+    started = time.perf_counter()
 
-        if people_match and location_match and date_match and group_match and comment_match:
-            filterbox_lb.insert(box_idx, image)
-            filtered_images.append(image)
-            box_idx += 1
+    def run_grouping():
+        try:
+            image_hashes = metadupes.HashIndex()
+            for path, image_hash in hashes.items():
+                image_hashes.add(path, image_hash)
+            duplicates_results.put((image_hashes.groups(duplicate_distance), time.perf_counter() - started))
+        except Exception as e:
+            print(f"[ERROR] Failed to group duplicates with error [{e}]")
+            duplicates_results.put(None)
+
+    duplicates_label.configure(text=f"Grouping {len(hashes)} images...")
+    duplicates_thread = threading.Thread(target=run_grouping, daemon=True)
+    duplicates_thread.start()
+    win.after(index_poll_ms, poll_duplicates_results)
+
+
+def poll_duplicates_results():
+    global duplicates_thread
+
+    try:
+        result = duplicates_results.get_nowait()
+    except queue.Empty:
+        win.after(index_poll_ms, poll_duplicates_results)
+        return
+    duplicates_thread = None
+    if result is None:
+        duplicates_label.configure(text="Failed to group duplicates")
+        return
+    groups, elapsed = result
+    metaprof.record("duplicate_groups", elapsed)
+    paths = [path for group in groups for path in group]
+    show_filtered(paths, f"{len(paths)} images in {len(groups)} groups of duplicates")
+    duplicates_label.configure(text=f"Grouped {len(library.image_hashes)} images in {elapsed:.1f}s")
+
+
+def copy_tags_to_duplicates():
+    """
+    Copy the tags of the current image onto its untagged near-duplicates
+    """
+    # hashed first, so library.duplicates() has nothing left to hash on the Tk thread
+    if curr_img_path is None or not hashes_ready(copy_tags_to_duplicates):
+        return
+    flush_pending_writes()
+    targets = library.duplicates(curr_img_path, duplicate_distance)
+    try:
+        written = library.copy_to_duplicates(curr_img_path, targets=targets)
+    except Exception as e:
+        print(f"[ERROR] Failed to copy tags of [{curr_img_path}] to its duplicates with error [{e}]")
+        return
+    # indexing that is still running must not overwrite the copied tags with what it parsed before
+    edited_paths.update(written)
+    duplicates_label.configure(text=f"Tags copied to {len(written)} of {len(targets)} duplicates")
+    filter_images("", None)
+
+
+###############
+# Batch edits #
+###############
+def open_batch_editor():
+    """
+    Dialog to set fields on every image in filtered_images at once; people are added to the ones already tagged
+    """
+    if not filtered_images or batch_thread is not None:
+        return
+    paths = list(filtered_images)
+    dialog = tk.Toplevel(win)
+    dialog.title("Edit Filtered Images")
+
+    field_svs = {}
+    labels = (("people", "Add people"), ("location", "Location"), ("date", "Date"), ("group", "Group"),
+              ("comment", "Comments"))
+    for row, (field, text) in enumerate(labels):
+        tk.Label(dialog, text=text).grid(column=0, row=row, sticky=tk.E)
+        field_svs[field] = tk.StringVar()
+        entry = tk.Entry(dialog, textvariable=field_svs[field], bd=5)
+        entry.grid(column=1, row=row)
+        if field in metasearch.COMPLETION_FIELDS:
+            metawidgets.Autocomplete(entry, suggester(field), separator="," if field == "people" else None)
+
+    def apply():
+        fields = {field: sv.get().strip() for field, sv in field_svs.items() if sv.get().strip()}
+        if not fields:
+            return
+        dialog.destroy()
+        run_batch(
+            lambda: metajournal.start_batch(library_root, paths, fields, export_workers, metadata_store),
+            len(paths), "Edited", metadata_store is not None
+        )
+
+    tk.Button(dialog, text=f"Apply to {len(paths)} images", command=apply).grid(column=1, row=len(labels))
+
+
+def undo_last_batch():
+    """
+    Give every image of the last batch edit its prior description back, after asking
+    """
+    if batch_thread is not None:
+        return
+    batch = library.last_batch()
+    if batch is None:
+        batch_progress_label.configure(text="Nothing to undo")
+        return
+    if not messagebox.askyesno("Undo batch edit", f"Undo {metajournal.describe(batch)}?"):
+        return
+    # a partly undone batch only has the images left that failed to restore
+    total = batch["counts"].get("unreverted", 0) if batch["state"] == metajournal.PARTIAL else batch["images"]
+    run_batch(
+        lambda: metajournal.revert_batch(library_root, batch["id"], export_workers, metadata_store),
+        total, "Undone", batch["target"] == "store"
+    )
+
+
+def recover_batches():
+    """
+    At launch: resume or roll back (the user picks) a batch edit that was interrupted, e.g. because the editor was
+    killed while it ran; an interrupted undo is finished. Further interrupted batches are handled on later launches.
+    """
+    unfinished = library.unfinished_batches()
+    if not unfinished:
+        return
+    batch = unfinished[0]
+    if batch["state"] == metajournal.UNDOING:
+        resume = False
+    else:
+        resume = messagebox.askyesno(
+            "Interrupted batch edit", f"The {metajournal.describe(batch)} was interrupted.\n\n"
+                                      f"Finish it? Choosing No rolls it back."
+        )
+    if resume:
+        run_batch(
+            lambda: metajournal.resume_batch(library_root, batch["id"], export_workers, metadata_store),
+            batch["counts"].get("pending", 0), "Resumed", batch["target"] == "store"
+        )
+    else:
+        run_batch(
+            lambda: metajournal.revert_batch(library_root, batch["id"], export_workers, metadata_store),
+            batch["images"], "Rolled back", batch["target"] == "store"
+        )
+
+
+def run_batch(make_results, total, title, in_store):
+    """
+    Run a batch of metajournal, on a background thread when it writes the images; returns right away and the
+    results are handed to the Tk thread (see poll_batch_results). Editing is turned off until a background batch
+    finishes (see set_editing).
+    :param make_results: returns the generator of per-file results; called on the thread that runs the batch
+    :param in_store: True if the batch goes into the metadata store rather than the images
+    """
+    global batch_thread, batch_title, batch_counts, batch_total, batch_started, batch_touched_current
+
+    if batch_thread is not None:
+        return
+    flush_pending_writes()
+    batch_title = title
+    batch_counts = {}
+    batch_total = total
+    batch_started = time.perf_counter()
+    batch_touched_current = False
+
+    if in_store:
+        # the store belongs to the Tk thread; putting edits into it is quick, so the batch runs right here
+        try:
+            for result in make_results():
+                handle_batch_result(result)
+        except ValueError as e:
+            print(f"[ERROR] Failed to run batch with error [{e}]")
+        finish_batch()
+        return
+
+    def run():
+        try:
+            for result in make_results():
+                batch_results.put(result)
+        except Exception as e:
+            print(f"[ERROR] Failed to run batch with error [{e}]")
+        finally:
+            batch_results.put(None)
+
+    # flushed above; no new edits until finish_batch()
+    set_editing(False)
+    batch_thread = threading.Thread(target=run, daemon=True)
+    batch_thread.start()
+    win.after(index_poll_ms, poll_batch_results)
+
+
+def handle_batch_result(result):
+    global batch_touched_current
+
+    path, status = result["path"], result["status"]
+    batch_counts[status] = batch_counts.get(status, 0) + 1
+    if status not in ("written", "unchanged"):
+        print(f"[ERROR] Failed to edit image [{path}] in a batch with error [{result['error']}]")
+        return
+    if "description" not in result:
+        return
+    record = metaindex.record_from_description(result["description"])
+    # indexing that is still running must not overwrite the batch's edit with what it parsed before
+    edited_paths.add(path)
+    set_indexed_record(path, record)
+    if path == curr_img_path:
+        batch_touched_current = True
+    if "size" in result:
+        size, mtime_ns = result["size"], result["mtime_ns"]
+    else:
+        # edits that went into the metadata store leave the file as it is
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            print(f"[ERROR] Failed to stat image [{path}] with error [{e}] while updating the index.")
+            return
+        size, mtime_ns = stat.st_size, stat.st_mtime_ns
+    metaindex.store_record(index_conn, path, size, mtime_ns, record, library.image_hashes.get(path))
+
+
+def poll_batch_results():
+    global batch_thread
+
+    finished = False
+    while True:
+        try:
+            result = batch_results.get_nowait()
+        except queue.Empty:
+            break
+        if result is None:
+            finished = True
+            break
+        handle_batch_result(result)
+
+    if finished:
+        batch_thread = None
+        set_editing(True)
+        finish_batch()
+        return
+    done = sum(batch_counts.values())
+    elapsed = time.perf_counter() - batch_started
+    errors = done - batch_counts.get("written", 0) - batch_counts.get("unchanged", 0)
+    batch_progress_label.configure(
+        text=f"{batch_title} {done}/{batch_total} files ({done / elapsed if elapsed > 0 else 0:.0f} files/s), "
+             f"{errors} errors"
+    )
+    win.after(index_poll_ms, poll_batch_results)
+
+
+def finish_batch():
+    index_conn.commit()
+    done = sum(batch_counts.values())
+    elapsed = time.perf_counter() - batch_started
+    metaprof.record("batch_run", elapsed, batch_started)
+    # the per-file log stays in the journal (python metajournal.py --log ID)
+    counts = ", ".join(f"{count} {status}" for status, count in sorted(batch_counts.items()))
+    batch_progress_label.configure(
+        text=f"{batch_title} {done} files in {elapsed:.1f}s ({done / elapsed if elapsed > 0 else 0:.0f} files/s)"
+             + (f": {counts}" if counts else "")
+             + (" (Undo Last Batch retries the failed ones)"
+                if batch_title in ("Undone", "Rolled back") and batch_counts.keys() & {"failed", "missing"} else "")
+    )
+    filter_images("", None)
+    if batch_touched_current:
+        jump_to_img(curr_img_path)
 
 
 #############
 # Exporting #
 #############
+@metaprof.timed()
 def export_images():
-    new_directory = "filtered_images"
+    """
+    Copy filtered_images into the export folder, keeping their folders
+    """
     try:
-        os.mkdir(new_directory)
-    except FileExistsError:
-        shutil.rmtree(new_directory)
-    os.mkdir(new_directory)
-    for image_filename in filtered_images:
-        shutil.copy2(image_filename, new_directory + "/" + image_filename)
+        metaexport.check_destination(os.getcwd(), export_dir)
+    except metaexport.ExportError as e:
+        export_progress_label.configure(text=f"Not exported: {e}")
+        return
+    start_export(lambda paths: metaexport.export_files(os.getcwd(), paths, export_dir, export_workers, export_link))
+
+
+@metaprof.timed()
+def export_archive():
+    """
+    Stream filtered_images into a ZIP or TAR archive picked by the user, without copying them to a folder first
+    """
+    archive_path = filedialog.asksaveasfilename(
+        initialdir=os.getcwd(), defaultextension=".zip",
+        filetypes=[("ZIP archive", "*.zip"), ("TAR archive", "*.tar")]
+    )
+    if not archive_path:
+        return
+    volume_size = int(archive_volume_mb * 1024 * 1024)
+    start_export(lambda paths: metaexport.export_archive(os.getcwd(), paths, archive_path, volume_size))
+
+
+def start_export(exporter):
+    """
+    Run an export of filtered_images on a background thread. Returns right away; progress is shown by
+    poll_export_results().
+    :param exporter: callable taking the image paths and returning a generator of metaexport results
+    """
+    global export_thread, export_stats
+
+    if export_thread is not None:
+        return  # an export is still running
+    # the exported files should carry the latest edits
+    flush_pending_writes()
+
+    paths = list(filtered_images)
+    export_stats = metaexport.ExportStats(len(paths))
+
+    def run_export():
+        try:
+            for result in exporter(paths):
+                export_results.put(result)
+        except (OSError, metaexport.ExportError) as e:
+            print(f"[ERROR] Failed to export images with error [{e}]")
+        finally:
+            export_results.put(None)
+
+    export_thread = threading.Thread(target=run_export, daemon=True)
+    export_thread.start()
+    win.after(index_poll_ms, poll_export_results)
+
+
+def poll_export_results():
+    global export_thread
+
+    finished = False
+    while True:
+        try:
+            result = export_results.get_nowait()
+        except queue.Empty:
+            break
+        if result is None:
+            finished = True
+            break
+        export_stats.add(result)
+        if result["status"] == "failed":
+            print(f"[ERROR] Failed to export image [{result['path']}] with error [{result['error']}]")
+
+    if finished:
+        export_thread = None
+        metaprof.record("export_run", time.perf_counter() - export_stats.started, export_stats.started)
+        export_progress_label.configure(text="Exported " + export_stats.summary())
+        return
+    export_progress_label.configure(text="Exporting " + export_stats.summary())
+    win.after(index_poll_ms, poll_export_results)
 
 
 ################
@@ -514,6 +1541,7 @@ def export_images():
 ################
 def prev_img():
     global curr_img_idx
+    flush_pending_writes()
     if curr_img_idx - 1 < 0:
         return  # if there are no previous images, do nothing
     else:
@@ -528,6 +1556,7 @@ def prev_img():
 
 def next_img():
     global curr_img_idx, people_sv, location_sv, date_sv, people_entry, location_entry, date_entry
+    flush_pending_writes()
     if curr_img_idx + 1 >= len(images):
         return  # if there are no more images, do nothing
     else:
@@ -540,10 +1569,61 @@ def next_img():
     load_img(next_image)
 
 
+def quit_app():
+    # don't leave the pool working through the rest of the library after the window is gone
+    flush_pending_writes()
+    if library is not None:
+        library.close()
+    cancel_indexing()
+    img_prefetcher.shutdown()
+    win.quit()
+
+
+def jump_to_img(img_path):
+    """
+    Show an image picked from the filter results; the filters are kept so the results stay in place
+    """
+    global curr_img_idx
+    flush_pending_writes()
+    try:
+        curr_img_idx = images.index(img_path)
+    except ValueError:
+        print(f"[ERROR] Image [{img_path}] is no longer in the library")
+        return
+    clear_entries(clear_filters=False)
+    load_img(img_path)
+
+
+def open_thumbnail_grid():
+    """
+    Show the filter results as a grid of thumbnails; clicking one opens it in the editor
+    """
+    global thumbnail_grid
+    if thumbnail_grid is not None:
+        thumbnail_grid.lift()
+        return
+
+    def on_close():
+        global thumbnail_grid
+        thumbnail_grid = None
+
+    thumbnail_grid = metawidgets.ThumbnailGrid(win, thumbnail_cache.load, on_select=jump_to_img, on_close=on_close)
+    thumbnail_grid.set_items(filtered_images)
+
+
+@metaprof.timed()
+def suggest_values(field, text):
+    return search_index.suggest(field, text)
+
+
+def suggester(field):
+    return lambda text: suggest_values(field, text)
+
+
 def display_editor():
     global curr_people_label, curr_location_label, curr_date_label, curr_group_label, curr_comment_label, \
         people_sv, location_sv, date_sv, group_sv, comment_sv, \
-        people_entry, location_entry, date_entry, group_entry, comment_entry
+        people_entry, location_entry, date_entry, group_entry, comment_entry, cache_stats_label
 
     # create vertical scrollbar
     # see: https://www.youtube.com/watch?v=0WafQCaok6g
@@ -574,6 +1654,9 @@ def display_editor():
     curr_date_label.grid(column=1, row=14, sticky=tk.W)
     curr_group_label.grid(column=1, row=15, sticky=tk.W)
     curr_comment_label.grid(column=1, row=16, sticky=tk.W)
+    # -- image cache statistics
+    cache_stats_label = tk.Label(win, text="")
+    cache_stats_label.grid(column=1, row=17, sticky=tk.W)
 
     # create string vars for live text input
     people_sv = tk.StringVar()
@@ -603,8 +1686,13 @@ def display_editor():
     group_entry.grid(column=4, row=4)
     comment_entry.grid(column=4, row=5)
 
+    # suggest known people, locations and groups while typing
+    metawidgets.Autocomplete(people_entry, suggester("people"), separator=",")
+    metawidgets.Autocomplete(location_entry, suggester("location"))
+    metawidgets.Autocomplete(group_entry, suggester("group"))
+
     # create buttons
-    button_exit = tk.Button(win, text="Quit Application", command=win.quit)
+    button_exit = tk.Button(win, text="Quit Application", command=quit_app)
     button_prev = tk.Button(text='Previous image', command=prev_img)
     button_next = tk.Button(text='Next image', command=next_img)
     # button_save = tk.Button(text="Save image", command=save_img)
@@ -621,7 +1709,8 @@ def display_editor():
 
 def display_search():
     global filter_people_entry, filter_location_entry, filter_date_entry, \
-        filter_group_entry, filter_comment_entry, filterbox_lb
+        filter_group_entry, filter_comment_entry, filter_query_entry, filterbox_lb, index_progress_label, \
+        export_progress_label, sync_progress_label, duplicates_label, batch_progress_label
 
     # create label widgets
     filter_people_label = tk.Label(win, text="Filter by People: ")
@@ -665,36 +1754,83 @@ def display_search():
     filter_group_entry.grid(column=4, row=11)
     filter_comment_entry.grid(column=4, row=12)
 
-    # create listbox widget
-    filterbox_lb = tk.Listbox(win, height=10, width=25, bg="grey", activestyle='dotbox', font="Helvetica", fg="yellow")
+    metawidgets.Autocomplete(filter_people_entry, suggester("people"), separator=",")
+    metawidgets.Autocomplete(filter_location_entry, suggester("location"))
+    metawidgets.Autocomplete(filter_group_entry, suggester("group"))
+
+    # structured query, e.g.: people:"ann smith" AND (location:paris OR location:rome) AND date:1960..1965
+    filter_query_label = tk.Label(win, text="Query: ")
+    filter_query_label.grid(column=3, row=7, sticky=tk.E)
+    filter_query_sv = tk.StringVar()
+    filter_query_sv.trace("w", lambda name, index, mode, sv=filter_query_sv: filter_images(sv, "query"))
+    filter_query_entry = tk.Entry(win, textvariable=filter_query_sv, bd=5)
+    filter_query_entry.grid(column=4, row=7)
+
+    # create listbox widget; it only renders the visible rows, so it copes with any number of matches
+    filterbox_lb = metawidgets.VirtualListbox(
+        win, height=10, on_select=jump_to_img,
+        width=25, bg="grey", activestyle='dotbox', font="Helvetica", fg="yellow"
+    )
 
     # arrange search components
     filterbox_lb.grid(column=4, row=13, columnspan=2, rowspan=4, pady=2)
 
     # create buttons
     button_export = tk.Button(win, text="Export Filtered Results", command=export_images)
+    button_archive = tk.Button(win, text="Export as Archive", command=export_archive)
+    button_rebuild = tk.Button(win, text="Rebuild Index", command=rebuild_index)
+    button_thumbnails = tk.Button(win, text="Browse Thumbnails", command=open_thumbnail_grid)
+    button_rescan = tk.Button(win, text="Rescan Folder", command=rescan_library)
+    button_duplicates = tk.Button(win, text="Find Duplicates", command=show_duplicates)
+    button_all_duplicates = tk.Button(win, text="All Duplicates", command=show_all_duplicates)
+    button_copy_tags = tk.Button(win, text="Copy Tags to Duplicates", command=copy_tags_to_duplicates)
+    button_batch = tk.Button(win, text="Edit Filtered Images", command=open_batch_editor)
+    button_undo_batch = tk.Button(win, text="Undo Last Batch", command=undo_last_batch)
 
     # arrange buttons
     button_export.grid(column=4, row=18)
+    button_rebuild.grid(column=4, row=19)
+    button_thumbnails.grid(column=5, row=18)
+    button_archive.grid(column=5, row=19)
+    button_rescan.grid(column=4, row=20)
+    button_duplicates.grid(column=4, row=21)
+    button_all_duplicates.grid(column=5, row=21)
+    button_copy_tags.grid(column=4, row=22)
+    button_batch.grid(column=4, row=23)
+    button_undo_batch.grid(column=5, row=23)
+
+    # edits kept in a metadata store are written into the images on request
+    if metadata_store is not None:
+        button_sync = tk.Button(win, text="Sync to EXIF", command=sync_to_exif)
+        button_sync.grid(column=5, row=20)
+        sync_progress_label = tk.Label(win, text="")
+        sync_progress_label.grid(column=3, row=20, sticky=tk.E)
+
+    # duplicate search and tag copying
+    duplicates_label = tk.Label(win, text="")
+    duplicates_label.grid(column=3, row=21, sticky=tk.E)
+
+    # batch edit progress and throughput
+    batch_progress_label = tk.Label(win, text="")
+    batch_progress_label.grid(column=3, row=23, sticky=tk.E)
+
+    # indexing progress
+    index_progress_label = tk.Label(win, text="")
+    index_progress_label.grid(column=3, row=19, sticky=tk.E)
+
+    # export progress and throughput
+    export_progress_label = tk.Label(win, text="")
+    export_progress_label.grid(column=3, row=18, sticky=tk.E)
 
     filter_images("", None)
 
 
-def is_image_file(filename: str):
-    # at minimum, must be ".jpg" (4) or larger like ".jpeg" (5)
-    if not len(filename) > 4:
-        return False
-    is_jpg = filename[-3:].lower() == 'jpg' or filename[-4:].lower() == 'jpeg'
-
-    return is_jpg
-
-
 def pick_path():
     """
     Prompt user to select directory where photos are located
     :return: bool indicating if path is valid
     """
-    global images
+    global images, index_conn, library_root, library, metadata_store, indexed_images, search_index
 
     home = str(Path.home())
     selected_path = filedialog.askdirectory(initialdir=home)
@@ -702,25 +1838,41 @@ def pick_path():
         return False
     else:
         os.chdir(selected_path)
-
-        files = []
-        for (dirpath, dirnames, filenames) in walk(selected_path):
-            files.extend(filenames)
-
-        images = []
-        for filename in files:
-            if is_image_file(filename):
-                images.append(filename)
+        library_root = selected_path
 
         button_pick_path.destroy()
 
-        asyncio.run(index_images())
+        library = metacore.Library(selected_path, store_kind)
+        index_conn = library.index_conn
+        metadata_store = library.store
+        indexed_images = library.records
+        search_index = library.search_index
 
+        # images (paths relative to the library folder) are filled in while discovery walks the folder; the
+        # first one is shown as soon as it is found, and indexing starts on each batch as it arrives
+        images = []
         display_search()
         display_editor()
+        index_images()
+        discover_images(selected_path)
+        # after index_images(), which starts with no edited images
+        recover_batches()
+        if rescan_interval > 0:
+            win.after(rescan_interval * 1000, poll_library)
+
+
+if __name__ == "__main__":
+    # needed for the indexing process pool in frozen (pyinstaller) builds
+    multiprocessing.freeze_support()
+
+    win = tk.Tk()
+    win.geometry('1200x800')  # set window size
+    win.protocol("WM_DELETE_WINDOW", quit_app)
 
+    panel = tk.Label(win)
+    panel.grid(row=0, column=0, columnspan=3, rowspan=12, padx=0, pady=0)
 
-button_pick_path = tk.Button(text='Click to select image folder', command=pick_path)
-button_pick_path.grid(column=win.grid_size()[1], row=win.grid_size()[0])
+    button_pick_path = tk.Button(text='Click to select image folder', command=pick_path)
+    button_pick_path.grid(column=win.grid_size()[1], row=win.grid_size()[0])
 
-win.mainloop()
+    win.mainloop()
@@ -0,0 +1,347 @@
+"""
+Header-only access to the EXIF ImageDescription field of JPEG files.
+
+Only the JPEG markers up to the APP1/EXIF segment and the entries of IFD0 are read, using a handful of small
+seek+read calls, so the compressed image data is never touched and no PIL image object is created. Writes patch the
+value in place when it fits and otherwise replace the file atomically.
+"""
+import json
+import os
+import shutil
+import struct
+import tempfile
+
+# tag ids (piexif.ImageIFD.ImageDescription, Orientation, JPEGInterchangeFormat, JPEGInterchangeFormatLength)
+IMAGE_DESCRIPTION_TAG = 270
+ORIENTATION_TAG = 274
+THUMBNAIL_OFFSET_TAG = 513
+THUMBNAIL_LENGTH_TAG = 514
+
+# TIFF field types and their sizes in bytes
+TYPE_BYTE = 1
+TYPE_ASCII = 2
+TYPE_SHORT = 3
+TYPE_LONG = 4
+TYPE_UNDEFINED = 7
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+# JPEG markers
+MARKER_SOI = 0xD8
+MARKER_APP1 = 0xE1
+MARKER_COM = 0xFE
+
+EXIF_HEADER = b"Exif\x00\x00"
+
+# rewritten descriptions get this much spare room (rounded to a multiple of it) so later edits can be patched in place
+DESCRIPTION_PADDING = 256
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _unpack(fmt: str, data: bytes):
+    # a truncated file gives short reads; callers handle every malformed file as a ValueError
+    try:
+        return struct.unpack(fmt, data)
+    except struct.error:
+        raise ValueError("truncated EXIF") from None
+
+
+def find_exif_segment(f):
+    """
+    Walk the JPEG markers until the APP1/EXIF segment is found
+    :param f: file object opened in binary mode
+    :return: (offset of the TIFF header, length of the TIFF data) or None if the file has no EXIF segment
+    """
+    f.seek(0)
+    if f.read(2) != b"\xff" + bytes([MARKER_SOI]):
+        raise ValueError("not a JPEG file")
+
+    while True:
+        marker_bytes = f.read(2)
+        if len(marker_bytes) < 2 or marker_bytes[0] != 0xFF:
+            return None
+        marker = marker_bytes[1]
+        if marker == 0xFF:
+            # fill byte in front of the actual marker
+            f.seek(-1, 1)
+            continue
+
+        # EXIF has to come before the frame/scan data, so stop at the first non APPn/COM marker
+        if not (0xE0 <= marker <= 0xEF or marker == MARKER_COM):
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = _unpack(">H", length_bytes)[0]
+        if marker == MARKER_APP1 and length >= 2 + len(EXIF_HEADER) + 8:
+            if f.read(len(EXIF_HEADER)) == EXIF_HEADER:
+                return f.tell(), length - 2 - len(EXIF_HEADER)
+            f.seek(-len(EXIF_HEADER), 1)
+        f.seek(length - 2, 1)
+
+
+def _read_tiff_header(f, tiff_start: int):
+    """
+    :return: (struct endian prefix, offset of IFD0) or None if this is not a TIFF header
+    """
+    f.seek(tiff_start)
+    tiff_header = f.read(8)
+    if tiff_header[:2] == b"II":
+        endian = "<"
+    elif tiff_header[:2] == b"MM":
+        endian = ">"
+    else:
+        return None
+    return endian, _unpack(endian + "L", tiff_header[4:8])[0]
+
+
+def _read_ifd(f, tiff_start: int, tiff_length: int, endian: str, ifd_offset: int):
+    """
+    Read the entries of one IFD
+    :return: (dict of tag -> (file offset of the entry, type, count, file offset of the value), offset of the next
+        IFD or 0), or None if the IFD lies outside of the TIFF data
+    """
+    if ifd_offset < 8 or ifd_offset + 2 > tiff_length:
+        return None
+    f.seek(tiff_start + ifd_offset)
+    entry_count = _unpack(endian + "H", f.read(2))[0]
+    data = f.read(12 * entry_count + 4)
+    if len(data) < 12 * entry_count + 4:
+        return None
+
+    entries = {}
+    for i in range(entry_count):
+        tag_id, field_type, count = _unpack(endian + "HHL", data[i * 12:i * 12 + 8])
+        entry_pos = tiff_start + ifd_offset + 2 + i * 12
+        if count * TYPE_SIZES.get(field_type, 1) <= 4:
+            # small values are stored inline in the entry itself
+            value_pos = entry_pos + 8
+        else:
+            value_offset = _unpack(endian + "L", data[i * 12 + 8:i * 12 + 12])[0]
+            if value_offset + count * TYPE_SIZES.get(field_type, 1) > tiff_length:
+                continue
+            value_pos = tiff_start + value_offset
+        entries[tag_id] = (entry_pos, field_type, count, value_pos)
+    next_ifd_offset = _unpack(endian + "L", data[12 * entry_count:12 * entry_count + 4])[0]
+    return entries, next_ifd_offset
+
+
+def _read_int(f, endian: str, entry):
+    # value of a single SHORT or LONG entry
+    entry_pos, field_type, count, value_pos = entry
+    f.seek(value_pos)
+    if field_type == TYPE_SHORT:
+        return _unpack(endian + "H", f.read(2))[0]
+    if field_type == TYPE_LONG:
+        return _unpack(endian + "L", f.read(4))[0]
+    return None
+
+
+def find_ifd0_entry(f, tiff_start: int, tiff_length: int, tag: int):
+    """
+    Find a tag in IFD0 of the TIFF structure inside the EXIF segment
+    :return: (endian, file offset of the 12 byte entry, type, count, file offset of the value) or None if missing
+    """
+    header = _read_tiff_header(f, tiff_start)
+    if header is None:
+        return None
+    endian, ifd_offset = header
+    ifd = _read_ifd(f, tiff_start, tiff_length, endian, ifd_offset)
+    if ifd is None or tag not in ifd[0]:
+        return None
+    return (endian,) + ifd[0][tag]
+
+
+def read_exif_thumbnail(path: str):
+    """
+    Read the JPEG thumbnail embedded in the EXIF data (IFD1) and the Orientation of the image, without decoding it
+    :return: (thumbnail JPEG bytes or None, Orientation tag value, 1 if not set)
+    """
+    with open(path, "rb") as f:
+        segment = find_exif_segment(f)
+        if segment is None:
+            return None, 1
+        tiff_start, tiff_length = segment
+        header = _read_tiff_header(f, tiff_start)
+        if header is None:
+            return None, 1
+        endian, ifd_offset = header
+        ifd0 = _read_ifd(f, tiff_start, tiff_length, endian, ifd_offset)
+        if ifd0 is None:
+            return None, 1
+
+        orientation = 1
+        if ORIENTATION_TAG in ifd0[0]:
+            orientation = _read_int(f, endian, ifd0[0][ORIENTATION_TAG]) or 1
+
+        ifd1 = _read_ifd(f, tiff_start, tiff_length, endian, ifd0[1]) if ifd0[1] else None
+        if ifd1 is None or THUMBNAIL_OFFSET_TAG not in ifd1[0] or THUMBNAIL_LENGTH_TAG not in ifd1[0]:
+            return None, orientation
+        thumbnail_offset = _read_int(f, endian, ifd1[0][THUMBNAIL_OFFSET_TAG])
+        thumbnail_length = _read_int(f, endian, ifd1[0][THUMBNAIL_LENGTH_TAG])
+        if not thumbnail_offset or not thumbnail_length or thumbnail_offset + thumbnail_length > tiff_length:
+            return None, orientation
+        f.seek(tiff_start + thumbnail_offset)
+        thumbnail = f.read(thumbnail_length)
+    if not thumbnail.startswith(b"\xff\xd8"):
+        return None, orientation
+    return thumbnail, orientation
+
+
+def read_image_description(path: str):
+    """
+    Read the raw ImageDescription text of a JPEG without decoding the image
+    :return: description string, or None if the image has no description
+    """
+    with open(path, "rb") as f:
+        segment = find_exif_segment(f)
+        if segment is None:
+            return None
+        entry = find_ifd0_entry(f, segment[0], segment[1], IMAGE_DESCRIPTION_TAG)
+        if entry is None:
+            return None
+        endian, entry_pos, field_type, count, value_pos = entry
+        if field_type not in (TYPE_ASCII, TYPE_BYTE, TYPE_UNDEFINED):
+            return None
+        f.seek(value_pos)
+        data = f.read(count)
+    # the value is NUL terminated (and may be padded); anything after the first NUL is not part of the text
+    return data.split(b"\x00", 1)[0].decode("utf-8", errors="replace")
+
+
+def parse_image_description(description):
+    """
+    Decode our JSON ImageDescription scheme
+    :return: dict of fields; empty if there is no description
+    :raises ValueError: if the description is not one of ours (e.g. b'Processed with VSCO with b1 preset')
+    """
+    if isinstance(description, bytes):
+        description = description.split(b"\x00", 1)[0].decode("utf-8", errors="replace")
+    # an emptied description (e.g. an undone edit of an untagged image) is only the padding of the value
+    description = (description or "").strip("\x00 \t\r\n")
+    if not description:
+        return {}
+    parsed = json.loads(description)
+    if not isinstance(parsed, dict):
+        raise ValueError("image description is not a JSON object")
+    return parsed
+
+
+def write_image_description(path: str, description: dict):
+    """
+    Store an ImageDescription dict as JSON in the EXIF data of a JPEG. The value is patched in place when it fits
+    in the space of the existing value, so the cost of a save does not depend on the size of the image. Otherwise
+    the file is rewritten atomically with some spare room in the value for the next edits.
+    """
+    data = json.dumps(description).encode("utf-8")
+    if not patch_image_description(path, data):
+        rewrite_image_description(path, data)
+
+
+def write_raw_image_description(path: str, description):
+    """
+    Store an ImageDescription text as it is, e.g. one read with read_image_description() before an edit, to undo
+    the edit. None (no description) is written as an empty description.
+    """
+    data = (description or "").encode("utf-8")
+    if not patch_image_description(path, data):
+        rewrite_image_description(path, data)
+
+
+def patch_image_description(path: str, data: bytes) -> bool:
+    """
+    Overwrite the existing ImageDescription value in place
+    :return: False if the value is missing or too small to hold the new data (nothing is written in that case)
+    """
+    with open(path, "r+b") as f:
+        segment = find_exif_segment(f)
+        if segment is None:
+            return False
+        entry = find_ifd0_entry(f, segment[0], segment[1], IMAGE_DESCRIPTION_TAG)
+        if entry is None:
+            return False
+        endian, entry_pos, field_type, count, value_pos = entry
+        # inline values (4 bytes or less) have no room to grow
+        if field_type != TYPE_ASCII or count <= 4 or len(data) + 1 > count:
+            return False
+
+        # pad with spaces (trailing whitespace is valid JSON) so the value keeps its capacity for later edits
+        f.seek(value_pos)
+        f.write(data + b" " * (count - len(data) - 1) + b"\x00")
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+
+def rewrite_image_description(path: str, data: bytes):
+    """
+    Write a copy of the image with a new APP1/EXIF segment to a temp file next to it, then rename it over the
+    original, so a crash can never leave a half-written photo behind
+    """
+    # only needed here, so reading (and importing this module) doesn't pay for it
+    import piexif
+
+    # reserve spare room so that the next edits can be patched in place
+    value_length = len(data) + 1 + DESCRIPTION_PADDING
+    value_length += -value_length % DESCRIPTION_PADDING
+    padded_data = data + b" " * (value_length - len(data) - 1)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".metaedit_", suffix=".tmp", dir=directory)
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            segment = find_exif_segment(src)
+            if segment is None:
+                exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}, "thumbnail": None}
+                cut_start = cut_end = _exif_insert_position(src)
+            else:
+                tiff_start, tiff_length = segment
+                src.seek(tiff_start)
+                try:
+                    exif_dict = piexif.load(EXIF_HEADER + src.read(tiff_length))
+                except struct.error:
+                    raise ValueError("truncated EXIF") from None
+                # replace the whole segment: marker (2), length (2) and the Exif header come before the TIFF data
+                cut_start = tiff_start - len(EXIF_HEADER) - 4
+                cut_end = tiff_start + tiff_length
+
+            exif_dict["0th"][piexif.ImageIFD.ImageDescription] = padded_data
+            app1_data = piexif.dump(exif_dict)
+            if len(app1_data) + 2 > 0xFFFF:
+                raise ValueError("EXIF data does not fit in a single APP1 segment")
+
+            src.seek(0)
+            _copy_bytes(src, dst, cut_start)
+            dst.write(b"\xff" + bytes([MARKER_APP1]) + struct.pack(">H", len(app1_data) + 2) + app1_data)
+            src.seek(cut_end)
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        # mkstemp creates the file readable by the owner only
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _exif_insert_position(f) -> int:
+    # a new EXIF segment goes right after SOI, or after the JFIF APP0 segment if there is one
+    f.seek(2)
+    header = f.read(4)
+    if len(header) == 4 and header[0] == 0xFF and header[1] == 0xE0:
+        return 2 + 2 + _unpack(">H", header[2:4])[0]
+    return 2
+
+
+def _copy_bytes(src, dst, length: int):
+    while length > 0:
+        chunk = src.read(min(length, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise ValueError("unexpected end of file")
+        dst.write(chunk)
+        length -= len(chunk)
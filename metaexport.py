@@ -0,0 +1,454 @@
+"""
+Export of filtered images into a folder.
+
+Files keep their path relative to the library root, so images with the same name in different folders don't
+collide. A destination file with the same size and modification time as its source is already up to date and is
+not copied again. The files an export wrote are listed in a manifest in the destination, so the next export removes
+the ones that are no longer part of it, and nothing else: other files in the destination are never touched. The
+destination can be inside the library, but not the library itself or a folder above it. Copies run on a
+thread pool and use the cheapest mechanism the filesystem offers: a reflink (copy-on-write clone), then
+os.copy_file_range (copied inside the kernel), then a plain buffered copy. Hardlinks are used only when asked for,
+since an in-place metadata edit of the original would then change the exported file too.
+
+The filtered images can also be streamed straight into a ZIP or TAR archive (optionally split into volumes of a
+maximum size), with a manifest of every image's ImageDescription fields inside each volume.
+"""
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metaexif
+
+# ioctl that clones a file on btrfs/xfs (linux/fs.h)
+FICLONE = 0x40049409
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# suffix of a file being copied; it is renamed into place once complete, so an interrupted export never leaves a
+# half-written file that looks up to date
+PARTIAL_SUFFIX = ".metaedit-part"
+
+# list of the files exported into a folder (paths relative to it), kept in that folder
+EXPORT_MANIFEST_NAME = ".metaedit_export.json"
+
+
+class ExportError(ValueError):
+    pass
+
+
+def is_up_to_date(src_stat, dst_path: str) -> bool:
+    try:
+        dst_stat = os.stat(dst_path)
+    except OSError:
+        return False
+    return dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+
+
+def _reflink(fsrc, fdst) -> bool:
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        # EOPNOTSUPP/EXDEV/EINVAL: the filesystem can't clone (or not across these two files)
+        return False
+
+
+def _copy_file_range(fsrc, fdst, size: int) -> bool:
+    if not hasattr(os, "copy_file_range"):
+        return False
+    copied = 0
+    try:
+        while copied < size:
+            n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+            if n == 0:
+                break
+            copied += n
+    except OSError:
+        if copied:
+            # failed half way: start over with a plain copy
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        return False
+    return copied == size
+
+
+def copy_file(src: str, dst: str, size: int, link: bool = False) -> str:
+    """
+    Copy src to dst (replacing it), keeping the modification time
+    :param size: size of src in bytes
+    :param link: hardlink instead of copying when src and dst are on the same filesystem
+    :return: the mechanism used: "hardlink", "reflink", "copy_file_range" or "copy"
+    """
+    tmp_path = dst + PARTIAL_SUFFIX
+    try:
+        if link:
+            try:
+                os.link(src, tmp_path)
+                os.replace(tmp_path, dst)
+                return "hardlink"
+            except OSError:
+                pass
+
+        with open(src, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+            if _reflink(fsrc, fdst):
+                method = "reflink"
+            elif _copy_file_range(fsrc, fdst, size):
+                method = "copy_file_range"
+            else:
+                shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+                method = "copy"
+        shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dst)
+        return method
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def export_file(root: str, path: str, dest: str, link: bool = False) -> dict:
+    """
+    Export one image, unless the destination copy is up to date. Runs on a worker thread.
+    :return: result: path, status ("copied", "skipped" or "failed"), method, bytes, error
+    """
+    result = {"path": path, "status": "failed", "method": None, "bytes": 0, "error": None}
+    src = os.path.join(root, path)
+    dst = os.path.join(dest, path)
+    try:
+        src_stat = os.stat(src)
+        if is_up_to_date(src_stat, dst):
+            result["status"] = "skipped"
+            return result
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        result["method"] = copy_file(src, dst, src_stat.st_size, link)
+        result["status"] = "copied"
+        result["bytes"] = src_stat.st_size
+    except OSError as e:
+        result["error"] = str(e)
+    return result
+
+
+def export_paths(root: str, paths, dest: str):
+    """
+    :return: paths relative to root, without duplicates, images outside the root and images inside dest (which may
+        itself be inside the library)
+    """
+    root = os.path.abspath(root)
+    dest = os.path.abspath(dest)
+    relative_paths = {}
+    for path in paths:
+        full_path = os.path.abspath(os.path.join(root, path))
+        if full_path == dest or full_path.startswith(dest + os.sep):
+            continue
+        relative_path = os.path.relpath(full_path, root)
+        if relative_path.startswith(os.pardir + os.sep):
+            print(f"[ERROR] Image [{path}] is outside the library and was not exported")
+            continue
+        relative_paths[relative_path] = None
+    return list(relative_paths)
+
+
+def check_destination(root: str, dest: str):
+    """
+    :raise ExportError: if dest is the library root or a folder above it; the export would copy the library onto
+        itself, and pruning would remove files that were never exported
+    """
+    root = os.path.abspath(root)
+    dest = os.path.abspath(dest)
+    if root == dest or root.startswith(dest.rstrip(os.sep) + os.sep):
+        raise ExportError(f"export folder [{dest}] contains the library [{root}]")
+
+
+def read_export_manifest(dest: str) -> list:
+    """
+    :return: paths (relative to dest) of the files an earlier export wrote into dest; empty if there was none
+    """
+    try:
+        with open(os.path.join(dest, EXPORT_MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)["paths"]
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"[ERROR] Failed to read export manifest in [{dest}] with error [{e}]; no stale exports are removed")
+        return []
+
+
+def write_export_manifest(dest: str, paths):
+    manifest_path = os.path.join(dest, EXPORT_MANIFEST_NAME)
+    with open(manifest_path + PARTIAL_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump({"paths": sorted(paths)}, f)
+    os.replace(manifest_path + PARTIAL_SUFFIX, manifest_path)
+
+
+def prune_destination(dest: str, keep) -> int:
+    """
+    Remove the files an earlier export wrote into dest (see read_export_manifest()) that are not in keep, and the
+    folders that leaves empty; files the exporter didn't write are left alone
+    :param keep: set of paths relative to dest
+    :return: number of files removed
+    """
+    dest = os.path.abspath(dest)
+    removed = 0
+    for path in read_export_manifest(dest):
+        full_path = os.path.abspath(os.path.join(dest, path))
+        if path in keep or not full_path.startswith(dest + os.sep):
+            continue
+        try:
+            os.remove(full_path)
+            removed += 1
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            print(f"[ERROR] Failed to remove stale export [{full_path}] with error [{e}]")
+            continue
+        folder = os.path.dirname(full_path)
+        while folder != dest and not os.listdir(folder):
+            os.rmdir(folder)
+            folder = os.path.dirname(folder)
+    return removed
+
+
+def export_files(root: str, paths, dest: str, workers: int = 8, link: bool = False, prune: bool = True):
+    """
+    Export images into dest, keeping their path relative to root
+    :param paths: image paths (relative to root or absolute)
+    :param prune: remove files an earlier export wrote into dest that are not part of this export
+    :return: generator of export_file() results in completion order
+    :raise ExportError: if dest is the library root or a folder above it (see check_destination())
+    """
+    check_destination(root, dest)
+    paths = export_paths(root, paths, dest)
+    os.makedirs(dest, exist_ok=True)
+    if prune:
+        prune_destination(dest, set(paths))
+        # before copying, so the files of an interrupted export are known to the next one
+        write_export_manifest(dest, paths)
+    else:
+        write_export_manifest(dest, set(paths).union(read_export_manifest(dest)))
+
+    pending = iter(paths)
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            while len(in_flight) < workers * 2:
+                path = next(pending, None)
+                if path is None:
+                    break
+                in_flight.add(executor.submit(export_file, root, path, dest, link))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+############
+# Archives #
+############
+# name of the manifest stored in every archive volume
+MANIFEST_NAME = "manifest.json"
+
+
+class ZipVolume:
+    """
+    ZIP archive being written; JPEG data doesn't compress, so entries are stored as they are
+    """
+    # fixed size of a local header + central directory record, with room for the zip64 extra fields
+    ENTRY_OVERHEAD = 30 + 46 + 2 * 32
+    END_RECORD_SIZE = 22 + 56 + 20
+
+    def __init__(self, f):
+        self.file = f
+        self.archive = zipfile.ZipFile(f, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+        self.central_directory_size = 0
+
+    def size(self) -> int:
+        # bytes written so far plus the central directory still to come
+        return self.file.tell() + self.central_directory_size + self.END_RECORD_SIZE
+
+    def entry_size(self, arcname: str, size: int) -> int:
+        return size + 2 * len(arcname.encode()) + self.ENTRY_OVERHEAD
+
+    def add_file(self, src: str, arcname: str):
+        # write() streams the file in chunks, nothing is held in memory
+        self.archive.write(src, arcname)
+        self.central_directory_size += 46 + 32 + len(arcname.encode())
+
+    def add_bytes(self, arcname: str, data: bytes):
+        self.archive.writestr(arcname, data)
+
+    def close(self):
+        self.archive.close()
+
+
+class TarVolume:
+    """
+    Uncompressed TAR archive being written
+    """
+
+    def __init__(self, f):
+        self.file = f
+        self.archive = tarfile.open(fileobj=f, mode="w", format=tarfile.PAX_FORMAT)
+
+    def size(self) -> int:
+        # bytes written so far plus the end-of-archive blocks and the padding to a full record
+        return self.file.tell() + tarfile.RECORDSIZE
+
+    def entry_size(self, arcname: str, size: int) -> int:
+        # header block, pax header for long or non-ascii names, data rounded up to whole blocks
+        blocks = (size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+        return (blocks + 3) * tarfile.BLOCKSIZE + len(arcname.encode())
+
+    def add_file(self, src: str, arcname: str):
+        self.archive.add(src, arcname, recursive=False)
+
+    def add_bytes(self, arcname: str, data: bytes):
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self.archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.archive.close()
+
+
+def archive_format(archive_path: str) -> str:
+    return "tar" if archive_path.lower().endswith(".tar") else "zip"
+
+
+def volume_path(archive_path: str, number: int) -> str:
+    # export.zip -> export.001.zip, export.002.zip, ...
+    base, extension = os.path.splitext(archive_path)
+    return f"{base}.{number:03d}{extension}"
+
+
+def manifest_entry(src: str, path: str, size: int) -> dict:
+    try:
+        description = metaexif.parse_image_description(metaexif.read_image_description(src))
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Failed to read image description for [{src}] with error [{e}] while exporting")
+        description = None
+    return {"path": path, "size": size, "description": description}
+
+
+def export_archive(root: str, paths, archive_path: str, volume_size: int = 0):
+    """
+    Stream images into a ZIP (or, for a .tar path, TAR) archive, keeping their path relative to root. Memory use
+    doesn't depend on the size of the images: every file is copied into the archive in chunks.
+    :param volume_size: maximum size of an archive file in bytes; when set, the archive is split into
+        self-contained volumes named like export.001.zip, and a single image bigger than that gets a volume of
+        its own. 0 writes a single archive.
+    :return: generator of results (path, status "copied" or "failed", bytes, error, volume) in archive order
+    """
+    volume_class = TarVolume if archive_format(archive_path) == "tar" else ZipVolume
+    paths = export_paths(root, paths, archive_path)
+
+    volume = None
+    volume_file = None
+    volume_name = None
+    volume_count = 0
+    manifest = []
+    manifest_size = 0
+
+    def finish_volume():
+        # the manifest goes last, once the images of the volume are known
+        volume.add_bytes(MANIFEST_NAME, ('{"images": [\n' + ",\n".join(manifest) + "\n]}\n").encode())
+        volume.close()
+        volume_file.flush()
+        os.fsync(volume_file.fileno())
+        volume_file.close()
+        os.replace(volume_name + PARTIAL_SUFFIX, volume_name)
+
+    try:
+        for path in paths:
+            src = os.path.join(root, path)
+            arcname = path.replace(os.sep, "/")
+            result = {"path": path, "status": "failed", "bytes": 0, "error": None, "volume": None}
+            try:
+                size = os.stat(src).st_size
+                # one manifest line per image, so the size of the manifest is known while the volume fills up
+                entry = json.dumps(manifest_entry(src, arcname, size))
+                entry_manifest_size = len(entry.encode()) + 2
+
+                if volume is not None and volume_size and manifest and volume.size() + manifest_size + \
+                        volume.entry_size(arcname, size) + entry_manifest_size > volume_size:
+                    finish_volume()
+                    volume = None
+                if volume is None:
+                    volume_count += 1
+                    volume_name = volume_path(archive_path, volume_count) if volume_size else archive_path
+                    volume_file = open(volume_name + PARTIAL_SUFFIX, "wb")
+                    volume = volume_class(volume_file)
+                    manifest = []
+                    manifest_size = volume.entry_size(MANIFEST_NAME, 0) + 16
+
+                volume.add_file(src, arcname)
+                manifest.append(entry)
+                manifest_size += entry_manifest_size
+                result.update(status="copied", bytes=size, volume=volume_name)
+            except OSError as e:
+                result["error"] = str(e)
+            yield result
+
+        if volume is None:
+            # nothing to export: still write an (empty) archive so the user gets what they asked for
+            volume_name = volume_path(archive_path, 1) if volume_size else archive_path
+            volume_file = open(volume_name + PARTIAL_SUFFIX, "wb")
+            volume = volume_class(volume_file)
+        finish_volume()
+        volume = None
+    finally:
+        if volume is not None:
+            # interrupted: don't leave a broken volume behind
+            try:
+                volume.close()
+            except (OSError, ValueError, tarfile.TarError) as e:
+                print(f"[ERROR] Failed to close interrupted archive [{volume_name}] with error [{e}]")
+            volume_file.close()
+            os.remove(volume_name + PARTIAL_SUFFIX)
+
+
+class ExportStats:
+    """
+    Running totals of an export, for progress and throughput reporting
+    """
+
+    def __init__(self, total: int = 0):
+        self.total = total
+        self.copied = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+
+    def add(self, result: dict):
+        if result["status"] == "copied":
+            self.copied += 1
+            self.bytes += result["bytes"]
+        elif result["status"] == "skipped":
+            self.skipped += 1
+        else:
+            self.failed += 1
+
+    @property
+    def done(self) -> int:
+        return self.copied + self.skipped + self.failed
+
+    def summary(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (
+            f"{self.done}/{self.total} files: {self.copied} copied, {self.skipped} up to date, {self.failed} failed "
+            f"({self.bytes / (1024 * 1024) / elapsed:.1f} MB/s, {self.done / elapsed:.0f} files/s)"
+        )
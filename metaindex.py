@@ -0,0 +1,239 @@
+"""
+Persistent on-disk index of the ImageDescription fields found in a library folder.
+
+The index is a small SQLite file stored in the root of the selected library folder. Every entry is keyed on the
+image path together with its size and modification time, so only new or changed files have to be parsed again
+when the library is re-opened. The entry also keeps the image's perceptual hash (see metadupes), which survives
+our own rewrites of the description since they don't change the picture. An image that could not be parsed gets an
+entry without a record, so it is not parsed again either until the file changes.
+"""
+import json
+import os
+import sqlite3
+
+import metaexif
+
+# name of the index file kept in the root of the selected library folder
+INDEX_FILENAME = ".metaedit_index.sqlite3"
+
+# bump whenever the table layout changes; an index with a different version is rebuilt from scratch
+INDEX_VERSION = 2
+
+# the hash is unsigned 64 bit, SQLite integers are signed
+HASH_SIGN_BIT = 1 << 63
+
+
+def open_index(root: str) -> sqlite3.Connection:
+    """
+    Open (or create) the index file for a library folder
+    :param root: library folder selected by the user
+    :return: sqlite connection; falls back to an in-memory index if the folder is not writable
+    """
+    index_path = os.path.join(root, INDEX_FILENAME)
+    try:
+        conn = sqlite3.connect(index_path)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"[ERROR] Failed to open index [{index_path}] with error [{e}]. Using a temporary in-memory index.")
+        conn = sqlite3.connect(":memory:")
+        version = 0
+
+    if version != INDEX_VERSION:
+        conn.execute("DROP TABLE IF EXISTS images")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS images ("
+        "path TEXT PRIMARY KEY, "
+        "size INTEGER NOT NULL, "
+        "mtime_ns INTEGER NOT NULL, "
+        "fields TEXT NOT NULL, "
+        "image_hash INTEGER)"
+    )
+    conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+    conn.commit()
+    return conn
+
+
+def encode_record(record: dict) -> str:
+    # people are kept as a set in memory, which json can't serialize
+    encoded = dict(record)
+    if 'people' in encoded:
+        encoded['people'] = sorted(encoded['people'])
+    return json.dumps(encoded)
+
+
+def decode_record(fields: str):
+    # None for the entry of an image that could not be parsed (see store_failed())
+    record = json.loads(fields)
+    if record is None:
+        return None
+    if 'people' in record:
+        record['people'] = set(record['people'])
+    return record
+
+
+def encode_hash(image_hash):
+    if image_hash is not None and image_hash >= HASH_SIGN_BIT:
+        return image_hash - 2 * HASH_SIGN_BIT
+    return image_hash
+
+
+def decode_hash(stored):
+    if stored is not None and stored < 0:
+        return stored + 2 * HASH_SIGN_BIT
+    return stored
+
+
+def load_index(conn: sqlite3.Connection) -> dict:
+    """
+    Read every entry of the index into memory
+    :return: dict of image path -> (size, mtime_ns, record, image hash or None); the record is None for an image
+        that could not be parsed
+    """
+    entries = {}
+    query = "SELECT path, size, mtime_ns, fields, image_hash FROM images"
+    for path, size, mtime_ns, fields, image_hash in conn.execute(query):
+        try:
+            entries[path] = (size, mtime_ns, decode_record(fields), decode_hash(image_hash))
+        except json.decoder.JSONDecodeError:
+            # a damaged entry is simply treated as stale and re-parsed
+            print(f"[ERROR] Failed to decode index entry for [{path}]. It will be re-indexed.")
+    return entries
+
+
+def load_file_stats(conn: sqlite3.Connection) -> dict:
+    """
+    Read the size and mtime of every indexed image, without decoding the records (for rescans)
+    :return: dict of image path -> (size, mtime_ns)
+    """
+    return {path: (size, mtime_ns) for path, size, mtime_ns in conn.execute("SELECT path, size, mtime_ns FROM images")}
+
+
+def store_record(conn: sqlite3.Connection, path: str, size: int, mtime_ns: int, record: dict, image_hash=None):
+    """
+    :param image_hash: perceptual hash of the image; None keeps the stored one (a rewritten description doesn't
+        change the picture)
+    """
+    conn.execute(
+        "INSERT OR REPLACE INTO images (path, size, mtime_ns, fields, image_hash) VALUES (?, ?, ?, ?, "
+        "COALESCE(?, (SELECT image_hash FROM images WHERE path = ?)))",
+        (path, size, mtime_ns, encode_record(record), encode_hash(image_hash), path)
+    )
+
+
+def store_failed(conn: sqlite3.Connection, path: str, size: int, mtime_ns: int):
+    """
+    Remember that an image could not be parsed, so it is skipped like an unchanged image until its size or mtime
+    changes
+    """
+    conn.execute(
+        "INSERT OR REPLACE INTO images (path, size, mtime_ns, fields, image_hash) VALUES (?, ?, ?, 'null', NULL)",
+        (path, size, mtime_ns)
+    )
+
+
+def store_hash(conn: sqlite3.Connection, path: str, image_hash: int):
+    """
+    Set the perceptual hash of an image that is already in the index, leaving its record as it is
+    """
+    conn.execute("UPDATE images SET image_hash = ? WHERE path = ?", (encode_hash(image_hash), path))
+
+
+def remove_records(conn: sqlite3.Connection, paths):
+    conn.executemany("DELETE FROM images WHERE path = ?", ((path,) for path in paths))
+
+
+def clear_index(conn: sqlite3.Connection):
+    conn.execute("DELETE FROM images")
+    conn.commit()
+
+
+#####################
+# Parse image files #
+#####################
+def people_list(people) -> list:
+    """
+    :return: the stripped names of people given as a list or as comma separated text ("Ann, Bob"), without blanks;
+        descriptions store people as such a list
+    """
+    if people is None:
+        return []
+    if isinstance(people, str):
+        people = people.split(",")
+    elif not isinstance(people, (list, tuple, set)):
+        # a single value written by another tool, e.g. a number
+        people = [people]
+    return [str(person).strip() for person in people if person is not None and str(person).strip()]
+
+
+def record_from_description(img_desc_parsed: dict) -> dict:
+    """
+    Convert a parsed ImageDescription dictionary into the record kept for filtering. Descriptions written by other
+    tools may hold numbers (e.g. "date": 1962); they are indexed as text, and null fields are left out.
+    """
+    record = {}
+    for field in ('location', 'date', 'group', 'comment'):
+        value = img_desc_parsed.get(field)
+        if value is not None:
+            record[field] = str(value).strip()
+    if 'people' in img_desc_parsed:
+        record['people'] = set(people_list(img_desc_parsed['people']))
+    return record
+
+
+def read_record(img_filename: str):
+    """
+    Parse the ImageDescription fields of an image into an index record
+    :return: dict of indexed fields, or None if the image could not be parsed
+    """
+    # header-only read: no PIL image object and no open file handle left behind
+    try:
+        description = metaexif.read_image_description(img_filename)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Failed to parse image [{img_filename}] with error [{e}] while indexing images.")
+        return None
+
+    # ImageDescription field is set for image and contains a dictionary object
+    try:
+        return record_from_description(metaexif.parse_image_description(description))
+    except (ValueError, TypeError, AttributeError):
+        print(
+            f"[ERROR] Failed to decode image description [{img_filename}]. "
+            f"Setting fields to empty for filtering purposes."
+        )
+        return {}
+
+
+def index_batch(batch, root: str = "", hash_images: bool = False):
+    """
+    Check a batch of images against their cached entries and parse the ones that changed. This runs inside a
+    worker thread or process, so it must not touch the index connection or any GUI state.
+    :param batch: list of (path, cached size, cached mtime_ns) tuples; cached values are None for new images
+    :param root: folder the paths are relative to (default: the current directory)
+    :param hash_images: also compute the perceptual hash of parsed images (see metadupes); this decodes them
+    :return: list of (path, status, size, mtime_ns, record, image hash) tuples, status being "unchanged", "parsed"
+        or "failed"; the hash is None unless the image was parsed and hashed, and size and mtime are None for an
+        image that could not be stat'ed
+    """
+    if hash_images:
+        import metadupes
+    results = []
+    for path, cached_size, cached_mtime_ns in batch:
+        full_path = os.path.join(root, path)
+        try:
+            stat = os.stat(full_path)
+        except OSError as e:
+            print(f"[ERROR] Failed to stat image [{path}] with error [{e}] while indexing images.")
+            results.append((path, "failed", None, None, None, None))
+            continue
+
+        if stat.st_size == cached_size and stat.st_mtime_ns == cached_mtime_ns:
+            results.append((path, "unchanged", stat.st_size, stat.st_mtime_ns, None, None))
+            continue
+
+        record = read_record(full_path)
+        if record is None:
+            results.append((path, "failed", stat.st_size, stat.st_mtime_ns, None, None))
+        else:
+            image_hash = metadupes.image_hash(full_path) if hash_images else None
+            results.append((path, "parsed", stat.st_size, stat.st_mtime_ns, record, image_hash))
+    return results
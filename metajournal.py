@@ -0,0 +1,488 @@
+"""
+Crash-safe batch edits of many images at once, with undo.
+
+A batch sets some fields on a list of images, e.g. the filter results in the editor; people are added to the ones
+already tagged, the other fields are replaced. Before anything is written, the current ImageDescription of every
+image is recorded in a write-ahead journal (.metaedit_journal.sqlite3 in the library folder) and committed. The
+images are then written on a pool of threads, and the outcome of each one is recorded in the journal as it
+completes, so:
+
+- a batch that was interrupted (a crash, a power cut, the editor killed) is still "running" at the next launch, and
+  is either resumed (the images not done yet are written) or rolled back (the images get their prior description
+  back)
+- a finished batch can be undone in one step; images that were edited again after the batch are left alone, and
+  images that could not be restored (e.g. a file that was locked) leave the batch "partly undone", to be undone
+  again
+- the journal keeps the status, error and time of every image, as the per-file log of the batch
+
+With a metadata store (see metastore) the batch goes into the store instead of the images, and the journal records
+the prior stored fields.
+
+usage: python metajournal.py [--root DIR] [--list | --log ID | --resume ID | --undo ID|last] [--workers 8]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import metabatch
+import metaexif
+import metastore
+
+JOURNAL_FILENAME = ".metaedit_journal.sqlite3"
+
+# per-file results recorded between commits
+JOURNAL_COMMIT_INTERVAL = 256
+
+# batches kept for undo; older finished ones are dropped when a new batch starts
+BATCHES_KEPT = 20
+
+# states of a batch; a batch that is still running or undoing when the library is opened was interrupted
+RUNNING = "running"
+DONE = "done"
+UNDOING = "undoing"
+UNDONE = "undone"
+PARTIAL = "partly undone"  # undone except for images that failed to restore; undoing it again retries them
+
+
+class Journal:
+    """
+    Batches and the prior description of every image they touch, in one SQLite file in the library folder. Every
+    thread running a batch opens its own Journal.
+    """
+
+    def __init__(self, root: str):
+        self.conn = sqlite3.connect(os.path.join(root, JOURNAL_FILENAME))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS batches ("
+            "id INTEGER PRIMARY KEY, "
+            "created REAL NOT NULL, "
+            "fields TEXT NOT NULL, "
+            "target TEXT NOT NULL, "
+            "state TEXT NOT NULL)"
+        )
+        # prior: the ImageDescription text before the batch (the stored fields as JSON, with a metadata store), NULL
+        # when there was none; after: the description (or stored fields) as JSON after the batch, NULL until done
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "batch INTEGER NOT NULL, "
+            "path TEXT NOT NULL, "
+            "prior TEXT, "
+            "after TEXT, "
+            "status TEXT NOT NULL, "
+            "error TEXT, "
+            "ms REAL, "
+            "PRIMARY KEY (batch, path))"
+        )
+        self.conn.commit()
+
+    def begin(self, fields: dict, target: str, priors) -> int:
+        """
+        Record a new batch with the prior description of every image, and commit, before anything is written
+        :param target: "exif" when the images are written, "store" when the edits go into a metadata store
+        :param priors: (path, prior description, status, error) tuples, status being "pending" for images to write
+        :return: batch id
+        """
+        self._prune()
+        batch_id = self.conn.execute(
+            "INSERT INTO batches (created, fields, target, state) VALUES (?, ?, ?, ?)",
+            (time.time(), json.dumps(fields), target, RUNNING)
+        ).lastrowid
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO entries (batch, path, prior, status, error) VALUES (?, ?, ?, ?, ?)",
+            ((batch_id, path, prior, status, error) for path, prior, status, error in priors)
+        )
+        self.conn.commit()
+        return batch_id
+
+    def _prune(self):
+        finished = [
+            batch_id for (batch_id,) in self.conn.execute(
+                "SELECT id FROM batches WHERE state IN (?, ?) ORDER BY id DESC", (DONE, UNDONE)
+            )
+        ][BATCHES_KEPT - 1:]
+        self.conn.executemany("DELETE FROM entries WHERE batch = ?", ((batch_id,) for batch_id in finished))
+        self.conn.executemany("DELETE FROM batches WHERE id = ?", ((batch_id,) for batch_id in finished))
+
+    def record(self, batch_id: int, path: str, status: str, error=None, ms=None, after=None):
+        self.conn.execute(
+            "UPDATE entries SET status = ?, error = ?, ms = ?, after = COALESCE(?, after) WHERE batch = ? AND path = ?",
+            (status, error, ms, after, batch_id, path)
+        )
+
+    def set_state(self, batch_id: int, state: str):
+        self.conn.execute("UPDATE batches SET state = ? WHERE id = ?", (state, batch_id))
+        self.conn.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def _batch(self, row) -> dict:
+        batch_id, created, fields, target, state = row
+        counts = dict(self.conn.execute(
+            "SELECT status, COUNT(*) FROM entries WHERE batch = ? GROUP BY status", (batch_id,)
+        ).fetchall())
+        return {
+            "id": batch_id, "created": created, "fields": json.loads(fields), "target": target, "state": state,
+            "images": sum(counts.values()), "counts": counts,
+        }
+
+    def batch(self, batch_id: int):
+        """
+        :return: dict of id, created, fields, target, state, images and counts (images per status), or None
+        """
+        row = self.conn.execute(
+            "SELECT id, created, fields, target, state FROM batches WHERE id = ?", (batch_id,)
+        ).fetchone()
+        return None if row is None else self._batch(row)
+
+    def batches(self) -> list:
+        """
+        :return: every batch in the journal (see batch()), newest first
+        """
+        rows = self.conn.execute("SELECT id, created, fields, target, state FROM batches ORDER BY id DESC").fetchall()
+        return [self._batch(row) for row in rows]
+
+    def unfinished(self) -> list:
+        """
+        :return: batches that were interrupted while running or undoing, oldest first
+        """
+        return [batch for batch in reversed(self.batches()) if batch["state"] in (RUNNING, UNDOING)]
+
+    def last_done(self):
+        """
+        :return: the newest batch that can be undone (or undone further), or None
+        """
+        for batch in self.batches():
+            if batch["state"] in (DONE, PARTIAL):
+                return batch
+        return None
+
+    def entries(self, batch_id: int, statuses) -> list:
+        """
+        :return: (path, prior, after, status) of the images of a batch with one of the given statuses
+        """
+        marks = ", ".join("?" * len(statuses))
+        return self.conn.execute(
+            f"SELECT path, prior, after, status FROM entries WHERE batch = ? AND status IN ({marks}) ORDER BY path",
+            (batch_id,) + tuple(statuses)
+        ).fetchall()
+
+    def log(self, batch_id: int):
+        """
+        :return: generator of the per-file log of a batch: dicts of path, status, error and ms
+        """
+        rows = self.conn.execute(
+            "SELECT path, status, error, ms FROM entries WHERE batch = ? ORDER BY path", (batch_id,)
+        )
+        for path, status, error, ms in rows:
+            yield {"path": path, "status": status, "error": error, "ms": ms}
+
+
+###########
+# Editing #
+###########
+def _parse(description) -> dict:
+    try:
+        return metaexif.parse_image_description(description)
+    except ValueError:
+        return {}
+
+
+def _read_prior(root: str, path: str):
+    # runs on a worker thread
+    try:
+        return path, metaexif.read_image_description(os.path.join(root, path)), "pending", None
+    except FileNotFoundError:
+        return path, None, "missing", "file not found"
+    except (OSError, ValueError) as e:
+        return path, None, "failed", str(e)
+
+
+def _apply_to_store(root: str, store, path: str, fields: dict) -> dict:
+    # the store edition of metabatch.apply_edit(); runs on the thread the store belongs to
+    start = time.perf_counter()
+    result = {"path": path, "status": "failed", "error": None}
+    try:
+        embedded = metabatch.read_description(os.path.join(root, path))
+        current = metastore.merge(embedded, store.get(path))
+        merged = metabatch.merge_fields(current, fields, add_people=True)
+        if merged == current:
+            result["status"] = "unchanged"
+        else:
+            changed = metastore.changed_fields(embedded, merged)
+            if changed:
+                store.put(path, changed)
+            else:
+                store.remove(path)
+            result.update(status="written", description=merged, stored=changed or None)
+    except FileNotFoundError:
+        result.update(status="missing", error="file not found")
+    except (OSError, ValueError) as e:
+        result["error"] = str(e)
+    result["ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def _after(result: dict, prior, fields: dict, store) -> str:
+    # what the image holds after the batch (see Journal), so an undo can tell whether it was edited again since;
+    # an unchanged image may also have been written by a run of the batch that was interrupted before recording it
+    if store is not None:
+        if result["status"] == "written":
+            return json.dumps(result.pop("stored"))
+        return json.dumps(store.get(result["path"]) or None)
+    if result["status"] == "written":
+        return json.dumps(result["description"])
+    return json.dumps(metabatch.merge_fields(_parse(prior), fields, add_people=True))
+
+
+def _apply(root: str, journal: Journal, batch_id: int, fields: dict, entries, workers: int, store):
+    # entries: (path, prior) of the images to write
+    priors = dict(entries)
+    if store is None:
+        calls = ((root, path, fields, False, True) for path in priors)
+        results = metabatch.map_bounded(metabatch.apply_edit, calls, workers)
+    else:
+        results = (_apply_to_store(root, store, path, fields) for path in priors)
+    for done, result in enumerate(results, 1):
+        after = None
+        if result["status"] in ("written", "unchanged"):
+            after = _after(result, priors[result["path"]], fields, store)
+        journal.record(batch_id, result["path"], result["status"], result["error"], result["ms"], after)
+        if done % JOURNAL_COMMIT_INTERVAL == 0:
+            # the store first: an image the journal calls written must not be lost with an uncommitted store
+            if store is not None:
+                store.commit()
+            journal.commit()
+        yield result
+    if store is not None:
+        store.commit()
+    journal.set_state(batch_id, DONE)
+
+
+def start_batch(root: str, paths, fields: dict, workers: int = 8, store=None):
+    """
+    Set fields on every image of paths (people are added to the image's), journaled so it can be undone
+    :param store: metadata store to put the edits in (used from the calling thread), None to write the images
+    :return: generator of report entries (as metabatch.apply_edit() returns them) in completion order
+    """
+    journal = Journal(root)
+    try:
+        if store is None:
+            priors = list(metabatch.map_bounded(_read_prior, ((root, path) for path in paths), workers))
+        else:
+            priors = []
+            for path in paths:
+                stored = store.get(path)
+                priors.append((path, json.dumps(stored) if stored else None, "pending", None))
+        batch_id = journal.begin(fields, "exif" if store is None else "store", priors)
+
+        # images that could not be read are not written, and have nothing to undo
+        for path, prior, status, error in priors:
+            if status != "pending":
+                yield {"path": path, "status": status, "error": error, "ms": 0}
+        pending = [(path, prior) for path, prior, status, error in priors if status == "pending"]
+        del priors
+        yield from _apply(root, journal, batch_id, fields, pending, workers, store)
+    finally:
+        journal.close()
+
+
+def _target_store(batch: dict, store):
+    # a batch is finished or reverted where it was written, whichever store is open now
+    if batch["target"] == "exif":
+        return None
+    if store is None:
+        raise ValueError(f"batch [{batch['id']}] was put in a metadata store, which is not open")
+    return store
+
+
+def resume_batch(root: str, batch_id: int, workers: int = 8, store=None):
+    """
+    Write the images an interrupted batch didn't get to
+    :return: generator of report entries, as start_batch()
+    :raise ValueError: if there is no such batch, or it was put in a metadata store and store is None
+    """
+    journal = Journal(root)
+    try:
+        batch = journal.batch(batch_id)
+        if batch is None:
+            raise ValueError(f"no batch [{batch_id}] in the journal")
+        store = _target_store(batch, store)
+        # written again if the batch was interrupted after writing them but before recording it; that is a no-op
+        pending = [(path, prior) for path, prior, after, status in journal.entries(batch_id, ("pending",))]
+        journal.set_state(batch_id, RUNNING)
+        yield from _apply(root, journal, batch_id, batch["fields"], pending, workers, store)
+    finally:
+        journal.close()
+
+
+###########
+# Undoing #
+###########
+def _same_text(first, second) -> bool:
+    # patched values are padded with spaces
+    return (first or "").rstrip() == (second or "").rstrip()
+
+
+def _restore_file(root: str, path: str, prior, after) -> dict:
+    # runs on a worker thread
+    start = time.perf_counter()
+    result = {"path": path, "status": "failed", "error": None}
+    full_path = os.path.join(root, path)
+    try:
+        current = metaexif.read_image_description(full_path)
+        if _same_text(current, prior):
+            result["status"] = "unchanged"
+        elif after is not None and _parse(current) != json.loads(after):
+            result.update(status="conflict", error="edited again since the batch")
+        else:
+            metaexif.write_raw_image_description(full_path, prior)
+            stat = os.stat(full_path)
+            result.update(status="written", description=_parse(prior), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+    except FileNotFoundError:
+        result.update(status="missing", error="file not found")
+    except (OSError, ValueError) as e:
+        result["error"] = str(e)
+    result["ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def _restore_stored(root: str, store, path: str, prior, after) -> dict:
+    start = time.perf_counter()
+    result = {"path": path, "status": "failed", "error": None}
+    prior_fields = json.loads(prior) if prior else None
+    current = store.get(path) or None
+    if current == prior_fields:
+        result["status"] = "unchanged"
+    elif after is not None and current != json.loads(after):
+        result.update(status="conflict", error="edited again since the batch")
+    else:
+        if prior_fields:
+            store.put(path, prior_fields)
+        else:
+            store.remove(path)
+        try:
+            embedded = metabatch.read_description(os.path.join(root, path))
+            result.update(status="written", description=metastore.merge(embedded, prior_fields))
+        except FileNotFoundError:
+            result.update(status="missing", error="file not found")
+        except (OSError, ValueError) as e:
+            result["error"] = str(e)
+    result["ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def revert_batch(root: str, batch_id: int, workers: int = 8, store=None):
+    """
+    Give every image of a batch its prior description back: undoes a finished batch, or rolls back an interrupted
+    one. Images that were edited again after the batch wrote them are left alone (status "conflict"). Images that
+    fail to restore are recorded as "unreverted" and tried again by the next revert; the batch is then left
+    PARTIAL instead of UNDONE.
+    :return: generator of report entries, as start_batch(); "written" means restored
+    :raise ValueError: if there is no such batch, or it was put in a metadata store and store is None
+    """
+    journal = Journal(root)
+    try:
+        batch = journal.batch(batch_id)
+        if batch is None:
+            raise ValueError(f"no batch [{batch_id}] in the journal")
+        store = _target_store(batch, store)
+        # a pending image may have been written just before the batch was interrupted; it has no "after" to check
+        entries = journal.entries(batch_id, ("written", "unchanged", "pending", "unreverted"))
+        journal.set_state(batch_id, UNDOING)
+
+        checked = [(path, prior, after) for path, prior, after, status in entries]
+        if store is None:
+            results = metabatch.map_bounded(_restore_file, ((root,) + entry for entry in checked), workers)
+        else:
+            results = (_restore_stored(root, store, *entry) for entry in checked)
+        failed = 0
+        for done, result in enumerate(results, 1):
+            status = "reverted" if result["status"] in ("written", "unchanged") else result["status"]
+            if status not in ("reverted", "conflict"):
+                # "failed" or "missing": the image still has the batch's edit (prior and after are kept)
+                status = "unreverted"
+                failed += 1
+            journal.record(batch_id, result["path"], status, result["error"], result["ms"])
+            if done % JOURNAL_COMMIT_INTERVAL == 0:
+                if store is not None:
+                    store.commit()
+                journal.commit()
+            yield result
+        if store is not None:
+            store.commit()
+        journal.set_state(batch_id, PARTIAL if failed else UNDONE)
+    finally:
+        journal.close()
+
+
+def describe(batch: dict) -> str:
+    """
+    :return: one line summary of a batch, e.g. for a prompt
+    """
+    fields = ", ".join(
+        f"{field} {'+' if field == 'people' else '='} {value}" for field, value in batch["fields"].items()
+    )
+    created = time.strftime("%Y-%m-%d %H:%M", time.localtime(batch["created"]))
+    return f"batch {batch['id']} of {created}: {fields} on {batch['images']} images ({batch['state']})"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default=".", help="library folder")
+    parser.add_argument("--workers", type=int, default=8, help="files written at the same time")
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--list", action="store_true", help="list the batches in the journal (default)")
+    action.add_argument("--log", type=int, metavar="ID", help="print the per-file log (JSONL) of a batch")
+    action.add_argument("--resume", type=int, metavar="ID", help="finish an interrupted batch")
+    action.add_argument("--undo", metavar="ID", help="undo a batch, or roll back an interrupted one ('last': the "
+                                                     "newest finished batch)")
+    args = parser.parse_args(argv)
+
+    root = os.path.abspath(args.root)
+    if args.resume is None and args.undo is None:
+        journal = Journal(root)
+        try:
+            if args.log is not None:
+                for entry in journal.log(args.log):
+                    print(json.dumps(entry))
+            else:
+                for batch in journal.batches():
+                    print(describe(batch))
+        finally:
+            journal.close()
+        return 0
+
+    # imported here: metacore imports this module
+    import metacore
+
+    with metacore.Library(root, os.environ.get("METAEDIT_STORE", "")) as library:
+        try:
+            if args.resume is not None:
+                results = library.resume_batch(args.resume, max(1, args.workers))
+            else:
+                results = library.undo_batch(None if args.undo == "last" else int(args.undo), max(1, args.workers))
+            counts = {}
+            start = time.perf_counter()
+            for result in results:
+                counts[result["status"]] = counts.get(result["status"], 0) + 1
+                print(json.dumps(result))
+        except ValueError as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            return 2
+    elapsed = time.perf_counter() - start
+    done = sum(counts.values())
+    print(f"{done} files in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.0f} files/s): "
+          + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())), file=sys.stderr)
+    return 1 if set(counts) - {"written", "unchanged"} else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+Optional timing instrumentation of the editor's hot paths.
+
+Off by default. It is switched on with the METAEDIT_PROFILE environment variable (or the --profile[=MODE] command
+line flag), which has to be set before the instrumented modules are imported:
+
+- "json" (or "1"): per function call counts, total/min/max time and a histogram of call durations
+- "trace": the same, plus every call as an event in Chrome trace format (open in chrome://tracing or Perfetto)
+- "cprofile": the same, plus a cProfile of the main thread (read with pstats or snakeviz)
+
+The results are written when the program exits, to METAEDIT_PROFILE_OUT (default: metaedit_profile.json in the
+folder the editor was started from; the cProfile stats go next to it with a .prof suffix).
+
+When profiling is off, timed() returns the function unchanged and span() is a no-op, so there is no overhead.
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+MODES = ("json", "trace", "cprofile")
+
+# histogram bucket upper bounds in milliseconds; the last bucket takes everything slower
+HISTOGRAM_BOUNDS_MS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# calls kept for the Chrome trace; beyond this only the statistics are updated
+MAX_TRACE_EVENTS = 1000000
+
+
+def _mode_from_environment():
+    mode = os.environ.get("METAEDIT_PROFILE", "").strip().lower()
+    for arg in sys.argv[1:]:
+        if arg == "--profile":
+            mode = "json"
+        elif arg.startswith("--profile="):
+            mode = arg.split("=", 1)[1].lower()
+    if mode in ("", "0", "off"):
+        return None
+    if mode == "1":
+        return "json"
+    if mode not in MODES:
+        print(f"[ERROR] Unknown profile mode [{mode}], expected one of {MODES}. Profiling is off.")
+        return None
+    return mode
+
+
+mode = _mode_from_environment()
+enabled = mode is not None
+output_path = os.path.abspath(os.environ.get("METAEDIT_PROFILE_OUT", "metaedit_profile.json"))
+
+_lock = threading.Lock()
+_stats = {}  # name -> Stat
+_events = []
+_started = time.perf_counter()
+_profiler = None
+
+
+class Stat:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        ms = seconds * 1000
+        for bucket, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+            if ms <= bound:
+                break
+        else:
+            bucket = len(HISTOGRAM_BOUNDS_MS)
+        self.histogram[bucket] += 1
+
+    def to_dict(self) -> dict:
+        labels = [f"<={bound}ms" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}ms"]
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0,
+            "min_ms": (self.min or 0) * 1000,
+            "max_ms": self.max * 1000,
+            "histogram": {label: n for label, n in zip(labels, self.histogram) if n},
+        }
+
+
+def record(name: str, seconds: float, start: float = None):
+    """
+    Add a measured duration, e.g. of work that doesn't map to a single call (an indexing run)
+    :param start: perf_counter() value when the work started, for the trace; defaults to now - seconds
+    """
+    if not enabled:
+        return
+    if start is None:
+        start = time.perf_counter() - seconds
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = Stat()
+        stat.add(seconds)
+        if mode == "trace" and len(_events) < MAX_TRACE_EVENTS:
+            _events.append({
+                "name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                "ts": (start - _started) * 1e6, "dur": seconds * 1e6,
+            })
+
+
+def timed(name: str = None):
+    """
+    Decorator timing every call of a function; returns the function itself when profiling is off
+    """
+    def decorate(func):
+        if not enabled:
+            return func
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(label, time.perf_counter() - start, start)
+
+        return wrapper
+
+    return decorate
+
+
+@contextmanager
+def _span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, start)
+
+
+_no_span = nullcontext()
+
+
+def span(name: str):
+    """
+    Time a block inside a function: "with metaprof.span('filter_images.widgets'):"
+    """
+    return _span(name) if enabled else _no_span
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "mode": mode,
+            "uptime_s": time.perf_counter() - _started,
+            "functions": {name: stat.to_dict() for name, stat in sorted(_stats.items())},
+        }
+
+
+def dump():
+    """
+    Write the statistics (and trace / cProfile output, depending on the mode)
+    """
+    if not enabled:
+        return
+    try:
+        data = snapshot()
+        if mode == "trace":
+            with _lock:
+                data["traceEvents"] = list(_events)
+            data["displayTimeUnit"] = "ms"
+        with open(output_path, "w") as f:
+            json.dump(data, f, indent=1)
+        if _profiler is not None:
+            _profiler.disable()
+            _profiler.dump_stats(os.path.splitext(output_path)[0] + ".prof")
+        print(f"[INFO] Profile written to [{output_path}]")
+    except OSError as e:
+        print(f"[ERROR] Failed to write profile [{output_path}] with error [{e}]")
+
+
+if enabled:
+    if mode == "cprofile":
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.register(dump)
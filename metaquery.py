@@ -0,0 +1,249 @@
+"""
+Structured search queries over the SearchIndex.
+
+    people:"ann smith" AND (location:paris OR location:rome) AND NOT group:work AND date:1960..1965
+
+- field:text matches when the field contains text, field=text when it is exactly text (case-insensitive); people
+  are matched per person. A text without a field matches any field.
+- date:... takes dates as free text ("1962", "Summer 1962", "12/25/1970", "1960s"), ranges (1960..1965) and
+  comparisons (date:>=1960, date:<1970), and matches every image whose date overlaps. Dates are compared as
+  normalized spans of days through the sorted date index, so a range costs a binary search plus the matches. A date
+  text that isn't recognized as a date falls back to substring matching.
+- AND, OR and NOT (or a leading "-") combine terms; terms next to each other are ANDed; parentheses group. Text with
+  spaces or parentheses goes in double quotes.
+"""
+import datetime
+
+import metasearch
+
+FIELD_ALIASES = {
+    "people": "people",
+    "person": "people",
+    "who": "people",
+    "location": "location",
+    "place": "location",
+    "where": "location",
+    "date": "date",
+    "when": "date",
+    "group": "group",
+    "comment": "comment",
+    "comments": "comment",
+}
+
+KEYWORDS = ("and", "or", "not")
+
+# open ends of date comparisons
+FIRST_DAY = datetime.date(metasearch.MIN_YEAR, 1, 1).toordinal()
+LAST_DAY = datetime.date(metasearch.MAX_YEAR, 12, 31).toordinal()
+
+
+class QueryError(ValueError):
+    pass
+
+
+############
+# Tokenize #
+############
+def _read_quoted(text: str, position: int):
+    # position is at the opening quote; a backslash escapes the next character
+    value = []
+    position += 1
+    while position < len(text):
+        char = text[position]
+        if char == "\\" and position + 1 < len(text):
+            value.append(text[position + 1])
+            position += 2
+            continue
+        if char == '"':
+            return "".join(value), position + 1
+        value.append(char)
+        position += 1
+    raise QueryError("missing closing quote")
+
+
+def _read_word(text: str, position: int):
+    start = position
+    while position < len(text) and not text[position].isspace() and text[position] not in '()"':
+        position += 1
+    return text[start:position], position
+
+
+def tokenize(text: str) -> list:
+    """
+    :return: list of ("(",), (")",), ("op", keyword) and ("term", field or None, ":" or "=", value, quoted) tokens
+    """
+    tokens = []
+    position = 0
+    while position < len(text):
+        char = text[position]
+        if char.isspace():
+            position += 1
+        elif char in "()":
+            tokens.append((char,))
+            position += 1
+        elif char == '"':
+            value, position = _read_quoted(text, position)
+            tokens.append(("term", None, ":", value, True))
+        elif char == "-" and position + 1 < len(text) and not text[position + 1].isspace():
+            tokens.append(("op", "not"))
+            position += 1
+        else:
+            word, position = _read_word(text, position)
+            field, separator, value = None, ":", word
+            for candidate in (":", "="):
+                name, found, rest = word.partition(candidate)
+                if found and name.lower() in FIELD_ALIASES:
+                    field, separator, value = FIELD_ALIASES[name.lower()], candidate, rest
+                    break
+            if field is None and word.lower() in KEYWORDS:
+                tokens.append(("op", word.lower()))
+                continue
+            quoted = False
+            if field is not None and not value and position < len(text) and text[position] == '"':
+                value, position = _read_quoted(text, position)
+                quoted = True
+            if field is not None and not value and not quoted:
+                raise QueryError(f"missing text after [{word}]")
+            tokens.append(("term", field, separator, value, quoted))
+    return tokens
+
+
+#########
+# Parse #
+#########
+class _Parser:
+    """
+    expression := and_expression (OR and_expression)*
+    and_expression := unary ([AND] unary)*
+    unary := NOT unary | "(" expression ")" | term
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def expression(self):
+        operands = [self.and_expression()]
+        while self.peek() == ("op", "or"):
+            self.take()
+            operands.append(self.and_expression())
+        return operands[0] if len(operands) == 1 else ("or", operands)
+
+    def and_expression(self):
+        operands = [self.unary()]
+        while True:
+            token = self.peek()
+            if token == ("op", "and"):
+                self.take()
+            elif token is None or token == (")",) or token == ("op", "or"):
+                break
+            operands.append(self.unary())
+        return operands[0] if len(operands) == 1 else ("and", operands)
+
+    def unary(self):
+        token = self.take()
+        if token is None:
+            raise QueryError("query ends too early")
+        if token == ("op", "not"):
+            return ("not", self.unary())
+        if token == ("(",):
+            node = self.expression()
+            if self.take() != (")",):
+                raise QueryError("missing closing parenthesis")
+            return node
+        if token[0] == "term":
+            return token
+        raise QueryError(f"unexpected [{token[-1]}]")
+
+
+def parse_query(text: str):
+    """
+    :return: query tree of ("and", [nodes]), ("or", [nodes]), ("not", node) and term tokens; None for an empty query
+    :raise QueryError: if the query is malformed
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return None
+    parser = _Parser(tokens)
+    node = parser.expression()
+    if parser.peek() is not None:
+        raise QueryError(f"unexpected [{parser.peek()[-1]}]")
+    return node
+
+
+############
+# Evaluate #
+############
+def date_range(value: str):
+    """
+    :return: (first day, last day) of a date term value, or None if it is not a date
+    """
+    for prefix in (">=", "<=", ">", "<"):
+        if value.startswith(prefix):
+            span = metasearch.parse_date(value[len(prefix):])
+            if span is None:
+                return None
+            if prefix == ">=":
+                return span[0], LAST_DAY
+            if prefix == ">":
+                return span[1] + 1, LAST_DAY
+            if prefix == "<=":
+                return FIRST_DAY, span[1]
+            return FIRST_DAY, span[0] - 1
+    if ".." in value:
+        start, _, end = value.partition("..")
+        first = metasearch.parse_date(start) if start else (FIRST_DAY, FIRST_DAY)
+        last = metasearch.parse_date(end) if end else (LAST_DAY, LAST_DAY)
+        if first is None or last is None:
+            return None
+        return first[0], last[1]
+    return metasearch.parse_date(value)
+
+
+def match_term(search_index, field, separator, value):
+    value = value.strip().lower()
+    exact = separator == "="
+    if field is None:
+        matches = set()
+        for any_field in ("people",) + metasearch.SUBSTRING_FIELDS:
+            matches |= match_term(search_index, any_field, separator, value)
+        return matches
+    if exact:
+        return search_index.match_exact(field, value)
+    if field == "date":
+        span = date_range(value)
+        if span is not None:
+            return search_index.match_dates(*span)
+    return search_index.match_substring(field, value)
+
+
+def evaluate(node, search_index) -> set:
+    kind = node[0]
+    if kind == "term":
+        return match_term(search_index, node[1], node[2], node[3])
+    if kind == "not":
+        return set(search_index.all_paths()) - evaluate(node[1], search_index)
+    operand_sets = [evaluate(operand, search_index) for operand in node[1]]
+    if kind == "and":
+        operand_sets.sort(key=len)
+        return operand_sets[0].intersection(*operand_sets[1:])
+    return set().union(*operand_sets)
+
+
+def run_query(search_index, text: str):
+    """
+    :return: set of matching image paths, or None for an empty query (no restriction)
+    :raise QueryError: if the query is malformed
+    """
+    node = parse_query(text)
+    if node is None:
+        return None
+    return evaluate(node, search_index)
@@ -0,0 +1,62 @@
+"""
+Discovery of the image files in a library folder.
+
+The folder tree is walked with os.scandir, which returns the file type with every directory entry, so only the
+image files themselves are stat()ed. Paths are relative to the library folder. A rescan compares sizes and
+modification times against what is already known, so only added and modified files need their EXIF parsed again.
+"""
+import os
+
+
+def is_image_file(filename: str):
+    # at minimum, must be ".jpg" (4) or larger like ".jpeg" (5)
+    if not len(filename) > 4:
+        return False
+    is_jpg = filename[-3:].lower() == 'jpg' or filename[-4:].lower() == 'jpeg'
+
+    return is_jpg
+
+
+def scan_images(root: str, exclude_dirs=()):
+    """
+    Walk the library folder
+    :param exclude_dirs: folders (relative to root or absolute) that are skipped, e.g. the export folder
+    :return: generator of (path relative to root, size, mtime_ns) for every image file
+    """
+    excluded = {os.path.relpath(os.path.join(root, path), root) for path in exclude_dirs}
+    pending = [""]
+    while pending:
+        relative_dir = pending.pop()
+        try:
+            with os.scandir(os.path.join(root, relative_dir)) as entries:
+                subdirs = []
+                for entry in entries:
+                    path = os.path.join(relative_dir, entry.name) if relative_dir else entry.name
+                    try:
+                        # symlinked folders are not followed, so a link loop can't make the scan run forever
+                        if entry.is_dir(follow_symlinks=False):
+                            if path not in excluded:
+                                subdirs.append(path)
+                        elif is_image_file(entry.name) and entry.is_file():
+                            stat = entry.stat()
+                            yield path, stat.st_size, stat.st_mtime_ns
+                    except OSError as e:
+                        print(f"[ERROR] Failed to read [{path}] with error [{e}] while scanning the library")
+        except OSError as e:
+            print(f"[ERROR] Failed to scan folder [{relative_dir or root}] with error [{e}]")
+            continue
+        # depth first, in name order, so images of the same folder stay together
+        pending.extend(sorted(subdirs, reverse=True))
+
+
+def diff_scan(known: dict, scanned: dict):
+    """
+    Compare a fresh scan with the known images
+    :param known: dict of path -> (size, mtime_ns), or None for images whose size and mtime are not known
+    :param scanned: dict of path -> (size, mtime_ns) as found by scan_images()
+    :return: (added, removed, modified) lists of paths
+    """
+    added = [path for path in scanned if path not in known]
+    removed = [path for path in known if path not in scanned]
+    modified = [path for path, stats in known.items() if path in scanned and scanned[path] != stats]
+    return added, removed, modified
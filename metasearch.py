@@ -0,0 +1,806 @@
+"""
+In-memory search index over the indexed ImageDescription fields.
+
+Images are numbered in the order they are indexed, and the fields are kept in columns rather than a dict per image:
+every distinct value of a field is stored once in a Vocabulary (interned, with an id), and each image only holds the
+ids of its values (an array of ints per field, a tuple of person ids for people). A large library then costs about
+200 bytes per image instead of a few kilobytes of dicts and sets.
+
+People are matched exactly (case-insensitive) through a person -> images posting array. Location, date, group and
+comment are matched by substring: every distinct lowercase value has a posting array of image ids, and a trigram
+map over the distinct values narrows down which values can contain the query. A query walks the smallest posting
+array of its filters and checks the other filters against the columns, so its cost follows the size of the result
+rather than the size of the library.
+
+The distinct people, location and group values are also kept in a PrefixIndex each, a sorted array searched with
+bisect, for autocompletion ranked by how many images have the value.
+
+Free-text dates ("1962", "Summer 1962", "12/25/1970", "the 1960s", ...) are also normalized into a span of days
+and kept in a DateIndex sorted by first day, so date range queries are a binary search plus the matches.
+"""
+import bisect
+import calendar
+import datetime
+import heapq
+import re
+import sys
+from array import array
+
+SUBSTRING_FIELDS = ("location", "date", "group", "comment")
+
+# fields whose values are suggested while typing
+COMPLETION_FIELDS = ("people", "location", "group")
+
+GRAM_SIZE = 3
+
+# dates outside these years are not taken for dates (e.g. a "4321" in a comment)
+MIN_YEAR = 1800
+MAX_YEAR = 2199
+
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): number for number, name in enumerate(calendar.month_abbr) if name})
+MONTHS["sept"] = 9
+
+# (first month, first day, last month, last day); winter runs into the next year
+SEASONS = {
+    "spring": (3, 1, 5, 31),
+    "summer": (6, 1, 8, 31),
+    "fall": (9, 1, 11, 30),
+    "autumn": (9, 1, 11, 30),
+    "winter": (12, 1, 2, None),
+    "christmas": (12, 24, 12, 26),
+    "easter": (3, 22, 4, 25),
+    "halloween": (10, 31, 10, 31),
+    "thanksgiving": (11, 22, 11, 28),
+}
+
+_YEAR = r"(\d{4})"
+_MONTH_NAME = r"(" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\.?"
+DATE_PATTERNS = [
+    # most specific first
+    ("ymd", re.compile(_YEAR + r"-(\d{1,2})-(\d{1,2})")),
+    ("mdy", re.compile(r"(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})\b")),
+    ("name_d_y", re.compile(r"\b" + _MONTH_NAME + r"\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+" + _YEAR)),
+    ("d_name_y", re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+" + _MONTH_NAME + r",?\s+" + _YEAR)),
+    ("year_range", re.compile(r"\b" + _YEAR + r"\s*(?:-|to|\.\.)\s*" + _YEAR + r"\b")),
+    ("ym", re.compile(r"\b" + _YEAR + r"-(\d{1,2})\b")),
+    ("my", re.compile(r"\b(\d{1,2})/" + _YEAR + r"\b")),
+    ("name_y", re.compile(r"\b" + _MONTH_NAME + r",?\s+" + _YEAR)),
+    ("season_y", re.compile(r"\b(" + "|".join(SEASONS) + r")(?:\s+of)?,?\s+" + _YEAR)),
+    ("decade", re.compile(r"\b(\d{3})0'?s\b")),
+    ("year", re.compile(r"\b" + _YEAR + r"\b")),
+]
+
+
+def _day(year: int, month: int, day: int) -> int:
+    return datetime.date(year, month, day).toordinal()
+
+
+def _month_span(year: int, month: int):
+    return _day(year, month, 1), _day(year, month, calendar.monthrange(year, month)[1])
+
+
+def _year_span(first_year: int, last_year: int):
+    return _day(first_year, 1, 1), _day(last_year, 12, 31)
+
+
+def parse_date(text: str):
+    """
+    Normalize a free-text date into the span of days it covers
+    :return: (first day, last day) as date ordinals, or None if no date was recognized
+    """
+    text = text.lower()
+    for kind, pattern in DATE_PATTERNS:
+        match = pattern.search(text)
+        if match is None:
+            continue
+        groups = match.groups()
+        try:
+            if kind == "ymd":
+                year, month, day = int(groups[0]), int(groups[1]), int(groups[2])
+                span = _day(year, month, day), _day(year, month, day)
+            elif kind == "mdy":
+                month, day, year = int(groups[0]), int(groups[1]), int(groups[2])
+                if len(groups[2]) == 2:
+                    # 12/25/70: a two digit year is taken as the most recent one that is not in the future
+                    year += 2000 if year <= datetime.date.today().year % 100 else 1900
+                span = _day(year, month, day), _day(year, month, day)
+            elif kind == "name_d_y":
+                year, month, day = int(groups[2]), MONTHS[groups[0]], int(groups[1])
+                span = _day(year, month, day), _day(year, month, day)
+            elif kind == "d_name_y":
+                year, month, day = int(groups[2]), MONTHS[groups[1]], int(groups[0])
+                span = _day(year, month, day), _day(year, month, day)
+            elif kind == "year_range":
+                year, last_year = int(groups[0]), int(groups[1])
+                if last_year < year:
+                    continue
+                span = _year_span(year, last_year)
+            elif kind == "ym":
+                year = int(groups[0])
+                span = _month_span(year, int(groups[1]))
+            elif kind == "my":
+                year = int(groups[1])
+                span = _month_span(year, int(groups[0]))
+            elif kind == "name_y":
+                year = int(groups[1])
+                span = _month_span(year, MONTHS[groups[0]])
+            elif kind == "season_y":
+                year = int(groups[1])
+                first_month, first_day, last_month, last_day = SEASONS[groups[0]]
+                last_year = year + 1 if last_month < first_month else year
+                if last_day is None:
+                    last_day = calendar.monthrange(last_year, last_month)[1]
+                span = _day(year, first_month, first_day), _day(last_year, last_month, last_day)
+            elif kind == "decade":
+                year = int(groups[0]) * 10
+                span = _year_span(year, year + 9)
+            else:
+                year = int(groups[0])
+                span = _year_span(year, year)
+        except ValueError:
+            # e.g. 13/45/1970: not a date after all
+            continue
+        if MIN_YEAR <= year <= MAX_YEAR:
+            return span
+    return None
+
+
+class DateIndex:
+    """
+    Images by the span of days their date covers. The spans are columns indexed by image id, and the images with a
+    date are kept sorted by first day as one array of (first day << 32 | image id) codes. Changes are applied to the
+    sorted array lazily: a few at a time with bisect when there are few, by sorting everything again when there are
+    many (e.g. while indexing a library).
+    """
+    # pending changes beyond which the sorted array is rebuilt instead of patched
+    REBUILD_THRESHOLD = 256
+
+    def __init__(self):
+        # image id -> first / last day of its date (0: no date)
+        self.firsts = array("i")
+        self.lasts = array("i")
+        self.count = 0
+        self.codes = array("q")  # first day << 32 | image id, sorted
+        # length of the longest span: an image overlapping a range can't start more than this before it
+        self.max_length = 0
+        self.pending = []  # (old code or None, new code or None) not yet applied to codes
+        self.stale = False  # too many pending changes: rebuild
+
+    def __len__(self):
+        return self.count
+
+    def update(self, image: int, span):
+        """
+        :param span: (first day, last day), or None if the image has no recognizable date
+        """
+        if image >= len(self.firsts):
+            zeros = array("i", bytes(4 * (image + 1 - len(self.firsts))))
+            self.firsts.extend(zeros)
+            self.lasts.extend(zeros)
+        old_first = self.firsts[image]
+        new_first, new_last = span if span is not None else (0, 0)
+        if old_first == new_first and self.lasts[image] == new_last:
+            return
+        self.firsts[image] = new_first
+        self.lasts[image] = new_last
+        self.count += bool(new_first) - bool(old_first)
+        self.max_length = max(self.max_length, new_last - new_first)
+        if old_first == new_first or self.stale:
+            # same position in the sorted array (only the last day changed), or it is rebuilt anyway
+            return
+        self.pending.append((
+            old_first << 32 | image if old_first else None,
+            new_first << 32 | image if new_first else None,
+        ))
+        if len(self.pending) > self.REBUILD_THRESHOLD:
+            self.pending = []
+            self.stale = True
+
+    def remove(self, image: int):
+        self.update(image, None)
+
+    def _apply_pending(self):
+        if self.stale:
+            self.codes = array("q", sorted(first << 32 | image for image, first in enumerate(self.firsts) if first))
+            self.max_length = max(
+                (last - first for first, last in zip(self.firsts, self.lasts) if first), default=0
+            )
+            self.stale = False
+            return
+        for old, new in self.pending:
+            if old is not None:
+                position = bisect.bisect_left(self.codes, old)
+                if position < len(self.codes) and self.codes[position] == old:
+                    del self.codes[position]
+            if new is not None:
+                self.codes.insert(bisect.bisect_left(self.codes, new), new)
+        self.pending = []
+
+    def overlapping(self, first: int, last: int) -> set:
+        """
+        :return: ids of the images whose date span overlaps the days first..last (inclusive); costs
+            O(log n + matches)
+        """
+        if self.pending or self.stale:
+            self._apply_pending()
+        start = bisect.bisect_left(self.codes, max(0, first - self.max_length) << 32)
+        end = bisect.bisect_left(self.codes, (last + 1) << 32)
+        lasts = self.lasts
+        return {code & 0xFFFFFFFF for code in self.codes[start:end] if lasts[code & 0xFFFFFFFF] >= first}
+
+
+class PrefixIndex:
+    """
+    Distinct values of a field for autocompletion. The lowercase values are kept in a sorted array, where the values
+    starting with a prefix are one bisect range, and ranked by the number of images having them. Like the DateIndex,
+    the array is patched with bisect after a few changes and sorted again after many.
+
+    Short prefixes match thousands of values, too many to rank on every key press, so the ranked suggestions of such
+    prefixes are remembered and kept up to date as the counts change.
+    """
+    # pending changes beyond which the array is rebuilt instead of patched
+    REBUILD_THRESHOLD = 256
+    # prefixes matching more values than this keep their ranked suggestions
+    CACHE_MIN_MATCHES = 256
+    # suggestions kept per remembered prefix; the most a suggest() call can return
+    RANKED_SIZE = 16
+
+    def __init__(self):
+        self.counts = {}  # lowercase value -> number of images with it
+        self.names = {}  # lowercase value -> value as last written, for display
+        self.keys = []  # lowercase values, sorted
+        self.pending = set()  # values added or gone since keys was last brought up to date
+        self.stale = False  # too many pending changes: rebuild
+        self.ranked = {}  # prefix -> best RANKED_SIZE values starting with it, best first
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _order(self, key: str):
+        return -self.counts[key], key
+
+    def add(self, value: str):
+        key = value.lower()
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        self.names[key] = value
+        if count == 0:
+            self._changed(key)
+        self._rerank(key)
+
+    def discard(self, value: str):
+        key = value.lower()
+        count = self.counts.get(key)
+        if not count:
+            return
+        if count == 1:
+            del self.counts[key]
+            del self.names[key]
+            self._changed(key)
+        else:
+            self.counts[key] = count - 1
+        self._rerank(key)
+
+    def _changed(self, key: str):
+        if self.stale:
+            return
+        self.pending.add(key)
+        if len(self.pending) > self.REBUILD_THRESHOLD:
+            self.pending = set()
+            self.stale = True
+
+    def _rerank(self, key: str):
+        # only the remembered prefixes of key can be affected
+        if not self.ranked:
+            return
+        for end in range(len(key) + 1):
+            prefix = key[:end]
+            ranked = self.ranked.get(prefix)
+            if ranked is None:
+                continue
+            if key in ranked:
+                ranked.remove(key)
+                if key not in self.counts or (ranked and self._order(key) > self._order(ranked[-1])):
+                    # gone or fallen to the end: a value that isn't remembered may now rank higher
+                    del self.ranked[prefix]
+                    continue
+            elif key not in self.counts or self._order(key) > self._order(ranked[-1]):
+                continue
+            else:
+                ranked.pop()
+            ranked.append(key)
+            ranked.sort(key=self._order)
+
+    def _apply_pending(self):
+        if self.stale:
+            self.keys = sorted(self.counts)
+            self.stale = False
+            return
+        for key in self.pending:
+            position = bisect.bisect_left(self.keys, key)
+            present = position < len(self.keys) and self.keys[position] == key
+            if key in self.counts and not present:
+                self.keys.insert(position, key)
+            elif key not in self.counts and present:
+                del self.keys[position]
+        self.pending = set()
+
+    def suggest(self, prefix: str, limit: int = 8) -> list:
+        """
+        :return: up to limit values starting with prefix (case-insensitive), most frequent first; the prefix itself
+            is left out, since there is nothing to complete
+        """
+        if self.pending or self.stale:
+            self._apply_pending()
+        prefix = prefix.lower()
+        ranked = self.ranked.get(prefix)
+        if ranked is None:
+            ranked = self._rank(prefix, bisect.bisect_left(self.keys, prefix))
+        return [self.names[key] for key in ranked if key != prefix][:limit]
+
+    def _rank(self, prefix: str, start: int) -> list:
+        # start: position of the first value starting with prefix
+        end = bisect.bisect_left(self.keys, prefix + "\U0010ffff", start)
+        ranked = heapq.nsmallest(self.RANKED_SIZE, self.keys[start:end], key=self._order)
+        if end - start > self.CACHE_MIN_MATCHES:
+            self.ranked[prefix] = ranked
+        return ranked
+
+    def prepare(self):
+        """
+        Bring the array up to date and rank the one letter prefixes ahead of time (e.g. once indexing is done), so
+        the first key press doesn't pay for them
+        """
+        if self.pending or self.stale:
+            self._apply_pending()
+        start = 0
+        while start < len(self.keys):
+            first = self.keys[start][:1]
+            end = bisect.bisect_left(self.keys, first + "\U0010ffff", start)
+            if first not in self.ranked and end - start > self.CACHE_MIN_MATCHES:
+                self._rank(first, start)
+            start = end
+
+
+def _grams(text: str):
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def is_refinement(old_query, new_query) -> bool:
+    """
+    Check whether every image matching new_query also matches old_query, i.e. the new query only narrows the old one
+    :param old_query: (people, location, date, group, comment) as passed to SearchIndex.query()
+    """
+    old_people, *old_texts = old_query
+    new_people, *new_texts = new_query
+    if not set(old_people) <= set(new_people):
+        return False
+    # a substring filter narrows when the new text still contains the old one (e.g. "par" -> "paris")
+    return all(old_text in new_text for old_text, new_text in zip(old_texts, new_texts))
+
+
+class Vocabulary:
+    """
+    The distinct values of a field, each kept once (interned) and numbered, with the images having each value.
+    Images refer to values by number, so a value shared by thousands of images costs one string.
+    """
+
+    def __init__(self):
+        self.ids = {}  # value -> id
+        self.values = []  # id -> value (None for an unused id)
+        self.lower = []  # id -> lowercase value
+        self.counts = []  # id -> number of images with the value
+        # id -> ids of the images that had the value at some point; the column of an image tells whether it still
+        # has it (see SearchIndex)
+        self.postings = []
+        self.by_lower = {}  # lowercase value -> ids of the values differing from it only in case
+        self.grams = {}  # trigram -> ids of the values whose lowercase contains it
+        self.free = []  # unused ids, to be handed out again
+
+    def __len__(self):
+        return len(self.ids)
+
+    def acquire(self, value: str) -> int:
+        """
+        Count one more image with value
+        :return: id of the value
+        """
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value = sys.intern(value)
+            lower = value.lower()
+            if self.free:
+                value_id = self.free.pop()
+                self.values[value_id] = value
+                self.lower[value_id] = lower
+                self.postings[value_id] = array("i")
+            else:
+                value_id = len(self.values)
+                self.values.append(value)
+                self.lower.append(lower)
+                self.counts.append(0)
+                self.postings.append(array("i"))
+            self.ids[value] = value_id
+            self.by_lower.setdefault(lower, []).append(value_id)
+            for gram in _grams(lower):
+                self.grams.setdefault(gram, set()).add(value_id)
+        self.counts[value_id] += 1
+        return value_id
+
+    def release(self, value_id: int):
+        """
+        Count one image less with the value; a value no image has any more is dropped
+        """
+        self.counts[value_id] -= 1
+        if self.counts[value_id]:
+            return
+        lower = self.lower[value_id]
+        del self.ids[self.values[value_id]]
+        same_lower = self.by_lower[lower]
+        same_lower.remove(value_id)
+        if not same_lower:
+            del self.by_lower[lower]
+        for gram in _grams(lower):
+            gram_ids = self.grams[gram]
+            gram_ids.discard(value_id)
+            if not gram_ids:
+                del self.grams[gram]
+        self.values[value_id] = None
+        self.lower[value_id] = None
+        self.postings[value_id] = None
+        self.free.append(value_id)
+
+    def exact(self, text: str) -> list:
+        """
+        :param text: lowercase value
+        :return: ids of the values equal to text, ignoring case
+        """
+        return self.by_lower.get(text, [])
+
+    def containing(self, text: str) -> list:
+        """
+        :param text: lowercase text
+        :return: ids of the values containing text, ignoring case
+        """
+        grams = _grams(text)
+        if grams:
+            gram_sets = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+            candidates = gram_sets[0].intersection(*gram_sets[1:])
+            return [value_id for value_id in candidates if text in self.lower[value_id]]
+        # text shorter than a trigram only scans the distinct values, not the images
+        return [value_id for lower, ids in self.by_lower.items() if text in lower for value_id in ids]
+
+
+class RecordView:
+    """
+    Read-only mapping of image path -> record (people as a set, the other fields as strings), built on demand from
+    the columns of a SearchIndex, so the records don't have to be kept as dicts as well
+    """
+
+    def __init__(self, search_index):
+        self.search_index = search_index
+
+    def __len__(self):
+        return len(self.search_index)
+
+    def __contains__(self, path):
+        return path in self.search_index
+
+    def __iter__(self):
+        return iter(self.search_index.ids)
+
+    def __getitem__(self, path: str) -> dict:
+        record = self.search_index.record(path)
+        if record is None:
+            raise KeyError(path)
+        return record
+
+    def get(self, path: str, default=None):
+        record = self.search_index.record(path)
+        return default if record is None else record
+
+    def clear(self):
+        self.search_index.clear()
+
+
+class SearchIndex:
+    """
+    Images are numbered in the order they are added (so results keep that order), and their fields are columns
+    indexed by that number: an array of value ids per field and a tuple of person ids per image, the values
+    themselves being kept once per field in a Vocabulary. Per image this costs a few machine words instead of a dict
+    and a set of strings.
+
+    Every value has a posting array of the images that got it. Arrays can't drop entries cheaply, so an image that
+    changes or loses a value stays in the old posting array until the postings are rebuilt; a query only takes
+    posting entries that the image's column confirms.
+    """
+    # stale posting entries (beyond this minimum) that make the postings be rebuilt, relative to the image count
+    COMPACT_MINIMUM = 4096
+
+    def __init__(self):
+        # bumped on every change, so callers can tell whether earlier results are still valid
+        self.version = 0
+
+        self.ids = {}  # image path -> image id
+        self.paths = []  # image id -> path (None once removed)
+
+        # people: image id -> tuple of person ids (None: the record has no people field)
+        self.people_vocabulary = Vocabulary()
+        self.people = []
+
+        # other fields: image id -> value id (-1: the record doesn't have the field)
+        self.vocabularies = {field: Vocabulary() for field in SUBSTRING_FIELDS}
+        self.columns = {field: array("i") for field in SUBSTRING_FIELDS}
+
+        # posting entries no longer confirmed by the columns
+        self.stale = 0
+
+        # normalized date spans, for range queries
+        self.dates = DateIndex()
+
+        # field -> distinct values, for autocompletion
+        self.completions = {field: PrefixIndex() for field in COMPLETION_FIELDS}
+
+        self.records = RecordView(self)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, path):
+        return path in self.ids
+
+    def clear(self):
+        version = self.version
+        self.__init__()
+        self.version = version + 1
+
+    def all_paths(self) -> list:
+        return [path for path in self.paths if path is not None]
+
+    def in_order(self, paths) -> list:
+        """
+        :return: paths sorted in the order they were added to the index
+        """
+        return sorted(paths, key=self.ids.__getitem__)
+
+    def update(self, path: str, record: dict):
+        """
+        Add an image or replace its indexed fields
+        :param record: indexed_images entry (people as a set, the other fields as strings)
+        """
+        self.version += 1
+        image = self.ids.get(path)
+        if image is None:
+            image = len(self.paths)
+            self.ids[path] = image
+            self.paths.append(path)
+            self.people.append(None)
+            for column in self.columns.values():
+                column.append(-1)
+        self._assign(image, record)
+        self._compact_if_stale()
+
+    def remove(self, path: str):
+        image = self.ids.pop(path, None)
+        if image is None:
+            return
+        self.version += 1
+        self._assign(image, {})
+        self.paths[image] = None
+        self._compact_if_stale()
+
+    def _assign(self, image: int, record: dict):
+        # new values are acquired before the old ones are released, so a value that stays is never dropped
+        vocabulary = self.people_vocabulary
+        old_people = self.people[image]
+        new_people = None
+        if 'people' in record:
+            # lowercase person -> person as written
+            names = {}
+            for person in record['people']:
+                person = person.strip()
+                if person:
+                    names.setdefault(person.lower(), person)
+            new_people = tuple(vocabulary.acquire(person) for person in names.values())
+        self.people[image] = new_people
+        for person_id in new_people or ():
+            if old_people is None or person_id not in old_people:
+                vocabulary.postings[person_id].append(image)
+                self.completions["people"].add(vocabulary.values[person_id])
+        for person_id in old_people or ():
+            if new_people is None or person_id not in new_people:
+                self.stale += 1
+                self.completions["people"].discard(vocabulary.values[person_id])
+            vocabulary.release(person_id)
+
+        for field in SUBSTRING_FIELDS:
+            vocabulary = self.vocabularies[field]
+            column = self.columns[field]
+            old_id = column[image]
+            new_id = vocabulary.acquire(record[field]) if field in record else -1
+            if new_id != old_id:
+                column[image] = new_id
+                completion = self.completions.get(field)
+                if new_id != -1:
+                    vocabulary.postings[new_id].append(image)
+                    if completion is not None and record[field]:
+                        completion.add(record[field])
+                if old_id != -1:
+                    self.stale += 1
+                    if completion is not None and vocabulary.values[old_id]:
+                        completion.discard(vocabulary.values[old_id])
+                if field == "date":
+                    self.dates.update(image, parse_date(record['date']) if record.get('date') else None)
+            if old_id != -1:
+                vocabulary.release(old_id)
+
+    def _compact_if_stale(self):
+        if len(self.paths) - len(self.ids) > max(self.COMPACT_MINIMUM, len(self.ids)):
+            # mostly ids of removed images: number the images again from scratch
+            records = [(path, self.record(path)) for path in self.all_paths()]
+            version = self.version
+            self.__init__()
+            self.version = version
+            for path, record in records:
+                self.update(path, record)
+            return
+        if self.stale <= max(self.COMPACT_MINIMUM, len(self.ids)):
+            return
+        vocabulary = self.people_vocabulary
+        vocabulary.postings = [None if value is None else array("i") for value in vocabulary.values]
+        for image, person_ids in enumerate(self.people):
+            for person_id in person_ids or ():
+                vocabulary.postings[person_id].append(image)
+        for field in SUBSTRING_FIELDS:
+            vocabulary = self.vocabularies[field]
+            vocabulary.postings = [None if value is None else array("i") for value in vocabulary.values]
+            for image, value_id in enumerate(self.columns[field]):
+                if value_id != -1:
+                    vocabulary.postings[value_id].append(image)
+        self.stale = 0
+
+    def record(self, path: str):
+        """
+        :return: the indexed fields of an image (people as a set, the other fields as strings), or None
+        """
+        image = self.ids.get(path)
+        if image is None:
+            return None
+        record = {}
+        for field in SUBSTRING_FIELDS:
+            value_id = self.columns[field][image]
+            if value_id != -1:
+                record[field] = self.vocabularies[field].values[value_id]
+        if self.people[image] is not None:
+            values = self.people_vocabulary.values
+            record['people'] = {values[person_id] for person_id in self.people[image]}
+        return record
+
+    def suggest(self, field: str, prefix: str, limit: int = 8) -> list:
+        """
+        Autocompletion: known values of a field (one of COMPLETION_FIELDS) starting with prefix, most used first
+        """
+        prefix = prefix.strip()
+        if not prefix:
+            return []
+        return self.completions[field].suggest(prefix, limit)
+
+    def prepare_completions(self):
+        for completion in self.completions.values():
+            completion.prepare()
+
+    ###########
+    # Filters #
+    ###########
+    # A filter is (posting arrays, check): the images it can match are among the postings, and check(image id)
+    # confirms one against the columns.
+    def _people_filter(self, person_ids):
+        person_ids = set(person_ids)
+        people = self.people
+        postings = [self.people_vocabulary.postings[person_id] for person_id in person_ids]
+        return postings, lambda image: not person_ids.isdisjoint(people[image] or ())
+
+    def _value_filter(self, field: str, value_ids):
+        value_ids = set(value_ids)
+        column = self.columns[field]
+        postings = [self.vocabularies[field].postings[value_id] for value_id in value_ids]
+        return postings, lambda image: column[image] in value_ids
+
+    def _filters(self, people, location, date, group, comment) -> list:
+        filters = []
+        for person in people:
+            if person:
+                filters.append(self._people_filter(self.people_vocabulary.exact(person)))
+        for field, text in zip(SUBSTRING_FIELDS, (location, date, group, comment)):
+            if text:
+                filters.append(self._value_filter(field, self.vocabularies[field].containing(text)))
+        return filters
+
+    def _run(self, filters) -> set:
+        """
+        :return: ids of the images passing every filter; walks the postings of the most selective filter only
+        """
+        filters = sorted(filters, key=lambda f: sum(len(postings) for postings in f[0]))
+        checks = [check for postings, check in filters]
+        matches = set()
+        for postings in filters[0][0]:
+            for image in postings:
+                if all(check(image) for check in checks):
+                    matches.add(image)
+        return matches
+
+    def _paths(self, images) -> set:
+        paths = self.paths
+        return {paths[image] for image in images}
+
+    def match_people(self, people) -> set:
+        """
+        :param people: lowercase names; an image has to contain every one of them
+        """
+        filters = [self._people_filter(self.people_vocabulary.exact(person)) for person in people]
+        return self._paths(self._run(filters)) if filters else set()
+
+    def match_substring(self, field: str, text: str) -> set:
+        """
+        :param field: "people" or one of SUBSTRING_FIELDS
+        :param text: lowercase text that has to be contained in the field
+        """
+        if field == "people":
+            return self._paths(self._run([self._people_filter(self.people_vocabulary.containing(text))]))
+        return self._paths(self._run([self._value_filter(field, self.vocabularies[field].containing(text))]))
+
+    def match_exact(self, field: str, text: str) -> set:
+        """
+        :param field: "people" or one of SUBSTRING_FIELDS
+        :param text: lowercase text the field has to be equal to
+        """
+        if field == "people":
+            return self.match_people([text])
+        return self._paths(self._run([self._value_filter(field, self.vocabularies[field].exact(text))]))
+
+    def match_dates(self, first: int, last: int) -> set:
+        """
+        :return: images whose date span overlaps the days first..last (inclusive)
+        """
+        return self._paths(self.dates.overlapping(first, last))
+
+    def query(self, people=(), location="", date="", group="", comment="") -> list:
+        """
+        Find the images matching every non-empty filter
+        :param people: lowercase names that all have to be tagged in the image
+        :param location: lowercase substrings of the respective fields
+        :return: matching image paths, in the order they were added to the index
+        """
+        filters = self._filters(people, location, date, group, comment)
+        if not filters:
+            return self.all_paths()
+        paths = self.paths
+        return [paths[image] for image in sorted(self._run(filters))]
+
+    def matches(self, path: str, people=(), location="", date="", group="", comment="") -> bool:
+        """
+        Check a single image against a query (same arguments as query())
+        """
+        image = self.ids.get(path)
+        if image is None:
+            return False
+        person_ids = self.people[image] or ()
+        values = self.people_vocabulary.lower
+        image_people = [values[person_id] for person_id in person_ids]
+        for person in people:
+            if person and person not in image_people:
+                return False
+        for field, text in zip(SUBSTRING_FIELDS, (location, date, group, comment)):
+            if not text:
+                continue
+            value_id = self.columns[field][image]
+            if value_id == -1 or text not in self.vocabularies[field].lower[value_id]:
+                return False
+        return True
+
+    def refine(self, paths, people=(), location="", date="", group="", comment="") -> list:
+        """
+        Re-check the results of a broader query against a narrower one; costs O(len(paths))
+        """
+        return [path for path in paths if self.matches(path, people, location, date, group, comment)]
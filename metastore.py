@@ -0,0 +1,273 @@
+"""
+Optional central store for edits, so that editing doesn't rewrite the image files.
+
+By default edits are written straight into the ImageDescription of each JPEG. That is slow on network shares, and
+it changes the file's mtime, so backup tools upload the whole photo again for every tag. With METAEDIT_STORE set
+to:
+
+- "sidecar": edits are kept in a .metaedit.json file in each folder ({"file name": {field: value}})
+- "database": edits are kept in one SQLite file in the library folder (.metaedit_store.sqlite3)
+
+Only the fields that differ from the embedded ImageDescription are stored, and reading an image merges them over
+it. The images themselves are written later, all at once, by a sync ("Sync to EXIF" in the editor, or this module
+from the command line): the stored fields are merged into the files on a pool of threads, and every entry that
+made it into its file is dropped from the store.
+
+usage: python metastore.py --store sidecar|database [--root DIR] [--workers 8] [--report report.jsonl] [--no-index]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import metabatch
+import metaindex
+
+STORE_KINDS = ("sidecar", "database")
+
+SIDECAR_FILENAME = ".metaedit.json"
+STORE_FILENAME = ".metaedit_store.sqlite3"
+
+# synced entries dropped from the store between commits
+SYNC_COMMIT_INTERVAL = 256
+
+
+class SidecarStore:
+    """
+    Edits in a JSON file per folder, next to the images. The files of the folders in use are kept in memory and
+    written back (atomically) on commit().
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.folders = {}  # folder relative to root -> {file name: fields}
+        self.dirty = set()  # folders changed since the last commit
+
+    def _sidecar_path(self, folder: str) -> str:
+        return os.path.join(self.root, folder, SIDECAR_FILENAME)
+
+    def _entries(self, folder: str) -> dict:
+        entries = self.folders.get(folder)
+        if entries is not None:
+            return entries
+        sidecar_path = self._sidecar_path(folder)
+        try:
+            with open(sidecar_path, encoding="utf-8") as f:
+                entries = json.load(f)
+            if not isinstance(entries, dict):
+                raise ValueError("not a JSON object")
+        except FileNotFoundError:
+            entries = {}
+        except (OSError, ValueError) as e:
+            # keep the broken file around rather than overwriting it on the next commit
+            print(f"[ERROR] Failed to read sidecar [{sidecar_path}] with error [{e}]. It is renamed to .corrupt.")
+            try:
+                os.replace(sidecar_path, sidecar_path + ".corrupt")
+            except OSError:
+                pass
+            entries = {}
+        self.folders[folder] = entries
+        return entries
+
+    def get(self, path: str):
+        folder, name = os.path.split(path)
+        return self._entries(folder).get(name)
+
+    def put(self, path: str, fields: dict):
+        folder, name = os.path.split(path)
+        self._entries(folder)[name] = dict(fields)
+        self.dirty.add(folder)
+
+    def remove(self, path: str, fields: dict = None) -> bool:
+        """
+        :param fields: only remove the entry if it still holds these fields (it wasn't edited again meanwhile)
+        :return: True if an entry was removed
+        """
+        folder, name = os.path.split(path)
+        entries = self._entries(folder)
+        if name not in entries or (fields is not None and entries[name] != fields):
+            return False
+        del entries[name]
+        self.dirty.add(folder)
+        return True
+
+    def entries(self) -> dict:
+        """
+        :return: dict of path -> stored fields for the whole library
+        """
+        found = {}
+        for folder, dirs, files in os.walk(self.root):
+            if SIDECAR_FILENAME not in files:
+                continue
+            relative_dir = os.path.relpath(folder, self.root)
+            relative_dir = "" if relative_dir == "." else relative_dir
+            for name, fields in self._entries(relative_dir).items():
+                found[os.path.join(relative_dir, name)] = fields
+        # folders edited in this session whose sidecar isn't written yet
+        for relative_dir in self.dirty:
+            for name, fields in self.folders[relative_dir].items():
+                found[os.path.join(relative_dir, name)] = fields
+        return found
+
+    def commit(self):
+        for folder in self.dirty:
+            sidecar_path = self._sidecar_path(folder)
+            entries = self.folders[folder]
+            try:
+                if not entries:
+                    if os.path.exists(sidecar_path):
+                        os.remove(sidecar_path)
+                    continue
+                temp_path = sidecar_path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f, indent=1, sort_keys=True)
+                os.replace(temp_path, sidecar_path)
+            except OSError as e:
+                print(f"[ERROR] Failed to write sidecar [{sidecar_path}] with error [{e}]")
+        self.dirty = set()
+
+    def close(self):
+        self.commit()
+
+
+class DatabaseStore:
+    """
+    Edits in one SQLite file in the library folder
+    """
+
+    def __init__(self, root: str):
+        self.conn = sqlite3.connect(os.path.join(root, STORE_FILENAME))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS edits (path TEXT PRIMARY KEY, fields TEXT NOT NULL)")
+        self.conn.commit()
+
+    def get(self, path: str):
+        row = self.conn.execute("SELECT fields FROM edits WHERE path = ?", (path,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, path: str, fields: dict):
+        self.conn.execute("INSERT OR REPLACE INTO edits (path, fields) VALUES (?, ?)", (path, json.dumps(fields)))
+
+    def remove(self, path: str, fields: dict = None) -> bool:
+        """
+        :param fields: only remove the entry if it still holds these fields (it wasn't edited again meanwhile)
+        :return: True if an entry was removed
+        """
+        if fields is not None and self.get(path) != fields:
+            return False
+        return self.conn.execute("DELETE FROM edits WHERE path = ?", (path,)).rowcount > 0
+
+    def entries(self) -> dict:
+        return {path: json.loads(fields) for path, fields in self.conn.execute("SELECT path, fields FROM edits")}
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def open_store(kind: str, root: str):
+    """
+    :param kind: "sidecar", "database", or "" / "exif" to write edits into the images directly
+    :return: SidecarStore, DatabaseStore, or None when edits go into the images
+    """
+    kind = (kind or "").strip().lower()
+    if kind in ("", "exif"):
+        return None
+    if kind == "sidecar":
+        return SidecarStore(root)
+    if kind == "database":
+        try:
+            return DatabaseStore(root)
+        except sqlite3.Error as e:
+            print(f"[ERROR] Failed to open metadata store in [{root}] with error [{e}]. Edits go into the images.")
+            return None
+    print(f"[ERROR] Unknown metadata store [{kind}], expected one of {STORE_KINDS}. Edits go into the images.")
+    return None
+
+
+def changed_fields(embedded: dict, description: dict) -> dict:
+    """
+    :return: the fields of description that differ from the embedded ImageDescription, i.e. what the store keeps
+    """
+    return {field: value for field, value in description.items() if embedded.get(field) != value}
+
+
+def merge(embedded: dict, stored) -> dict:
+    """
+    :return: the ImageDescription as the user sees it: the embedded one with the stored fields over it
+    """
+    if not stored:
+        return embedded
+    merged = dict(embedded)
+    merged.update(stored)
+    return merged
+
+
+def sync_to_exif(root: str, store, workers: int = 8, index_conn=None):
+    """
+    Write every stored edit into its image file, and drop the entries that made it from the store
+    :param index_conn: library index to keep in step with the written files, if any
+    :return: generator of report entries (as metabatch.apply_edit() returns them) in completion order
+    """
+    entries = store.entries()
+    removed = 0
+    for result in metabatch.apply_manifest(root, entries, workers, index_conn=index_conn):
+        if result["status"] in ("written", "unchanged"):
+            store.remove(result["path"], entries[result["path"]])
+            removed += 1
+            if removed % SYNC_COMMIT_INTERVAL == 0:
+                store.commit()
+        yield result
+    store.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", choices=STORE_KINDS, default=os.environ.get("METAEDIT_STORE") or None,
+                        required=not os.environ.get("METAEDIT_STORE"), help="where the edits are kept")
+    parser.add_argument("--root", default=".", help="library folder")
+    parser.add_argument("--workers", type=int, default=8, help="files written at the same time")
+    parser.add_argument("--report", help="write the per-file report (JSONL) here instead of stdout")
+    parser.add_argument("--no-index", action="store_true", help="don't update the library index")
+    args = parser.parse_args(argv)
+
+    root = os.path.abspath(args.root)
+    store = open_store(args.store, root)
+    if store is None:
+        return 2
+    index_conn = None if args.no_index else metaindex.open_index(root)
+
+    report = open(args.report, "w", encoding="utf-8") if args.report else sys.stdout
+    counts = {"written": 0, "unchanged": 0, "missing": 0, "failed": 0}
+    start = last_progress = time.perf_counter()
+    try:
+        for done, result in enumerate(sync_to_exif(root, store, max(1, args.workers), index_conn), 1):
+            counts[result["status"]] += 1
+            report.write(json.dumps(result) + "\n")
+            now = time.perf_counter()
+            if now - last_progress >= metabatch.PROGRESS_INTERVAL:
+                last_progress = now
+                print(f"\r{done} files, {done / max(now - start, 1e-9):.0f} files/s", end="", file=sys.stderr,
+                      flush=True)
+    finally:
+        if report is not sys.stdout:
+            report.close()
+        if index_conn is not None:
+            index_conn.close()
+        store.close()
+
+    print(file=sys.stderr)
+    print(
+        f"{counts['written']} written, {counts['unchanged']} unchanged, {counts['missing']} missing, "
+        f"{counts['failed']} failed in {time.perf_counter() - start:.1f}s",
+        file=sys.stderr
+    )
+    return 1 if counts["failed"] or counts["missing"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
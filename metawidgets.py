@@ -0,0 +1,396 @@
+"""
+Tk widgets used by the editor.
+"""
+import queue
+import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import ImageTk
+
+import metacache
+
+
+class VirtualListbox(tk.Frame):
+    """
+    Scrollable list that only renders the rows currently in view. The items stay in a plain python list, so
+    memory use and redraw time don't depend on how many items there are.
+    """
+
+    def __init__(self, master, height=10, on_select=None, **listbox_options):
+        """
+        :param height: number of visible rows
+        :param on_select: called with the selected item when a row is clicked
+        :param listbox_options: passed on to the tk.Listbox that shows the visible rows
+        """
+        super().__init__(master)
+        self.items = []
+        self.top = 0  # index of the first visible item
+        self.rows = height
+        self.selected = None  # index of the selected item
+        self.on_select = on_select
+
+        self.count_label = tk.Label(self, text="")
+        self.listbox = tk.Listbox(self, height=height, exportselection=False, **listbox_options)
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+
+        self.count_label.grid(row=0, column=0, columnspan=2, sticky=tk.W)
+        self.listbox.grid(row=1, column=0, sticky=tk.NSEW)
+        self.scrollbar.grid(row=1, column=1, sticky=tk.NS)
+
+        self.listbox.bind("<<ListboxSelect>>", self._on_listbox_select)
+        # mouse wheel: Windows/macOS report a delta, X11 sends button 4/5 presses
+        self.listbox.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1, "units"))
+        self.listbox.bind("<Button-4>", lambda e: self.scroll(-1, "units"))
+        self.listbox.bind("<Button-5>", lambda e: self.scroll(1, "units"))
+        self.listbox.bind("<Prior>", lambda e: self.scroll(-1, "pages"))
+        self.listbox.bind("<Next>", lambda e: self.scroll(1, "pages"))
+        self.listbox.bind("<Home>", lambda e: self.see(0))
+        self.listbox.bind("<End>", lambda e: self.see(len(self.items) - 1))
+
+    def set_items(self, items):
+        """
+        Show a new list of items; the list is referenced, not copied
+        """
+        self.items = items
+        self.selected = None
+        self.top = max(0, min(self.top, len(items) - self.rows))
+        self.count_label.configure(text=f"{len(items)} matching images")
+        self._redraw()
+
+    def see(self, index: int):
+        """
+        Scroll so that the item at index is visible (jump to an item)
+        """
+        if not self.items:
+            return
+        index = max(0, min(index, len(self.items) - 1))
+        if index < self.top:
+            self.top = index
+        elif index >= self.top + self.rows:
+            self.top = index - self.rows + 1
+        self._redraw()
+
+    def select(self, index: int):
+        self.see(index)
+        self.selected = index
+        self._redraw()
+
+    def scroll(self, number: int, what: str):
+        step = self.rows if what == "pages" else 1
+        self._scroll_to(self.top + number * step)
+        return "break"
+
+    def yview(self, *args):
+        # scrollbar callback: ("moveto", fraction) or ("scroll", number, "units" | "pages")
+        if args[0] == "moveto":
+            self._scroll_to(int(float(args[1]) * len(self.items)))
+        elif args[0] == "scroll":
+            self.scroll(int(args[1]), args[2])
+
+    def _scroll_to(self, top: int):
+        top = max(0, min(top, len(self.items) - self.rows))
+        if top != self.top:
+            self.top = top
+            self._redraw()
+
+    def _redraw(self):
+        visible = self.items[self.top:self.top + self.rows]
+        self.listbox.delete(0, "end")
+        if visible:
+            self.listbox.insert(0, *visible)
+        if self.selected is not None and self.top <= self.selected < self.top + self.rows:
+            self.listbox.selection_set(self.selected - self.top)
+
+        if self.items:
+            self.scrollbar.set(self.top / len(self.items), (self.top + len(visible)) / len(self.items))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _on_listbox_select(self, event):
+        rows = self.listbox.curselection()
+        if not rows:
+            return
+        self.selected = self.top + rows[0]
+        if self.on_select is not None:
+            self.on_select(self.items[self.selected])
+
+
+class Autocomplete:
+    """
+    Drop-down list of suggestions under an Entry, refreshed on every key press. Up/Down pick a suggestion, Return,
+    Tab or a click takes it, Escape closes the list.
+    """
+    # keys that move around or pick a suggestion rather than change the text
+    IGNORED_KEYS = {
+        "Up", "Down", "Left", "Right", "Home", "End", "Return", "KP_Enter", "Tab", "Escape",
+        "Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R",
+    }
+
+    def __init__(self, entry, suggest, separator=None, rows=6):
+        """
+        :param suggest: called with the text being typed, returns the list of suggestions
+        :param separator: for entries holding a list (e.g. "Ann, Bob"), only the text after the last separator is
+            completed
+        :param rows: most suggestions shown at once
+        """
+        self.entry = entry
+        self.suggest = suggest
+        self.separator = separator
+        self.rows = rows
+        self.shown = False
+        self.listbox = tk.Listbox(entry.master, height=rows, exportselection=False, takefocus=0)
+
+        entry.bind("<KeyRelease>", self._on_key_release, add="+")
+        entry.bind("<Down>", lambda e: self._move(1), add="+")
+        entry.bind("<Up>", lambda e: self._move(-1), add="+")
+        entry.bind("<Return>", self._on_accept_key, add="+")
+        entry.bind("<KP_Enter>", self._on_accept_key, add="+")
+        entry.bind("<Tab>", self._on_accept_key, add="+")
+        entry.bind("<Escape>", lambda e: self.hide(), add="+")
+        # a click on the list takes the focus from the entry first, so give the click time to land
+        entry.bind("<FocusOut>", lambda e: entry.after(200, self._hide_unless_focused), add="+")
+        self.listbox.bind("<<ListboxSelect>>", lambda e: self.accept())
+
+    def _split(self):
+        # (text kept as is, text being completed)
+        text = self.entry.get()
+        if self.separator and self.separator in text:
+            position = text.rindex(self.separator) + len(self.separator)
+            return text[:position], text[position:]
+        return "", text
+
+    def _on_key_release(self, event):
+        if event.keysym in self.IGNORED_KEYS:
+            return
+        self.refresh()
+
+    def refresh(self):
+        typed = self._split()[1].strip()
+        suggestions = self.suggest(typed) if typed else []
+        if not suggestions:
+            self.hide()
+            return
+        self.listbox.delete(0, tk.END)
+        self.listbox.insert(tk.END, *suggestions)
+        self.listbox.configure(height=min(self.rows, len(suggestions)))
+        if not self.shown:
+            self.listbox.place(in_=self.entry, x=0, rely=1.0, relwidth=1.0)
+            self.listbox.lift()
+            self.shown = True
+
+    def hide(self):
+        if self.shown:
+            self.listbox.place_forget()
+            self.shown = False
+
+    def _hide_unless_focused(self):
+        if self.entry.focus_get() not in (self.entry, self.listbox):
+            self.hide()
+
+    def _move(self, step: int):
+        if not self.shown:
+            return None
+        size = self.listbox.size()
+        selection = self.listbox.curselection()
+        if selection:
+            index = max(0, min(selection[0] + step, size - 1))
+        else:
+            index = 0 if step > 0 else size - 1
+        self.listbox.selection_clear(0, tk.END)
+        self.listbox.selection_set(index)
+        self.listbox.see(index)
+        return "break"
+
+    def _on_accept_key(self, event):
+        if not self.shown:
+            return None
+        self.accept()
+        return "break"
+
+    def accept(self):
+        """
+        Replace the text being typed with the selected suggestion (the first one if none is selected)
+        """
+        if not self.shown:
+            return
+        selection = self.listbox.curselection()
+        value = self.listbox.get(selection[0] if selection else 0)
+        kept = self._split()[0]
+        text = f"{kept} {value}" if kept else value
+        # through the variable when there is one, so its trace sees a single change
+        variable = str(self.entry.cget("textvariable"))
+        if variable:
+            self.entry.setvar(variable, text)
+        else:
+            self.entry.delete(0, tk.END)
+            self.entry.insert(0, text)
+        self.entry.icursor(tk.END)
+        self.hide()
+        self.entry.focus_set()
+
+
+class ThumbnailGrid(tk.Toplevel):
+    """
+    Contact sheet window. Like VirtualListbox, only the rows in view are drawn, and their thumbnails are loaded on
+    background threads as the rows scroll into view, so the grid opens instantly whatever the number of images.
+    """
+
+    def __init__(self, master, loader, on_select=None, on_close=None, columns=5, visible_rows=4, cell_size=170,
+                 workers=4, cache_mb=64):
+        """
+        :param loader: callable taking an item and returning its thumbnail (PIL image) or None; runs on a worker
+        :param on_select: called with the item of a clicked cell
+        :param on_close: called once the window was closed
+        """
+        super().__init__(master)
+        self.title("Thumbnails")
+        self.loader = loader
+        self.on_select = on_select
+        self.on_close = on_close
+        self.columns = columns
+        self.visible_rows = visible_rows
+        self.cell_size = cell_size
+
+        self.items = []
+        self.top_row = 0
+        self.photos = {}  # item -> PhotoImage of the cells in view (Tk drops images without a reference)
+        self.thumbnails = metacache.ImageCache(cache_mb * 1024 * 1024)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = {}  # item -> future of a queued or running thumbnail load
+        self.results = queue.Queue()
+        self.closed = False
+
+        self.count_label = tk.Label(self, text="")
+        self.canvas = tk.Canvas(
+            self, width=columns * cell_size, height=visible_rows * cell_size, bg="grey", highlightthickness=0
+        )
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+
+        self.count_label.grid(row=0, column=0, columnspan=2, sticky=tk.W)
+        self.canvas.grid(row=1, column=0, sticky=tk.NSEW)
+        self.scrollbar.grid(row=1, column=1, sticky=tk.NS)
+
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1, "units"))
+        self.canvas.bind("<Button-4>", lambda e: self.scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.scroll(1, "units"))
+        self.bind("<Prior>", lambda e: self.scroll(-1, "pages"))
+        self.bind("<Next>", lambda e: self.scroll(1, "pages"))
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.after(50, self._poll_results)
+
+    def row_count(self) -> int:
+        return (len(self.items) + self.columns - 1) // self.columns
+
+    def set_items(self, items):
+        """
+        Show a new list of items; the list is referenced, not copied
+        """
+        self.items = items
+        self.top_row = max(0, min(self.top_row, self.row_count() - self.visible_rows))
+        self.count_label.configure(text=f"{len(items)} images")
+        self._redraw()
+
+    def scroll(self, number: int, what: str):
+        step = self.visible_rows if what == "pages" else 1
+        self._scroll_to(self.top_row + number * step)
+        return "break"
+
+    def yview(self, *args):
+        # scrollbar callback: ("moveto", fraction) or ("scroll", number, "units" | "pages")
+        if args[0] == "moveto":
+            self._scroll_to(int(float(args[1]) * self.row_count()))
+        elif args[0] == "scroll":
+            self.scroll(int(args[1]), args[2])
+
+    def close(self):
+        self.closed = True
+        for future in self.futures.values():
+            future.cancel()
+        self.executor.shutdown(wait=False)
+        self.destroy()
+        if self.on_close is not None:
+            self.on_close()
+
+    def _scroll_to(self, top_row: int):
+        top_row = max(0, min(top_row, self.row_count() - self.visible_rows))
+        if top_row != self.top_row:
+            self.top_row = top_row
+            self._redraw()
+
+    def _visible_items(self):
+        first = self.top_row * self.columns
+        return self.items[first:first + self.visible_rows * self.columns]
+
+    def _redraw(self):
+        self.canvas.delete("all")
+        visible = self._visible_items()
+        photos = {}
+        for position, item in enumerate(visible):
+            x = (position % self.columns) * self.cell_size
+            y = (position // self.columns) * self.cell_size
+            center_x = x + self.cell_size // 2
+            self.canvas.create_rectangle(x + 2, y + 2, x + self.cell_size - 2, y + self.cell_size - 2, outline="")
+            self.canvas.create_text(
+                center_x, y + self.cell_size - 8, text=str(item)[-24:], fill="yellow", font=("Helvetica", 8)
+            )
+            photo = self.photos.get(item)
+            if photo is None:
+                thumbnail = self.thumbnails.get(item)
+                if thumbnail is not None:
+                    photo = ImageTk.PhotoImage(thumbnail)
+            if photo is not None:
+                photos[item] = photo
+                self.canvas.create_image(center_x, y + (self.cell_size - 14) // 2, image=photo)
+        self.photos = photos
+
+        rows = self.row_count()
+        if rows:
+            self.scrollbar.set(self.top_row / rows, min(1.0, (self.top_row + self.visible_rows) / rows))
+        else:
+            self.scrollbar.set(0, 1)
+        self._request_thumbnails(visible)
+
+    def _request_thumbnails(self, visible):
+        # drop queued loads of cells that scrolled out of view before they started
+        wanted = set(visible)
+        for item, future in list(self.futures.items()):
+            if item not in wanted and future.cancel():
+                del self.futures[item]
+        for item in visible:
+            if item not in self.photos and item not in self.futures and item not in self.thumbnails:
+                future = self.executor.submit(self.loader, item)
+                future.add_done_callback(lambda f, item=item: self.results.put((item, f)))
+                self.futures[item] = future
+
+    def _poll_results(self):
+        if self.closed:
+            return
+        loaded = False
+        while True:
+            try:
+                item, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+            # a load cancelled while scrolling may report after a newer load of the same item was submitted
+            if self.futures.get(item) is future:
+                del self.futures[item]
+            if future.cancelled() or future.exception() is not None:
+                continue
+            thumbnail = future.result()
+            if thumbnail is not None:
+                self.thumbnails.put(item, thumbnail)
+                loaded = True
+        if loaded:
+            self._redraw()
+        self.after(50, self._poll_results)
+
+    def _on_click(self, event):
+        column = int(event.x) // self.cell_size
+        row = int(event.y) // self.cell_size
+        if column >= self.columns:
+            return
+        index = (self.top_row + row) * self.columns + column
+        if index < len(self.items) and self.on_select is not None:
+            self.on_select(self.items[index])
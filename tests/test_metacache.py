@@ -0,0 +1,40 @@
+import io
+import os
+import random
+import tempfile
+import unittest
+
+from PIL import Image
+
+import metacache
+import metaexif
+
+
+class ThumbnailKeyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "a.jpg")
+        # noise, so the image data is not much smaller than the description
+        noise = random.Random(0)
+        image = Image.new("RGB", (64, 48))
+        image.putdata([tuple(noise.randrange(256) for _ in range(3)) for _ in range(64 * 48)])
+        out = io.BytesIO()
+        image.save(out, "JPEG")
+        with open(self.path, "wb") as f:
+            f.write(out.getvalue())
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key_survives_description_edits(self):
+        cache = metacache.ThumbnailCache(self.tmp.name)
+        metaexif.write_image_description(self.path, {"location": "Nice"})
+        key = cache.key(self.path, 1)
+        metaexif.write_image_description(self.path, {"location": "Nice", "comment": "a longer comment " * 40})
+        self.assertLess(os.path.getsize(self.path), metacache.THUMBNAIL_KEY_BYTES)
+        self.assertEqual(key, cache.key(self.path, 1))
+        self.assertNotEqual(key, cache.key(self.path, 6))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import io
+import os
+import tempfile
+import unittest
+
+import piexif
+from PIL import Image
+
+import metacore
+import metaexif
+
+
+def write_jpeg(path: str, description: bytes):
+    out = io.BytesIO()
+    exif_bytes = piexif.dump({"0th": {piexif.ImageIFD.ImageDescription: description}})
+    Image.new("RGB", (32, 24), "gray").save(out, "JPEG", exif=exif_bytes)
+    with open(path, "wb") as f:
+        f.write(out.getvalue())
+
+
+class LibraryWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        write_jpeg(os.path.join(self.root, "a.jpg"), b'{"location": "Nice"}')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def embedded(self):
+        return metaexif.parse_image_description(metaexif.read_image_description(os.path.join(self.root, "a.jpg")))
+
+    def check_people(self, store_kind, edit):
+        with metacore.Library(self.root, store_kind) as library:
+            library.scan()
+            library.index(pool="thread", hash_images=False)
+            edit(library)
+            self.assertEqual(["Ann", "Bob"], library.read("a.jpg")["people"])
+            self.assertEqual("Nice", library.read("a.jpg")["location"])
+            self.assertEqual({"Ann", "Bob"}, library.records["a.jpg"]["people"])
+            if not store_kind:
+                self.assertEqual(["Ann", "Bob"], self.embedded()["people"])
+
+    def test_write_people_as_text(self):
+        for store_kind in ("", "sidecar"):
+            with self.subTest(store_kind=store_kind):
+                self.check_people(store_kind, lambda library: library.write("a.jpg", {"people": "Ann, , Bob "}))
+
+    def test_write_people_as_list(self):
+        for store_kind in ("", "sidecar"):
+            with self.subTest(store_kind=store_kind):
+                self.check_people(store_kind, lambda library: library.write("a.jpg", {"people": [" Ann", "Bob"]}))
+
+    def test_save_people_as_text(self):
+        self.check_people("", lambda library: library.save("a.jpg", {"location": "Nice", "people": "Ann,Bob"}))
+
+
+class LibraryDuplicatesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        for name in ("a.jpg", "b.jpg"):
+            write_jpeg(os.path.join(self.root, name), b'{"location": "Nice"}')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_hashed_on_first_use(self):
+        with metacore.Library(self.root) as library:
+            library.scan()
+            library.index(pool="thread")
+            self.assertEqual(0, len(library.image_hashes))
+            self.assertEqual([["a.jpg", "b.jpg"]], library.duplicate_groups())
+        with metacore.Library(self.root) as library:
+            library.scan()
+            library.index(pool="thread")
+            # the hashes were kept in the on-disk index
+            self.assertEqual(2, len(library.image_hashes))
+            self.assertEqual([], library.unhashed_images())
+
+
+if __name__ == "__main__":
+    unittest.main()
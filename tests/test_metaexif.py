@@ -0,0 +1,45 @@
+import io
+import os
+import tempfile
+import unittest
+
+import piexif
+from PIL import Image
+
+import metaexif
+
+
+def make_jpeg(description: bytes) -> bytes:
+    out = io.BytesIO()
+    exif_bytes = piexif.dump({"0th": {piexif.ImageIFD.ImageDescription: description}})
+    Image.new("RGB", (32, 24), "gray").save(out, "JPEG", exif=exif_bytes)
+    return out.getvalue()
+
+
+class TruncatedFileTest(unittest.TestCase):
+    def test_truncated_exif_raises_value_error(self):
+        data = make_jpeg(b'{"location": "Nice"}')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "a.jpg")
+            # every cut through the markers, the TIFF header and IFD0
+            for length in range(data.index(b"Nice") + 8):
+                with open(path, "wb") as f:
+                    f.write(data[:length])
+                try:
+                    metaexif.read_image_description(path)
+                    metaexif.read_exif_thumbnail(path)
+                except ValueError:
+                    pass
+
+    def test_complete_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "a.jpg")
+            with open(path, "wb") as f:
+                f.write(make_jpeg(b'{"location": "Nice"}'))
+            self.assertEqual({"location": "Nice"}, metaexif.parse_image_description(
+                metaexif.read_image_description(path)
+            ))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+
+import metaexport
+
+
+def write_file(path: str, data: bytes = b"\xff\xd8\xff\xd9"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class ExportFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pictures = self.tmp.name
+        self.root = os.path.join(self.pictures, "family")
+        self.paths = [os.path.join("1960", "a.jpg"), os.path.join("1970", "b.jpg")]
+        for path in self.paths:
+            write_file(os.path.join(self.root, path))
+        self.unrelated = os.path.join(self.pictures, "other", "important.txt")
+        write_file(self.unrelated, b"keep me")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def assert_untouched(self):
+        for path in self.paths:
+            self.assertTrue(os.path.exists(os.path.join(self.root, path)))
+        self.assertTrue(os.path.exists(self.unrelated))
+
+    def test_refuses_destination_containing_the_library(self):
+        for dest in (self.pictures, self.root):
+            with self.assertRaises(metaexport.ExportError):
+                list(metaexport.export_files(self.root, self.paths, dest))
+        self.assert_untouched()
+
+    def test_prunes_only_files_it_exported(self):
+        dest = os.path.join(self.pictures, "export")
+        stray = os.path.join(dest, "notes.txt")
+        write_file(stray, b"not an export")
+
+        results = list(metaexport.export_files(self.root, self.paths, dest))
+        self.assertEqual(["copied", "copied"], [result["status"] for result in results])
+
+        results = list(metaexport.export_files(self.root, self.paths[:1], dest))
+        self.assertEqual(["skipped"], [result["status"] for result in results])
+        self.assertTrue(os.path.exists(os.path.join(dest, self.paths[0])))
+        self.assertFalse(os.path.exists(os.path.join(dest, self.paths[1])))
+        self.assertFalse(os.path.exists(os.path.join(dest, "1970")))
+        self.assertTrue(os.path.exists(stray))
+        self.assert_untouched()
+
+    def test_destination_inside_the_library(self):
+        dest = os.path.join(self.root, "filtered_images")
+        list(metaexport.export_files(self.root, self.paths, dest))
+        # the exported copies are not exported again, and survive the next export
+        results = list(metaexport.export_files(self.root, self.paths + [os.path.join(dest, self.paths[0])], dest))
+        self.assertEqual(["skipped", "skipped"], [result["status"] for result in results])
+        self.assert_untouched()
+
+
+if __name__ == "__main__":
+    unittest.main()
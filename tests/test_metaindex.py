@@ -0,0 +1,19 @@
+import unittest
+
+import metaindex
+
+
+class RecordFromDescriptionTest(unittest.TestCase):
+    def test_people_without_blanks(self):
+        record = metaindex.record_from_description({"people": "Ann, , Bob "})
+        self.assertEqual({"Ann", "Bob"}, record["people"])
+        record = metaindex.record_from_description({"people": [" Ann", "", None, "Bob"]})
+        self.assertEqual({"Ann", "Bob"}, record["people"])
+
+    def test_values_that_are_not_text(self):
+        record = metaindex.record_from_description({"date": 1962, "location": None, "people": 7})
+        self.assertEqual({"date": "1962", "people": {"7"}}, record)
+
+
+if __name__ == "__main__":
+    unittest.main()